@@ -1,10 +1,122 @@
 import numpy as np
 from scipy import signal
-import librosa
+import librosa, os, math, logging
+from functools import lru_cache
+from typing import Optional
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+try:
+    import soxr
+except ImportError:
+    soxr = None
+try:
+    import torchaudio
+except ImportError:
+    torchaudio = None
+
+
+def Soundfile_Decode(path, offset, duration):
+    with soundfile.SoundFile(path) as f:
+        sample_rate = f.samplerate
+        if offset > 0.0:
+            f.seek(int(round(offset * sample_rate)))
+        audio = f.read(
+            frames= -1 if duration is None else int(round(duration * sample_rate)),
+            dtype= 'float32',
+            always_2d= True
+            )
+
+    return audio.mean(axis= 1), sample_rate
+
+def Torchaudio_Decode(path, offset, duration):
+    sample_rate = torchaudio.info(path).sample_rate
+    audio, sample_rate = torchaudio.load(
+        path,
+        frame_offset= int(round(offset * sample_rate)),
+        num_frames= -1 if duration is None else int(round(duration * sample_rate))
+        )
+
+    return audio.mean(dim= 0).numpy(), sample_rate
+
+def Librosa_Decode(path, offset, duration):
+    '''
+    audioread fallback. This is the slowest, but it decodes every format of ffmpeg.
+    '''
+    return librosa.load(path, sr= None, mono= True, offset= offset, duration= duration)
+
+# The decoders are tried in this order. libsndfile decodes wav, flac, ogg/opus, and mp3 in process without seeking from the start.
+decoder_dict = {
+    'soundfile': None if soundfile is None else Soundfile_Decode,
+    'torchaudio': None if torchaudio is None else Torchaudio_Decode,
+    'librosa': Librosa_Decode
+    }
+decoder_order_dict = {
+    '.M4A': ['torchaudio', 'librosa'],  # libsndfile does not support mp4 container.
+    '.AAC': ['torchaudio', 'librosa'],
+    }
+unavailable_decoder_dict = {}   # Extension -> decoders which cannot decode the format at all. A decode error of a file does not add a decoder.
+soundfile_format_dict = {   # The extensions whose libsndfile format has another name.
+    '.OPUS': 'OGG',
+    '.OGA': 'OGG',
+    '.AIF': 'AIFF',
+    }
+
+def Decoder_Available(name: str, extension: str):
+    if name == 'soundfile':
+        # libsndfile lists its formats, so an unsupported extension is not tried on every file.
+        return soundfile_format_dict.get(extension, extension[1:]) in soundfile.available_formats().keys()
+    return True
+
+def Resample(audio: np.ndarray, source_sample_rate: int, target_sample_rate: int):
+    '''
+    soxr HQ when it is installed, otherwise the polyphase resampler of scipy.
+    '''
+    if source_sample_rate == target_sample_rate:
+        return audio
+    if not soxr is None:
+        return soxr.resample(audio, source_sample_rate, target_sample_rate, quality= 'HQ')
+
+    gcd = math.gcd(source_sample_rate, target_sample_rate)
+    return signal.resample_poly(audio, target_sample_rate // gcd, source_sample_rate // gcd).astype(audio.dtype)
+
+def Audio_Load(path: str, sample_rate: int, offset: float= 0.0, duration: Optional[float]= None):
+    '''
+    Returns mono float32 audio of sample_rate like librosa.load(path, sr= sample_rate).
+    offset, duration: The window in seconds. Only the window is decoded when the decoder supports seeking.
+    '''
+    extension = os.path.splitext(path)[1].upper()
+    if not extension in unavailable_decoder_dict.keys():
+        unavailable_decoder_dict[extension] = {
+            name
+            for name, decoder in decoder_dict.items()
+            if not decoder is None and not Decoder_Available(name, extension)
+            }
+    decoder_names = [
+        name
+        for name in decoder_order_dict.get(extension, ['soundfile', 'torchaudio', 'librosa'])
+        if not decoder_dict[name] is None and not name in unavailable_decoder_dict[extension]
+        ]
+
+    for name in decoder_names:
+        try:
+            audio, source_sample_rate = decoder_dict[name](path, offset, duration)
+            break
+        except Exception as e:
+            if name == decoder_names[-1]:
+                raise
+            logging.warning('{} decoder failed on \'{}\', so the next decoder is tried: {}'.format(name, path, e))
+            if isinstance(e, (ImportError, AttributeError, NotImplementedError)) and name != 'librosa':
+                # The backend itself is missing, like a torchaudio without its ffmpeg or torchcodec or the removed info API, so it fails on every file.
+                unavailable_decoder_dict[extension].add(name)
+
+    return Resample(audio.astype(np.float32), source_sample_rate, sample_rate)
 
 
 def Audio_Prep(path, sample_rate, trim_top_db= 60):
-    audio = librosa.load(path, sr= sample_rate)[0]
+    audio = Audio_Load(path, sample_rate)
     audio = librosa.effects.trim(audio, top_db=trim_top_db, frame_length= 512, hop_length= 256)[0]
     audio = librosa.util.normalize(audio)
 
@@ -34,8 +146,7 @@ def Mel_Generate(
         win_length= window_length
         ))
 
-    mel_filter = librosa.filters.mel(sr= sample_rate, n_fft= n_fft, n_mels= num_mel, fmin= mel_fmin, fmax= mel_fmax)
-    magnitude = mel_filter @ magnitude
+    magnitude = Mel_Filter(sample_rate, n_fft, num_mel, mel_fmin, mel_fmax) @ magnitude
     
     db = 20 * np.log10(magnitude + 1e-7)
     mel = np.clip(
@@ -47,6 +158,13 @@ def Mel_Generate(
     return mel 
 
 
+@lru_cache(maxsize= None)
+def Mel_Filter(sample_rate, n_fft, num_mel, mel_fmin, mel_fmax):
+    mel_filter = librosa.filters.mel(sr= sample_rate, n_fft= n_fft, n_mels= num_mel, fmin= mel_fmin, fmax= mel_fmax)
+    mel_filter.flags.writeable = False  # The cached filter is shared by every call.
+
+    return mel_filter
+
 def Preemphasis(audio, pre_emphasis = 0.97):
     return signal.lfilter([1.0, -pre_emphasis], [1.0], audio)
 
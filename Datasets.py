@@ -1,13 +1,15 @@
 from argparse import Namespace
 import torch
 import numpy as np
-import pickle, os, logging, librosa
+import pickle, os, logging, librosa, tarfile
 from typing import Dict, List, Optional
-import functools
 from encodec import EncodecModel
 
-from Pattern_Generator import Text_Filtering, Phonemize
-from Modules.Nvidia_Alignment_Learning_Framework import Attention_Prior_Generator
+from Pattern_Generator import Text_Filtering, Phonemize, Phonemizer_Service
+from Audio import Audio_Load
+from Pattern_Store import Pattern_Store, Config_Hash
+from Pattern_Cache import Pattern_Cache, Pattern_Cache_Name
+from Metadata_Index import Metadata_Index_Load
      
 def Text_to_Token(text: str, token_dict: Dict[str, int]):
     return np.array([
@@ -15,47 +17,91 @@ def Text_to_Token(text: str, token_dict: Dict[str, int]):
         for letter in ['<S>'] + list(text) + ['<E>']
         ], dtype= np.int32)
 
-def Token_Stack(tokens: List[np.ndarray], token_dict, max_length: Optional[int]= None):
+def Token_Stack(tokens: List[np.ndarray], token_dict, max_length: Optional[int]= None, pin_memory: bool= False):
+    '''
+    The stacks write the items into one preallocated tensor of the final dtype instead of padding each item.
+    '''
     max_token_length = max_length or max([token.shape[0] for token in tokens])
-    tokens = np.stack(
-        [np.pad(token, [0, max_token_length - token.shape[0]], constant_values= token_dict['<E>']) for token in tokens],
-        axis= 0
-        )
-    return tokens
+    stacked = torch.full((len(tokens), max_token_length), token_dict['<E>'], dtype= torch.long, pin_memory= pin_memory)
+    buffer = stacked.numpy()
+    for index, token in enumerate(tokens):
+        buffer[index, :token.shape[0]] = token
 
-def Latent_Stack(latents: List[np.ndarray], max_length: Optional[int]= None):
+    return stacked
+
+def Latent_Stack(latents: List[np.ndarray], max_length: Optional[int]= None, pin_memory: bool= False, dtype: torch.dtype= torch.long):
     max_latent_length = max_length or max([latent.shape[1] for latent in latents])
-    latents = np.stack(
-        [np.pad(latent, [[0, 0], [0, max_latent_length - latent.shape[1]]], constant_values= 0) for latent in latents],
-        axis= 0
-        )
-    return latents
+    stacked = torch.zeros((len(latents), latents[0].shape[0], max_latent_length), dtype= dtype, pin_memory= pin_memory)
+    buffer = stacked.numpy()
+    for index, latent in enumerate(latents):
+        buffer[index, :, :latent.shape[1]] = latent
+
+    return stacked
 
-def F0_Stack(f0s: List[np.ndarray], max_length: int= None):
+def F0_Stack(f0s: List[np.ndarray], max_length: int= None, pin_memory: bool= False):
     max_f0_length = max_length or max([f0.shape[0] for f0 in f0s])
-    f0s = np.stack(
-        [np.pad(f0, [0, max_f0_length - f0.shape[0]], constant_values= 0.0) for f0 in f0s],
-        axis= 0
-        )
-    return f0s
+    stacked = torch.zeros((len(f0s), max_f0_length), dtype= torch.float, pin_memory= pin_memory)
+    buffer = stacked.numpy()
+    for index, f0 in enumerate(f0s):
+        buffer[index, :f0.shape[0]] = f0
+
+    return stacked
 
-def Mel_Stack(mels: List[np.ndarray], max_length: Optional[int]= None):
+def Mel_Stack(mels: List[np.ndarray], max_length: Optional[int]= None, pin_memory: bool= False):
+    '''
+    The padding is the minimum of each mel. The padding is infinity at first, so the minimums are one reduction of the batch.
+    '''
     max_mel_length = max_length or max([mel.shape[1] for mel in mels])
-    mels = np.stack(
-        [np.pad(mel, [[0, 0], [0, max_mel_length - mel.shape[1]]], constant_values= mel.min()) for mel in mels],
-        axis= 0
-        )
-    return mels
-
-def Attention_Prior_Stack(attention_priors: List[np.ndarray], max_token_length: int, max_latent_length: int):
-    attention_priors_padded = np.zeros(
-        shape= (len(attention_priors), max_latent_length, max_token_length),
-        dtype= np.float32
-        )    
-    for index, attention_prior in enumerate(attention_priors):
-        attention_priors_padded[index, :attention_prior.shape[0], :attention_prior.shape[1]] = attention_prior
-
-    return attention_priors_padded
+    stacked = torch.full((len(mels), mels[0].shape[0], max_mel_length), np.inf, dtype= torch.float, pin_memory= pin_memory)
+    buffer = stacked.numpy()
+    for index, mel in enumerate(mels):
+        buffer[index, :, :mel.shape[1]] = mel
+    np.copyto(buffer, buffer.min(axis= (1, 2), keepdims= True), where= np.isinf(buffer))
+
+    return stacked
+
+def Speech_Prompt_Gather(latents: torch.Tensor, speech_prompt_offsets: torch.Tensor, speech_prompt_length: int):
+    '''
+    Crops the speech prompts of the collater offsets on the device of the latents.
+    latents: [Batch, Latent_d, Latent_t]
+    speech_prompt_offsets: [Batch, 2]. The offsets of the speech prompt, and of the prompt for diffusion in the latent without the speech prompt.
+    Returns the speech prompts and the speech prompts for diffusion: [Batch, Latent_d, Prompt_t]
+    '''
+    speech_prompt_offsets = speech_prompt_offsets.to(latents.device)
+    steps = torch.arange(speech_prompt_length, device= latents.device)[None]
+    indices = speech_prompt_offsets[:, 0:1] + steps  # [Batch, Prompt_t]
+    indices_for_diffusion = speech_prompt_offsets[:, 1:2] + steps
+    indices_for_diffusion = indices_for_diffusion + (indices_for_diffusion >= speech_prompt_offsets[:, 0:1]) * speech_prompt_length    # Skip the speech prompt.
+
+    speech_prompts = latents.gather(2, indices[:, None].expand(-1, latents.size(1), -1))
+    speech_prompts_for_diffusion = latents.gather(2, indices_for_diffusion[:, None].expand(-1, latents.size(1), -1))
+
+    return speech_prompts, speech_prompts_for_diffusion
+
+def Pattern_Decode(
+    pattern_dict: Dict,
+    token_dict: Dict[str, int],
+    f0_info_dict: Dict[str, Dict[str, float]],
+    use_between_padding: bool
+    ):
+    '''
+    Returns token, latent, normalized f0, and mel of a pattern dict.
+    '''
+    speaker = pattern_dict['Speaker']
+
+    if use_between_padding:
+        # padding between tokens
+        token = ['<P>'] * (len(pattern_dict['Pronunciation']) * 2 - 1)
+        token[0::2] = pattern_dict['Pronunciation']
+    else:
+        token = pattern_dict['Pronunciation']
+    token = Text_to_Token(token, token_dict)
+
+    f0 = pattern_dict['F0']
+    f0 = np.where(f0 != 0.0, (f0 - f0_info_dict[speaker]['Mean']) / f0_info_dict[speaker]['Std'], 0.0)
+    f0 = np.clip(f0, -3.0, 3.0)
+
+    return token, pattern_dict['Latent'], f0, pattern_dict['Mel']
 
 class Dataset(torch.utils.data.Dataset):
     def __init__(
@@ -69,79 +115,453 @@ class Dataset(torch.utils.data.Dataset):
         latent_length_max: int,
         text_length_min: int,
         text_length_max: int,
-        accumulated_dataset_epoch: int= 1,
-        augmentation_ratio: float= 0.0,
-        use_pattern_cache: bool= False
+        pattern_cache_size: int= 0,
+        pattern_cache_directory: Optional[str]= None,
+        pattern_store_path: Optional[str]= None,
+        use_continuous_latent: bool= False
         ):
+        '''
+        pattern_cache_size: The byte budget of the decoded patterns shared by the DataLoader workers and the ranks on a node. 0 is not to cache.
+        pattern_cache_directory: The directory of the shared cache file. /dev/shm on Linux when it is None.
+        pattern_store_path: When it is given, the patterns in the store are read by memmap instead of the pickles.
+        use_continuous_latent: When it is True, the float16 continuous latents of the store are also returned. Every pattern must be in the store.
+        '''
         super().__init__()
         self.token_dict = token_dict
         self.f0_info_dict = f0_info_dict
         self.use_between_padding = use_between_padding
         self.pattern_path = pattern_path
-
-        self.attention_prior_generator = Attention_Prior_Generator()
-
-        metadata_dict = pickle.load(open(
-            os.path.join(pattern_path, metadata_file).replace('\\', '/'), 'rb'
-            ))
-        
-        self.patterns = []
-        max_pattern_by_speaker = max([
-            len(patterns)
-            for patterns in metadata_dict['File_List_by_Speaker_Dict'].values()
-            ])
-        for patterns in metadata_dict['File_List_by_Speaker_Dict'].values():
-            ratio = float(len(patterns)) / float(max_pattern_by_speaker)
-            if ratio < augmentation_ratio:
-                patterns *= int(np.ceil(augmentation_ratio / ratio))
-            self.patterns.extend(patterns)
-
-        self.patterns = [
-            x for x in self.patterns
-            if all([
-                metadata_dict['Latent_Length_Dict'][x] >= latent_length_min,
-                metadata_dict['Latent_Length_Dict'][x] <= latent_length_max,
-                metadata_dict['Text_Length_Dict'][x] >= text_length_min,
-                metadata_dict['Text_Length_Dict'][x] <= text_length_max
-                ])
-            ] * accumulated_dataset_epoch
-
-        if use_pattern_cache:
-            self.Pattern_LRU_Cache = functools.lru_cache(maxsize= None)(self.Pattern_LRU_Cache)
+        self.use_continuous_latent = use_continuous_latent
+
+        self.pattern_store = None
+        if not pattern_store_path is None:
+            self.pattern_store = Pattern_Store(pattern_store_path)
+            self.pattern_store.Check(token_dict, f0_info_dict, use_between_padding)
+        if use_continuous_latent and (self.pattern_store is None or not self.pattern_store.has_continuous_latent):
+            raise ValueError('The continuous latents need the pattern store generated with Continuous_Latent.')
+
+        # The patterns are the rows of the metadata index. Python lists of paths are not kept, so the worker memory does not grow by the copy-on-write.
+        self.metadata_index = Metadata_Index_Load(pattern_path, metadata_file)
+
+        # Each row is once. The augmentation and the accumulated epochs are by the weights of Weighted_Sampler.
+        rows = np.arange(len(self.metadata_index), dtype= np.int32)
+        self.patterns = rows[self.metadata_index.Length_Mask(latent_length_min, latent_length_max, text_length_min, text_length_max)]
+
+        if not self.pattern_store is None:
+            missing_count = sum([not self.metadata_index.Path(row) in self.pattern_store for row in self.patterns])
+            if missing_count > 0 and use_continuous_latent:
+                raise ValueError('{} patterns are not in the pattern store. The continuous latents are not in the pickles. Regenerate the store.'.format(missing_count))
+            elif missing_count > 0:
+                logging.warning('{} patterns are not in the pattern store. They are read from the pickles.'.format(missing_count))
+
+        self.pattern_cache = None
+        if pattern_cache_size > 0:
+            # The regenerated metadata or store has new modified times, so the cache of the old patterns is not used.
+            data_key = (
+                os.path.abspath(pattern_path),
+                metadata_file,
+                os.stat(os.path.join(pattern_path, metadata_file)).st_mtime_ns,
+                Config_Hash(token_dict, f0_info_dict, use_between_padding),
+                None if self.pattern_store is None else (
+                    self.pattern_store.codec,
+                    os.stat(os.path.join(self.pattern_store.store_path, 'INDEX.NPZ')).st_mtime_ns
+                    ),
+                use_continuous_latent
+                )
+            self.pattern_cache = Pattern_Cache(
+                name= Pattern_Cache_Name(*data_key),
+                capacity= pattern_cache_size,
+                pattern_count= len(self.metadata_index),
+                directory= pattern_cache_directory,
+                data_key= data_key
+                )
     
     def __getitem__(self, idx):
         '''
         compressed latent is for diffusion.
         non-compressed latent is for speech prompt.        
         '''
-        path = os.path.join(self.pattern_path, self.patterns[idx]).replace('\\', '/')
-        token, latent, f0, mel = self.Pattern_LRU_Cache(path)
-        
-        attention_prior = self.attention_prior_generator.get_prior(latent.shape[1], token.shape[0])
-
-        return token, latent, f0, mel, attention_prior
+        row = self.patterns[idx]
+        pattern = None if self.pattern_cache is None else self.pattern_cache.Get(row)
+        if pattern is None:
+            pattern = self.Pattern_Load(self.metadata_index.Path(row))
+            if not self.pattern_cache is None:
+                self.pattern_cache.Put(row, pattern)
+        return pattern
     
-    def Pattern_LRU_Cache(self, path: str):
+    def Pattern_Load(self, file: str):
+        if not self.pattern_store is None and file in self.pattern_store:
+            columns = ['Token', 'Latent', 'F0', 'Mel'] + (['Continuous_Latent'] if self.use_continuous_latent else [])
+            column_dict = self.pattern_store.Get(file, columns= tuple(columns))
+            return tuple([np.asarray(column_dict[column]) for column in columns])
+
+        path = os.path.join(self.pattern_path, file).replace('\\', '/')
         pattern_dict = pickle.load(open(path, 'rb'))
-        speaker = pattern_dict['Speaker']
-        
-        if self.use_between_padding:
-            # padding between tokens
-            token = ['<P>'] * (len(pattern_dict['Pronunciation']) * 2 - 1)
-            token[0::2] = pattern_dict['Pronunciation']
-        else:
-            token = pattern_dict['Pronunciation']
-        token = Text_to_Token(token, self.token_dict)
 
-        f0 = pattern_dict['F0']
-        f0 = np.where(f0 != 0.0, (f0 - self.f0_info_dict[speaker]['Mean']) / self.f0_info_dict[speaker]['Std'], 0.0)
-        f0 = np.clip(f0, -3.0, 3.0)
+        return Pattern_Decode(pattern_dict, self.token_dict, self.f0_info_dict, self.use_between_padding)
 
-        return token, pattern_dict['Latent'], f0, pattern_dict['Mel']
+    def Lengths(self):
+        '''
+        Returns the latent and token lengths of the patterns for the length bucketing.
+        '''
+        latent_lengths = self.metadata_index.latent_lengths[self.patterns]
+        pronunciation_lengths = self.metadata_index.pronunciation_lengths[self.patterns]
+        token_lengths = (pronunciation_lengths * 2 - 1 if self.use_between_padding else pronunciation_lengths) + 2  # '<S>' and '<E>'
+
+        return latent_lengths, token_lengths
+
+    def Speaker_Weights(self, augmentation_ratio: float= 0.0):
+        '''
+        Returns the sampling weight of each pattern.
+        The patterns of a speaker whose pattern count is less than augmentation_ratio x the count of the largest speaker
+        are weighted by ceil(augmentation_ratio / ratio), same to the repeats of the previous list duplication.
+        The counts are of the metadata before the length filter.
+        '''
+        speaker_counts = np.bincount(self.metadata_index.speaker_ids, minlength= len(self.metadata_index.speakers))
+        speaker_ratios = speaker_counts / speaker_counts.max()
+        speaker_weights = np.where(
+            (speaker_ratios > 0.0) & (speaker_ratios < augmentation_ratio),
+            np.ceil(augmentation_ratio / np.maximum(speaker_ratios, 1e-7)),
+            1.0
+            )
+
+        return speaker_weights[self.metadata_index.speaker_ids[self.patterns]]
 
     def __len__(self):
         return len(self.patterns)    
 
+def Weighted_Draw(random: np.random.RandomState, weights: np.ndarray, count: int):
+    '''
+    Draws count indices without replacement from the multiset where index i has count x weights[i] / sum(weights) copies.
+    Each index gets the whole copies, and the fractions are drawn by systematic sampling over a random order,
+    so a pattern is repeated in an epoch only by its weight and every pattern of weight count / sum(weights) or more is drawn.
+    Returns the indices in a random order.
+    '''
+    copies = weights.astype(np.float64) * (count / weights.sum())
+    whole_copies = np.floor(copies).astype(np.int64)
+    order = random.permutation(weights.shape[0])
+    cumulative_fractions = np.cumsum(copies[order] - whole_copies[order])
+    # Each fraction is below 1, so one point falls in it at most and its probability is the fraction.
+    points = random.random_sample() + np.arange(count - whole_copies.sum())
+    drawn = order[np.minimum(np.searchsorted(cumulative_fractions, points, side= 'right'), weights.shape[0] - 1)]
+    indices = np.concatenate([np.repeat(np.arange(weights.shape[0]), whole_copies), drawn])
+
+    return indices[random.permutation(indices.shape[0])]
+
+def Rank_Shards(weights: np.ndarray, num_replicas: int, seed: int):
+    '''
+    Splits the indices into num_replicas shards of the same weight sum by a seeded permutation.
+    Each rank draws from its shard by the weights, so the mixture over the ranks is same to the draws from all patterns.
+    '''
+    order = np.random.RandomState(seed).permutation(weights.shape[0])
+    cumulative_weights = np.cumsum(weights[order], dtype= np.float64)
+    bounds = np.searchsorted(cumulative_weights, cumulative_weights[-1] * np.arange(1, num_replicas) / num_replicas)
+    shards = np.split(order, bounds)
+    if any([shard.shape[0] == 0 for shard in shards]):
+        raise ValueError('There are fewer patterns ({}) than ranks ({}).'.format(weights.shape[0], num_replicas))
+
+    return [np.sort(shard) for shard in shards]
+
+class Weighted_Sampler(torch.utils.data.Sampler):
+    '''
+    Samples the patterns by the weights without replacement for a virtual epoch of num_samples by Weighted_Draw.
+    The speaker balancing and the epoch length do not need duplicated pattern lists.
+    The epoch is drawn once by the seed and epoch, and rank r takes the samples r::num_replicas after it is padded to a multiple of num_replicas like DistributedSampler.
+    A resumed epoch skips the consumed samples by start_index of set_epoch.
+    When rank_affine is True, each rank draws only from its home shard of Rank_Shards by its own random state,
+    so the pattern cache and the page cache of a node keep the patterns of its ranks.
+    The shards are split again every rebalance_interval epochs. 0 is never.
+    Call set_epoch before each epoch.
+    '''
+    def __init__(
+        self,
+        weights: np.ndarray,
+        num_samples: int,
+        num_replicas: int= 1,
+        rank: int= 0,
+        seed: int= 0,
+        rank_affine: bool= False,
+        rebalance_interval: int= 0
+        ):
+        if weights.shape[0] == 0 or weights.sum() <= 0.0:
+            raise ValueError('There is no pattern to sample.')
+        self.weights = weights
+        self.num_samples = num_samples
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.rank_affine = rank_affine and num_replicas > 1
+        self.rebalance_interval = rebalance_interval
+        self.epoch = 0
+        self.start_index = 0
+
+        self.shard, self.shard_seed = None, None
+
+    def set_epoch(self, epoch: int, start_index: int= 0):
+        '''
+        start_index: The number of the samples of this rank which are already consumed in the epoch. They are drawn but not yielded.
+        '''
+        self.epoch = epoch
+        self.start_index = start_index
+
+    def Shard(self):
+        '''
+        Returns the indices which this rank draws from.
+        '''
+        shard_seed = self.seed + (self.epoch // self.rebalance_interval if self.rebalance_interval > 0 else 0)
+        if self.shard_seed != shard_seed:
+            self.shard = Rank_Shards(self.weights, self.num_replicas, shard_seed)[self.rank]
+            self.shard_seed = shard_seed
+
+        return self.shard
+
+    def __iter__(self):
+        if not self.rank_affine:
+            # Every rank draws the same epoch by the seed and epoch.
+            indices = Weighted_Draw(np.random.RandomState([self.seed, self.epoch]), self.weights, self.num_samples)
+            indices = np.resize(indices, len(self) * self.num_replicas)[self.rank::self.num_replicas]
+        else:
+            shard = self.Shard()
+            indices = shard[Weighted_Draw(np.random.RandomState([self.seed, self.epoch, self.rank]), self.weights[shard], len(self))]
+
+        yield from indices[self.start_index:].tolist()
+
+    def __len__(self):
+        return int(np.ceil(self.num_samples / self.num_replicas))
+
+class Bucket_Batch_Sampler(torch.utils.data.Sampler):
+    '''
+    Batches of similar lengths by a frame budget instead of a fixed batch size.
+    The patterns are sorted by latent and token lengths with random tie breaking,
+    and cut greedily so that batch size x max latent length does not exceed frame_budget.
+    The padding of the latents, mels, F0s, and the attention priors, and the speech prompt cropping by the shortest pattern, are reduced.
+    When weights are given, the patterns of an epoch are num_samples draws without replacement by the weights like Weighted_Sampler instead of each pattern once.
+    The batches are shuffled. Rank r takes the batches r::num_replicas after the batch list is padded to a multiple of num_replicas like DistributedSampler.
+    When rank_affine is True, each rank batches only its home shard of Rank_Shards like Weighted_Sampler,
+    and the batch lists of the ranks are padded to the longest one.
+    Call set_epoch before each epoch. Its start_index skips the batches which are already consumed when an epoch is resumed.
+    '''
+    def __init__(
+        self,
+        latent_lengths: np.ndarray,
+        token_lengths: np.ndarray,
+        frame_budget: int,
+        max_batch_size: Optional[int]= None,
+        weights: Optional[np.ndarray]= None,
+        num_samples: Optional[int]= None,
+        num_replicas: int= 1,
+        rank: int= 0,
+        seed: int= 0,
+        rank_affine: bool= False,
+        rebalance_interval: int= 0
+        ):
+        self.latent_lengths = latent_lengths
+        self.token_lengths = token_lengths
+        self.frame_budget = frame_budget
+        self.max_batch_size = max_batch_size
+        self.weights = weights
+        self.num_samples = num_samples or latent_lengths.shape[0]
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.rank_affine = rank_affine and num_replicas > 1
+        self.rebalance_interval = rebalance_interval
+        self.epoch = 0
+        self.start_index = 0
+
+        self.batches, self.batches_epoch = None, None
+
+    def Batch_Sizes(self, sorted_latent_lengths: np.ndarray):
+        batch_sizes = []
+        batch_size = 0
+        for latent_length in sorted_latent_lengths:
+            if batch_size > 0 and ((batch_size + 1) * latent_length > self.frame_budget or batch_size == self.max_batch_size):
+                batch_sizes.append(batch_size)
+                batch_size = 0
+            batch_size += 1
+        if batch_size > 0:
+            batch_sizes.append(batch_size)
+
+        return batch_sizes
+
+    def Bucket(self, indices: np.ndarray, num_samples: int, random: np.random.RandomState):
+        '''
+        Returns the shuffled batches of the indices, or of num_samples draws from them when the sampler has weights.
+        '''
+        if not self.weights is None:
+            indices = indices[Weighted_Draw(random, self.weights[indices], num_samples)]
+        latent_lengths = self.latent_lengths[indices]
+        indices = indices[np.lexsort((random.rand(indices.shape[0]), self.token_lengths[indices], latent_lengths))]
+        batches = np.split(indices, np.cumsum(self.Batch_Sizes(np.sort(latent_lengths)))[:-1])
+
+        return [batches[index] for index in random.permutation(len(batches))]
+
+    def set_epoch(self, epoch: int, start_index: int= 0):
+        self.epoch = epoch
+        self.start_index = start_index
+
+    def Batches(self):
+        '''
+        Returns the batches of this rank in the epoch. Every rank has the same number of batches.
+        '''
+        if self.batches_epoch == self.epoch:
+            return self.batches
+
+        indices = np.arange(self.latent_lengths.shape[0])
+        if not self.rank_affine:
+            # Every rank gets the same batches by the seed and epoch.
+            batches = self.Bucket(indices, self.num_samples, np.random.RandomState(self.seed + self.epoch))
+            batch_order = np.resize(np.arange(len(batches)), int(np.ceil(len(batches) / self.num_replicas)) * self.num_replicas)
+            self.batches = [batches[index] for index in batch_order[self.rank::self.num_replicas]]
+        else:
+            # The batches of all ranks are made to know the longest one. The shards are disjoint, so this costs same to one bucketing of all patterns.
+            shard_seed = self.seed + (self.epoch // self.rebalance_interval if self.rebalance_interval > 0 else 0)
+            shards = Rank_Shards(np.ones_like(self.latent_lengths, dtype= np.float64) if self.weights is None else self.weights, self.num_replicas, shard_seed)
+            rank_batches = [
+                self.Bucket(shard, int(np.ceil(self.num_samples / self.num_replicas)), np.random.RandomState([self.seed, self.epoch, rank]))
+                for rank, shard in enumerate(shards)
+                ]
+            batches = rank_batches[self.rank]
+            self.batches = [batches[index] for index in np.resize(np.arange(len(batches)), max([len(x) for x in rank_batches]))]
+        self.batches_epoch = self.epoch
+
+        return self.batches
+
+    def __iter__(self):
+        for batch in self.Batches()[self.start_index:]:
+            yield batch.tolist()
+
+    def __len__(self):
+        return len(self.Batches())
+
+class Stream_Dataset(torch.utils.data.IterableDataset):
+    '''
+    Reads the tar shards of Pattern_Generator.py -tar sequentially instead of random pattern files.
+    The shards are split over the distributed ranks and the DataLoader workers without overlap,
+    and the patterns are shuffled by a bounded buffer. The samples are same to Dataset, so Collater is shared.
+    Every worker yields ceil(len / (ranks x workers)) samples in an epoch, so every rank has the same number of batches.
+    A worker with fewer samples repeats its shards like DistributedSampler pads, and a worker with more stops early.
+    Call set_epoch before each epoch to change the shard order and the shuffle.
+    When an epoch is resumed, the samples of the consumed batches are read from the shards but not unpickled and decoded.
+    '''
+    def __init__(
+        self,
+        token_dict: Dict[str, int],
+        f0_info_dict: Dict[str, Dict[str, float]],
+        use_between_padding: bool,
+        shard_path: str,
+        latent_length_min: int,
+        latent_length_max: int,
+        text_length_min: int,
+        text_length_max: int,
+        shuffle_buffer_size: int= 2048,
+        seed: int= 0
+        ):
+        super().__init__()
+        self.token_dict = token_dict
+        self.f0_info_dict = f0_info_dict
+        self.use_between_padding = use_between_padding
+        self.shard_path = shard_path
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.epoch = 0
+        self.start_batch, self.batch_size = 0, 1
+
+        index_dict = pickle.load(open(os.path.join(shard_path, 'SHARDS.PICKLE').replace('\\', '/'), 'rb'))
+        self.shard_dict = {}    # shard file -> members which pass the length filter.
+        for shard, members in index_dict['Shards']:
+            self.shard_dict[shard] = set([
+                file
+                for file, latent_length, text_length in members
+                if all([
+                    latent_length >= latent_length_min,
+                    latent_length <= latent_length_max,
+                    text_length >= text_length_min,
+                    text_length <= text_length_max
+                    ])
+                ])
+
+    def set_epoch(self, epoch: int, start_batch: int= 0, batch_size: int= 1):
+        '''
+        start_batch: The number of the batches of this rank which are already consumed in the epoch.
+        batch_size: The batch size of the DataLoader. The workers make whole batches by turns, so the consumed samples of each worker are known.
+        '''
+        self.epoch = epoch
+        self.start_batch = start_batch
+        self.batch_size = batch_size
+
+    def Worker_Shards(self):
+        '''
+        Returns the shards of this rank and worker, the number of samples every worker yields,
+        the index of the worker over the ranks, and the number of samples this worker skips.
+        '''
+        rank, world_size = 0, 1
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        # The DataLoader takes the batches from worker 0 after a restart, so a resumed worker continues the worker of the next batch.
+        worker_id = (worker_id + self.start_batch) % num_workers
+
+        # Every rank and worker gets the same order by the seed and epoch.
+        total_workers = world_size * num_workers
+        shards = sorted(self.shard_dict.keys())
+        if len(shards) < total_workers:
+            raise ValueError('The number of shards ({}) must be at least ranks x workers ({}). Regenerate the shards with smaller size.'.format(len(shards), total_workers))
+        shards = [shards[index] for index in np.random.RandomState(self.seed + self.epoch).permutation(len(shards))]
+
+        sample_count = int(np.ceil(len(self) / total_workers))
+        skip_count = min(max(self.start_batch - worker_id + num_workers - 1, 0) // num_workers * self.batch_size, sample_count)
+        return shards[rank * num_workers + worker_id::total_workers], sample_count, rank * num_workers + worker_id, skip_count
+
+    def Pattern_Stream(self, shards: List[str]):
+        for shard in shards:
+            members = self.shard_dict[shard]
+            with tarfile.open(os.path.join(self.shard_path, shard).replace('\\', '/'), 'r|') as tar:
+                for member_info in tar:
+                    if not member_info.name in members:
+                        continue
+                    yield tar.extractfile(member_info).read()
+
+    def __iter__(self):
+        shards, sample_count, worker_index, skip_count = self.Worker_Shards()
+        random = np.random.RandomState([self.seed, self.epoch, worker_index])
+
+        def Sample_Generate():
+            yielded_count = 0
+            while yielded_count < sample_count:
+                for pattern_bytes in self.Pattern_Stream(shards):
+                    yield pattern_bytes
+                    yielded_count += 1
+                    if yielded_count >= sample_count:
+                        return
+                if yielded_count == 0:
+                    raise ValueError('The shards of worker {} have no pattern in the length range.'.format(worker_index))
+
+        def Shuffle():
+            buffer = []
+            for pattern_bytes in Sample_Generate():
+                if len(buffer) < self.shuffle_buffer_size:
+                    buffer.append(pattern_bytes)
+                    continue
+                index = random.randint(len(buffer))
+                yield buffer[index]
+                buffer[index] = pattern_bytes
+
+            for index in random.permutation(len(buffer)):
+                yield buffer[index]
+
+        for index, pattern_bytes in enumerate(Shuffle()):
+            if index < skip_count:
+                continue
+            yield self.Sample(pickle.loads(pattern_bytes))
+
+    def Sample(self, pattern_dict: Dict):
+        return Pattern_Decode(pattern_dict, self.token_dict, self.f0_info_dict, self.use_between_padding)
+
+    def __len__(self):
+        return sum([len(members) for members in self.shard_dict.values()])
+
 class Inference_Dataset(torch.utils.data.Dataset):
     def __init__(
         self,
@@ -150,7 +570,9 @@ class Inference_Dataset(torch.utils.data.Dataset):
         hop_size: int,
         use_between_padding: bool,
         texts: List[str],
-        references: List[str]
+        references: List[str],
+        phoneme_cache_path: Optional[str]= None,
+        phonemizer_service: Optional[Phonemizer_Service]= None
         ):
         super().__init__()
         self.token_dict = token_dict
@@ -159,7 +581,7 @@ class Inference_Dataset(torch.utils.data.Dataset):
         self.use_between_padding = use_between_padding
         self.encodec = EncodecModel.encodec_model_24khz()
 
-        pronunciations = Phonemize(texts, language= 'English')
+        pronunciations = Phonemize(texts, language= 'English', cache_path= phoneme_cache_path, service= phonemizer_service)
 
         self.patterns = []
         for index, (text, pronunciation, reference) in enumerate(zip(texts, pronunciations, references)):
@@ -183,7 +605,7 @@ class Inference_Dataset(torch.utils.data.Dataset):
             token = pronunciation
         token = Text_to_Token(token, self.token_dict)
 
-        audio, _ = librosa.load(reference, sr= self.sample_rate)
+        audio = Audio_Load(reference, self.sample_rate)
         audio = librosa.util.normalize(audio) * 0.95
         audio = audio[:audio.shape[0] - (audio.shape[0] % self.hop_size)]
 
@@ -195,60 +617,92 @@ class Inference_Dataset(torch.utils.data.Dataset):
         return len(self.patterns)
 
 class Collater:
+    '''
+    The speech prompts are not cropped here. Their offsets are returned, and Speech_Prompt_Gather crops them on the device,
+    so the latents are transferred once.
+    When pin_memory is True, the batch is written into pinned memory in the main process,
+    so the DataLoader does not copy it again. The tensors of the workers are sent by shared memory, so they are not pinned.
+    When the samples have the continuous latents of the store, they are stacked in float16. Otherwise, continuous_latents is None.
+    When seed is given, the speech prompt offsets of a batch are drawn by the seed, rank, epoch, and batch index of set_epoch instead of np.random,
+    so a resumed epoch crops the same prompts as the original run whichever worker collates the batch.
+    '''
     def __init__(
         self,
         token_dict: Dict[str, int],
+        pin_memory: bool= False,
+        seed: Optional[int]= None,
+        rank: int= 0
         ):
         self.token_dict = token_dict
+        self.pin_memory = pin_memory
+        self.seed = seed
+        self.rank = rank
+        self.epoch = 0
+        self.start_batch = 0
+        self.collated_count = 0
+
+    def set_epoch(self, epoch: int, start_batch: int= 0):
+        '''
+        start_batch: The number of the batches which are already consumed in the epoch.
+        '''
+        self.epoch = epoch
+        self.start_batch = start_batch
+        self.collated_count = 0
+
+    def Random(self):
+        if self.seed is None:
+            return np.random
+
+        # The DataLoader gives the batches to the workers in turn, so the j-th batch of worker w is the batch start_batch + w + j x workers of the epoch.
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        batch_index = self.start_batch + worker_id + self.collated_count * num_workers
+        self.collated_count += 1
+
+        return np.random.RandomState([self.seed, self.rank, self.epoch, batch_index])
 
     def __call__(self, batch):
-        tokens, latents, f0s, mels, attention_priors = zip(*batch)
+        tokens, latents, f0s, mels, *continuous_latents = zip(*batch)
         token_lengths = np.array([token.shape[0] for token in tokens])
         latent_lengths = np.array([latent.shape[1] for latent in latents])
         speech_prompt_length = latent_lengths.min() // 2
+        pin_memory = self.pin_memory and torch.utils.data.get_worker_info() is None and torch.cuda.is_available()
 
-        speech_prompts = []
-        speech_prompts_for_diffusion = []
-        for latent in latents:
-            offset = np.random.randint(0, latent.shape[1] - speech_prompt_length + 1)
-            speech_prompts.append(latent[:, offset:offset + speech_prompt_length])
-
-            latent = np.concatenate([latent[:, 0:offset], latent[:, offset + speech_prompt_length:]], axis= 1)
-            offset = np.random.randint(0, latent.shape[1] - speech_prompt_length + 1)
-            speech_prompts_for_diffusion.append(latent[:, offset:offset + speech_prompt_length])
+        # The second offset is in the latent without the speech prompt, so the two prompts do not overlap.
+        random = self.Random()
+        speech_prompt_offsets = np.stack([
+            random.randint(0, latent_lengths - speech_prompt_length + 1),
+            random.randint(0, latent_lengths - speech_prompt_length * 2 + 1)
+            ], axis= 1)
 
         tokens = Token_Stack(
             tokens= tokens,
-            token_dict= self.token_dict
-            )
-        speech_prompts = Latent_Stack(speech_prompts)
-        speech_prompts_for_diffusion = Latent_Stack(speech_prompts_for_diffusion)        
+            token_dict= self.token_dict,
+            pin_memory= pin_memory
+            )   # [Batch, Token_t]
         latents = Latent_Stack(
-            latents= latents
-            )
+            latents= latents,
+            pin_memory= pin_memory
+            )   # [Batch, Latent_d, Latent_t]
         f0s = F0_Stack(
-            f0s= f0s
-            )
+            f0s= f0s,
+            pin_memory= pin_memory
+            )   # [Batch, Latent_t]
         mels = Mel_Stack(
-            mels= mels
-            )
-        attention_priors = Attention_Prior_Stack(
-            attention_priors= attention_priors,
-            max_token_length= token_lengths.max(),
-            max_latent_length= latent_lengths.max()
-            )
+            mels= mels,
+            pin_memory= pin_memory
+            )   # [Batch, Mel_d, Mel_t]
+        continuous_latents = None if len(continuous_latents) == 0 else Latent_Stack(
+            latents= continuous_latents[0],
+            pin_memory= pin_memory,
+            dtype= torch.half
+            )   # [Batch, Latent_d, Latent_t]
         
-        tokens = torch.LongTensor(tokens)   # [Batch, Token_t]
-        token_lengths = torch.LongTensor(token_lengths)   # [Batch]
-        speech_prompts = torch.LongTensor(speech_prompts)
-        speech_prompts_for_diffusion = torch.LongTensor(speech_prompts_for_diffusion)
-        latents = torch.LongTensor(latents)    # [Batch, Latent_d, Latent_t]
-        latent_lengths = torch.LongTensor(latent_lengths)   # [Batch]
-        f0s = torch.FloatTensor(f0s)    # [Batch, Latent_t]
-        mels = torch.FloatTensor(mels)  # [Batch, Mel_d, Mel_t]
-        attention_priors = torch.FloatTensor(attention_priors) # [Batch, Token_t, Latent_t]
+        token_lengths = torch.from_numpy(token_lengths)   # [Batch]
+        speech_prompt_offsets = torch.from_numpy(speech_prompt_offsets)    # [Batch, 2]
+        latent_lengths = torch.from_numpy(latent_lengths)   # [Batch]
 
-        return tokens, token_lengths, speech_prompts, speech_prompts_for_diffusion, latents, latent_lengths, f0s, mels, attention_priors
+        return tokens, token_lengths, speech_prompt_offsets, latents, latent_lengths, f0s, mels, continuous_latents
 
 class Inference_Collater:
     def __init__(self,
@@ -270,11 +724,9 @@ class Inference_Collater:
             offset = np.random.randint(0, latent.shape[1] - speech_prompt_length + 1)
             speech_prompts.append(latent[:, offset:offset + speech_prompt_length])
         
-        tokens = Token_Stack(tokens, self.token_dict)
+        tokens = Token_Stack(tokens, self.token_dict)   # [Batch, Token_t]
         speech_prompts = Latent_Stack(speech_prompts)
         
-        tokens = torch.LongTensor(tokens)   # [Batch, Token_t]
         token_lengths = torch.LongTensor(token_lengths)   # [Batch]
-        speech_prompts = torch.LongTensor(speech_prompts)
         
         return tokens, token_lengths, speech_prompts, texts, pronunciations, references
\ No newline at end of file
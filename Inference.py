@@ -5,6 +5,7 @@ from typing import List, Optional
 
 from Modules.Modules import NaturalSpeech2
 from Datasets import Inference_Dataset as Dataset, Inference_Collater as Collater
+from Pattern_Generator import Phonemizer_Service
 from Arg_Parser import Recursive_Parse
 
 logging.basicConfig(
@@ -27,6 +28,7 @@ class Inferencer:
             ))
 
         self.model = NaturalSpeech2(self.hp).to(self.device)
+        self.phonemizer_service = Phonemizer_Service(num_workers= self.hp.Phonemizer_Workers)   # Backends are kept warm over Dataset_Generate calls.
         
         self.Load_Checkpoint(checkpoint_path)
         self.batch_size = batch_size
@@ -45,6 +47,8 @@ class Inferencer:
                 hop_size= self.hp.Sound.Frame_Shift,
                 texts= texts,
                 references= references,
+                phoneme_cache_path= self.hp.Phoneme_Cache_Path,
+                phonemizer_service= self.phonemizer_service
                 ),
             shuffle= False,
             collate_fn= Collater(
@@ -0,0 +1,114 @@
+import numpy as np
+import os, pickle, logging
+from typing import Dict
+
+class Metadata_Index:
+    '''
+    Binary index of the metadata for the datasets.
+    The paths are one utf-8 byte blob with offsets, and the lengths and speakers are NumPy arrays.
+    Unlike the dicts and string lists of the metadata pickle, the arrays are a few objects,
+    so forked DataLoader workers do not copy the pages by reference count writes.
+        Path_Blob: uint8 [Sum_Path_Bytes]
+        Path_Offsets: int64 [Pattern + 1]. Path of row i is Path_Blob[Path_Offsets[i]:Path_Offsets[i + 1]].
+        Latent_Lengths, Text_Lengths, Pronunciation_Lengths: int32 [Pattern]
+        Speaker_IDs: int32 [Pattern]. The index of Speakers.
+        Speakers: str [Speaker]
+    '''
+    def __init__(
+        self,
+        path_blob: np.ndarray,
+        path_offsets: np.ndarray,
+        latent_lengths: np.ndarray,
+        text_lengths: np.ndarray,
+        pronunciation_lengths: np.ndarray,
+        speaker_ids: np.ndarray,
+        speakers: np.ndarray
+        ):
+        self.path_blob = path_blob
+        self.path_offsets = path_offsets
+        self.latent_lengths = latent_lengths
+        self.text_lengths = text_lengths
+        self.pronunciation_lengths = pronunciation_lengths
+        self.speaker_ids = speaker_ids
+        self.speakers = speakers
+
+    def __len__(self):
+        return self.latent_lengths.shape[0]
+
+    def Path(self, row: int):
+        return self.path_blob[self.path_offsets[row]:self.path_offsets[row + 1]].tobytes().decode('utf-8')
+
+    def Length_Mask(
+        self,
+        latent_length_min: int,
+        latent_length_max: int,
+        text_length_min: int,
+        text_length_max: int
+        ):
+        return \
+            (self.latent_lengths >= latent_length_min) & \
+            (self.latent_lengths <= latent_length_max) & \
+            (self.text_lengths >= text_length_min) & \
+            (self.text_lengths <= text_length_max)
+
+    def Save(self, path: str):
+        # np.savez appends '.npz' to a path, so the file object is given.
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                Path_Blob= self.path_blob,
+                Path_Offsets= self.path_offsets,
+                Latent_Lengths= self.latent_lengths,
+                Text_Lengths= self.text_lengths,
+                Pronunciation_Lengths= self.pronunciation_lengths,
+                Speaker_IDs= self.speaker_ids,
+                Speakers= self.speakers
+                )
+
+def Metadata_Index_Path(pattern_path: str, metadata_file: str):
+    return os.path.join(pattern_path, os.path.splitext(metadata_file.upper())[0] + '.INDEX').replace("\\", "/")
+
+def Metadata_Index_Generate(metadata_dict: Dict):
+    files = metadata_dict['File_List']
+    speakers = sorted(set(metadata_dict['Speaker_Dict'].values()))
+    speaker_index_dict = {speaker: index for index, speaker in enumerate(speakers)}
+
+    paths = [file.encode('utf-8') for file in files]
+    path_offsets = np.zeros(len(paths) + 1, dtype= np.int64)
+    np.cumsum([len(path) for path in paths], out= path_offsets[1:])
+
+    return Metadata_Index(
+        path_blob= np.frombuffer(b''.join(paths), dtype= np.uint8).copy(),
+        path_offsets= path_offsets,
+        latent_lengths= np.array([metadata_dict['Latent_Length_Dict'][file] for file in files], dtype= np.int32),
+        text_lengths= np.array([metadata_dict['Text_Length_Dict'][file] for file in files], dtype= np.int32),
+        # The metadata before the pronunciation lengths has the text lengths only. They are close for the length bucketing.
+        pronunciation_lengths= np.array([
+            metadata_dict.get('Pronunciation_Length_Dict', {}).get(file, metadata_dict['Text_Length_Dict'][file])
+            for file in files
+            ], dtype= np.int32),
+        speaker_ids= np.array([speaker_index_dict[metadata_dict['Speaker_Dict'][file]] for file in files], dtype= np.int32),
+        speakers= np.array(speakers, dtype= str)
+        )
+
+def Metadata_Index_Load(pattern_path: str, metadata_file: str):
+    '''
+    Loads the index written by Pattern_Generator.py.
+    When it is missing or older than the metadata, the index is generated from the metadata pickle in memory.
+    '''
+    metadata_path = os.path.join(pattern_path, metadata_file).replace('\\', '/')
+    index_path = Metadata_Index_Path(pattern_path, metadata_file)
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(metadata_path):
+        index = np.load(index_path)
+        return Metadata_Index(
+            path_blob= index['Path_Blob'],
+            path_offsets= index['Path_Offsets'],
+            latent_lengths= index['Latent_Lengths'],
+            text_lengths= index['Text_Lengths'],
+            pronunciation_lengths= index['Pronunciation_Lengths'] if 'Pronunciation_Lengths' in index.files else index['Text_Lengths'],
+            speaker_ids= index['Speaker_IDs'],
+            speakers= index['Speakers']
+            )
+
+    logging.warning('There is no up-to-date metadata index of \'{}\'. It is generated from the metadata. Regenerate the metadata to write it.'.format(metadata_path))
+    return Metadata_Index_Generate(pickle.load(open(metadata_path, 'rb')))
@@ -59,7 +59,7 @@ class NaturalSpeech2(torch.nn.Module):
         latent_lengths: Optional[torch.LongTensor]= None,
         f0s: Optional[torch.FloatTensor]= None,
         mels: Optional[torch.FloatTensor]= None,
-        attention_priors: Optional[torch.FloatTensor]= None,
+        continuous_latents: Optional[torch.FloatTensor]= None,
         ddim_steps: Optional[int]= None
         ):
         if all([
@@ -67,8 +67,7 @@ class NaturalSpeech2(torch.nn.Module):
             not latents is None,
             not latent_lengths is None,
             not f0s is None,
-            not mels is None,
-            not attention_priors is None
+            not mels is None
             ]):    # train
             return self.Train(
                 tokens= tokens,
@@ -79,7 +78,7 @@ class NaturalSpeech2(torch.nn.Module):
                 latent_lengths= latent_lengths,
                 f0s= f0s,
                 mels= mels,
-                attention_priors= attention_priors
+                continuous_latents= continuous_latents
                 )
         else:   #  inference
             return self.Inference(
@@ -99,14 +98,21 @@ class NaturalSpeech2(torch.nn.Module):
         latent_lengths: torch.LongTensor,
         f0s: torch.FloatTensor,
         mels: torch.Tensor,
-        attention_priors: torch.Tensor,
+        continuous_latents: Optional[torch.Tensor]= None
         ):
+        '''
+        continuous_latents: The quantizer decode of the latent codes. When it is given, the speech prompts are also continuous,
+            and the codes are used only for the CE-RVQ targets.
+        '''
         latent_codes = latents
         with torch.no_grad():
-            latents = self.encodec.quantizer.decode(latents.permute(1, 0, 2))
+            if continuous_latents is None:
+                latents = self.encodec.quantizer.decode(latents.permute(1, 0, 2))
+                speech_prompts = self.encodec.quantizer.decode(speech_prompts.permute(1, 0, 2))
+                speech_prompts_for_diffusion = self.encodec.quantizer.decode(speech_prompts_for_diffusion.permute(1, 0, 2))
+            else:
+                latents = continuous_latents
             latents = (latents - self.latent_mean) / self.latent_std
-            speech_prompts = self.encodec.quantizer.decode(speech_prompts.permute(1, 0, 2))
-            speech_prompts_for_diffusion = self.encodec.quantizer.decode(speech_prompts_for_diffusion.permute(1, 0, 2))
 
         encodings = self.encoder(
             tokens= tokens,
@@ -120,8 +126,7 @@ class NaturalSpeech2(torch.nn.Module):
             encoding_lengths= token_lengths,
             conditions= speech_prompts,
             features= mels,
-            feature_lengths= latent_lengths,
-            attention_priors= attention_priors
+            feature_lengths= latent_lengths
             )
 
         encodings_expand, duration_predictions, f0_predictions, _, _, _ = self.variance_block(
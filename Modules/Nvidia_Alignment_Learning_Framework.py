@@ -35,8 +35,6 @@ import numpy as np
 from numba import jit
 from typing import Optional
 
-import functools
-from scipy import ndimage
 from scipy.stats import betabinom
 
 from .LinearAttention import LinearAttention
@@ -292,42 +290,6 @@ def binarize_attention(attn, in_lens, out_lens):
 
 
 
-class BetaBinomialInterpolator:
-    """Interpolates alignment prior matrices to save computation.
-
-    Calculating beta-binomial priors is costly. Instead cache popular sizes
-    and use img interpolation to get priors faster.
-    """
-    def __init__(self, round_mel_len_to=100, round_text_len_to=20):
-        self.round_mel_len_to = round_mel_len_to
-        self.round_text_len_to = round_text_len_to
-        self.bank = functools.lru_cache(beta_binomial_prior_distribution)
-
-    def round(self, val, to):
-        return max(1, int(np.round((val + 1) / to))) * to
-
-    def __call__(self, w, h):
-        bw = self.round(w, to=self.round_mel_len_to)
-        bh = self.round(h, to=self.round_text_len_to)
-        ret = ndimage.zoom(self.bank(bw, bh).T, zoom=(w / bw, h / bh), order=1)
-        assert ret.shape[0] == w, ret.shape
-        assert ret.shape[1] == h, ret.shape
-        return ret
-
-class Attention_Prior_Generator:
-    def __init__(self, use_betabinomial_interpolator: bool= True):
-        self.use_betabinomial_interpolator = use_betabinomial_interpolator
-        if use_betabinomial_interpolator:
-            self.betabinomial_interpolator = BetaBinomialInterpolator()
-
-    def get_prior(self, mel_len, text_len):
-        if self.use_betabinomial_interpolator:
-            return torch.from_numpy(self.betabinomial_interpolator(mel_len, text_len))
-
-        attn_prior = beta_binomial_prior_distribution(text_len, mel_len)
-        
-        return attn_prior.numpy()
-
 def beta_binomial_prior_distribution(phoneme_count, mel_count, scaling=1.0):
     P = phoneme_count
     M = mel_count
@@ -340,6 +302,37 @@ def beta_binomial_prior_distribution(phoneme_count, mel_count, scaling=1.0):
         mel_text_probs.append(mel_i_prob)
     return torch.tensor(np.array(mel_text_probs))
 
+def Attention_Prior_Generate(
+    token_lengths: torch.Tensor,
+    feature_lengths: torch.Tensor,
+    max_token_length: int,
+    max_feature_length: int,
+    scaling: float= 1.0
+    ):
+    '''
+    The priors of beta_binomial_prior_distribution for a batch, made on the device of the lengths by lgamma.
+    Row i (1 <= i <= M) of a feature length M is the pmf of BetaBinomial(n= P, a= scaling x i, b= scaling x (M + 1 - i)) at 0 ~ P - 1 for a token length P.
+    Returns: [Batch, Feature_t, Token_t]. The prior is 0 out of the lengths.
+    '''
+    device = token_lengths.device
+    n = token_lengths.float()[:, None, None]    # [Batch, 1, 1]
+    m = feature_lengths.float()[:, None, None]
+    i = torch.arange(1, max_feature_length + 1, device= device).float()[None, :, None]  # [1, Feature_t, 1]
+    k = torch.arange(max_token_length, device= device).float()[None, None, :]   # [1, 1, Token_t]
+    masks = (i <= m) & (k < n)
+
+    # The arguments out of the lengths are clamped to keep lgamma finite. They are masked out.
+    a = scaling * i
+    b = (scaling * (m + 1 - i)).clamp(min= scaling)
+    n_k = (n - k).clamp(min= 1.0)
+
+    log_priors = \
+        torch.lgamma(n + 1) - torch.lgamma(k + 1) - torch.lgamma(n_k + 1) + \
+        torch.lgamma(k + a) + torch.lgamma(n_k + b) - torch.lgamma(n + a + b) + \
+        torch.lgamma(a + b) - torch.lgamma(a) - torch.lgamma(b)
+
+    return torch.where(masks, log_priors.exp(), torch.zeros_like(log_priors))
+
 def mask_from_lens(lens, max_len: Optional[int] = None):
     if max_len is None:
         max_len = lens.max()
@@ -437,8 +430,7 @@ class Alignment_Learning_Framework(torch.nn.Module):
         encoding_lengths: torch.Tensor,
         conditions: torch.Tensor,
         features: torch.Tensor,
-        feature_lengths: torch.Tensor,
-        attention_priors: torch.Tensor
+        feature_lengths: torch.Tensor
         ):
         token_embeddings = self.prompt_attention(
             queries= token_embeddings,
@@ -448,6 +440,14 @@ class Alignment_Learning_Framework(torch.nn.Module):
 
         attention_masks = mask_from_lens(encoding_lengths, max_len=encoding_lengths.max())
         attention_masks = attention_masks[..., None] == 0
+
+        # The priors are made on the device from the lengths instead of being shipped by the data loader.
+        attention_priors = Attention_Prior_Generate(
+            token_lengths= encoding_lengths,
+            feature_lengths= feature_lengths,
+            max_token_length= token_embeddings.size(2),
+            max_feature_length= features.size(2)
+            )
         
         attention_softs, attention_logprobs = self.attention(
             queries= features,
@@ -0,0 +1,271 @@
+import numpy as np
+import os, pickle, hashlib, tempfile, logging, atexit, glob, mmap
+import multiprocessing as mp
+from contextlib import contextmanager
+from typing import Any, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None    # Windows. The lock is a multiprocessing lock, so only the DataLoader workers of a process share the cache.
+
+header_size = 16  # int64
+block_header_size = 16
+magic = 0x4E53325043414348
+wrap_row = -2   # The block header which means the ring continues from 0.
+
+# Header fields
+MAGIC, CAPACITY, PATTERN_COUNT, HEAD, TAIL, BLOCKS, HITS, MISSES, EVICTIONS, OWNER_PID, DATA_KEY = range(11)
+
+class Pattern_Cache:
+    '''
+    Byte budgeted cache of decoded patterns in a shared memory-mapped file.
+    The file is in /dev/shm on Linux, so the cached patterns are in the memory once per node.
+    Every DataLoader worker of every rank on a node maps the same file, so a pattern decoded by one worker is a hit for the others.
+    Layout:
+        Header: int64 [16]: Magic, capacity, pattern count, head, tail, blocks, hits, misses, evictions, owner pid, data key.
+        Entries: int64 [Pattern, 2]: The block offset and data size of each pattern row. The offset is -1 when it is not cached.
+        Arena: uint8 [Capacity]: The ring of blocks. A block is the row and the size by int64, and the pickled pattern.
+    Eviction is FIFO by the ring. The patterns are sampled uniformly, so FIFO has the hit rate of LRU without moving the blocks on every hit.
+    '''
+    def __init__(
+        self,
+        name: str,
+        capacity: int,
+        pattern_count: int,
+        directory: Optional[str]= None,
+        data_key: Any= None
+        ):
+        '''
+        name: The cache identity. The processes with the same name and directory share the cache.
+        capacity: The byte budget of the cached patterns.
+        pattern_count: The number of pattern rows.
+        data_key: The identity of the pattern data, like the modified times of the metadata and the store. The cache of another key is reset.
+        '''
+        directory = directory or ('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+        Pattern_Cache_Cleanup(directory)
+        self.path = os.path.join(directory, 'PATTERN_CACHE_{}.BIN'.format(name)).replace('\\', '/')
+        self.pattern_count = pattern_count
+        self.data_key = int(hashlib.sha1(repr(data_key).encode('utf-8')).hexdigest()[:15], 16)
+        self.creator_pid = None
+        self.lock = mp.Lock() if fcntl is None else None
+
+        self.file_descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self.Lock():
+            os.lseek(self.file_descriptor, 0, os.SEEK_SET)
+            header = np.frombuffer(os.read(self.file_descriptor, header_size * 8), dtype= np.int64)
+            if len(header) == header_size and header[MAGIC] == magic and header[PATTERN_COUNT] == pattern_count and header[DATA_KEY] == self.data_key:
+                # The first process sized the cache, so the others map the same layout.
+                self.capacity = int(header[CAPACITY])
+                self.Map()
+            else:
+                try:
+                    self.capacity = self.Capacity_Fit(capacity, directory)
+                except OSError:
+                    os.remove(self.path)
+                    raise
+                # The file is sparse, so the memory is used by the cached patterns only.
+                os.ftruncate(self.file_descriptor, self.Total_Size())
+                self.Map()
+                self.entries[:, 0] = -1
+                self.header[:] = 0
+                self.header[CAPACITY] = self.capacity
+                self.header[PATTERN_COUNT] = pattern_count
+                self.header[DATA_KEY] = self.data_key
+                self.header[OWNER_PID] = os.getpid()
+                self.header[MAGIC] = magic
+                self.creator_pid = os.getpid()
+                atexit.register(self.Remove)
+
+    def Capacity_Fit(self, capacity: int, directory: str):
+        '''
+        The sparse file is not checked by the filesystem when it is created.
+        A page beyond the free space of tmpfs is SIGBUS in the worker which writes it, so the capacity is clamped to the free space here.
+        '''
+        if not hasattr(os, 'statvfs'):
+            return capacity
+        stat = os.statvfs(directory)
+        # The pages of the old file are freed by the reset.
+        free_size = stat.f_bavail * stat.f_frsize + os.fstat(self.file_descriptor).st_blocks * 512
+        table_size = self.Total_Size(capacity= 0)
+        fit_capacity = int((free_size - table_size) * 0.9) // 8 * 8   # Some room for the other files.
+        if fit_capacity < block_header_size:
+            raise OSError('The pattern cache needs {} bytes, but {} has {} bytes free. Set Train.Pattern_Cache.Directory or disable the cache.'.format(
+                table_size + capacity,
+                directory,
+                free_size
+                ))
+        if fit_capacity < capacity:
+            logging.warning('{} has {:.2f} GB free, so the pattern cache is clamped from {:.2f} GB to {:.2f} GB. Set Train.Pattern_Cache.Directory to a larger filesystem, or enlarge it (e.g. docker run --shm-size).'.format(
+                directory,
+                free_size / 2**30,
+                capacity / 2**30,
+                fit_capacity / 2**30
+                ))
+            return fit_capacity
+        return capacity
+
+    def Total_Size(self, capacity: Optional[int]= None):
+        capacity = self.capacity if capacity is None else capacity
+        return (header_size + self.pattern_count * 2) * 8 + capacity
+
+    def Open(self):
+        self.file_descriptor = os.open(self.path, os.O_RDWR)
+        self.Map()
+
+    def Map(self):
+        total_size = self.Total_Size()
+        # The file is mapped through the locked descriptor. np.memmap opens and closes its own descriptor, and a close releases the lockf locks of the process.
+        memmap = np.frombuffer(mmap.mmap(self.file_descriptor, total_size), dtype= np.uint8)
+        self.header = memmap[:header_size * 8].view(np.int64)
+        self.entries = memmap[header_size * 8:(header_size + self.pattern_count * 2) * 8].view(np.int64).reshape(self.pattern_count, 2)
+        self.arena = memmap[(header_size + self.pattern_count * 2) * 8:]
+
+    def __getstate__(self):
+        # Spawned workers map the file by themselves.
+        state = self.__dict__.copy()
+        for key in ['file_descriptor', 'header', 'entries', 'arena']:
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.Open()
+
+    @contextmanager
+    def Lock(self):
+        # The lockf lock is owned by the process, so forked workers exclude each other with the inherited file descriptor.
+        if fcntl is None:
+            with self.lock:
+                yield
+            return
+        fcntl.lockf(self.file_descriptor, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self.file_descriptor, fcntl.LOCK_UN)
+
+    def Get(self, row: int):
+        '''
+        Returns None when the pattern is not cached.
+        '''
+        with self.Lock():
+            offset, size = self.entries[row]
+            if offset < 0:
+                self.header[MISSES] += 1
+                return None
+            self.header[HITS] += 1
+            data = self.arena[offset + block_header_size:offset + block_header_size + size].tobytes()
+
+        return pickle.loads(data)
+
+    def Put(self, row: int, value: Any):
+        data = pickle.dumps(value, protocol= 4)
+        block_size = block_header_size + (len(data) + 7) // 8 * 8
+        if block_size > self.capacity:
+            return
+
+        with self.Lock():
+            if self.entries[row, 0] >= 0:  # Another worker cached it.
+                return
+            offset = self.Allocate(block_size)
+            self.arena[offset:offset + block_header_size].view(np.int64)[:] = [row, len(data)]
+            self.arena[offset + block_header_size:offset + block_header_size + len(data)] = np.frombuffer(data, dtype= np.uint8)
+            self.entries[row] = [offset, len(data)]
+            self.header[HEAD] = offset + block_size
+            self.header[BLOCKS] += 1
+
+    def Allocate(self, block_size: int):
+        '''
+        Returns the offset of the free space of block_size at the head. The oldest blocks are evicted until it is free.
+        '''
+        header = self.header
+        while True:
+            if header[BLOCKS] == 0:
+                header[HEAD] = header[TAIL] = 0
+                return 0
+            if header[HEAD] > header[TAIL]:
+                if self.capacity - header[HEAD] >= block_size:
+                    return int(header[HEAD])
+                if self.capacity - header[HEAD] >= block_header_size:
+                    self.arena[header[HEAD]:header[HEAD] + block_header_size].view(np.int64)[:] = [wrap_row, 0]
+                header[HEAD] = 0
+                continue
+            if header[TAIL] - header[HEAD] >= block_size:
+                return int(header[HEAD])
+            self.Evict()
+
+    def Evict(self):
+        header = self.header
+        tail = int(header[TAIL])
+        if self.capacity - tail < block_header_size:
+            header[TAIL] = 0
+            return
+        row, size = self.arena[tail:tail + block_header_size].view(np.int64)
+        if row == wrap_row:
+            header[TAIL] = 0
+            return
+
+        if self.entries[row, 0] == tail:
+            self.entries[row, 0] = -1
+        tail += block_header_size + (int(size) + 7) // 8 * 8
+        header[TAIL] = 0 if tail >= self.capacity else tail
+        header[BLOCKS] -= 1
+        header[EVICTIONS] += 1
+
+    def Statistics(self):
+        hits, misses = int(self.header[HITS]), int(self.header[MISSES])
+        return {
+            'Hits': hits,
+            'Misses': misses,
+            'Evictions': int(self.header[EVICTIONS]),
+            'Hit_Rate': hits / max(hits + misses, 1),
+            'Patterns': int(self.header[BLOCKS])
+            }
+
+    def Remove(self):
+        if os.getpid() != self.creator_pid:
+            return
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def Pattern_Cache_Name(*keys):
+    '''
+    The ranks launched together have the same parent process and master port, so they get the same name.
+    '''
+    return hashlib.sha1(repr(keys + (os.getppid(), os.getenv('MASTER_PORT', ''))).encode('utf-8')).hexdigest()[:16]
+
+def Process_Alive(pid: int):
+    if pid <= 0:
+        return False
+    if fcntl is None:
+        return True  # os.kill of Windows terminates the process, so the owner is not checked.
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass    # The process of another user.
+    return True
+
+def Pattern_Cache_Cleanup(directory: str):
+    '''
+    Removes the cache files whose owner process is gone.
+    A crashed run does not remove its file. The file of another data or launch is not used again, and the ring of a killed process may be half written.
+    '''
+    for path in glob.glob(os.path.join(directory, 'PATTERN_CACHE_*.BIN').replace('\\', '/')):
+        try:
+            with open(path, 'rb') as f:
+                header = np.frombuffer(f.read(header_size * 8), dtype= np.int64)
+        except OSError:
+            continue
+        # A file which is being created has no magic yet.
+        if len(header) < header_size or header[MAGIC] != magic or Process_Alive(int(header[OWNER_PID])):
+            continue
+        try:
+            os.remove(path)
+            logging.info('The pattern cache of a stopped run is removed: {}'.format(path))
+        except OSError:
+            pass
@@ -1,19 +1,30 @@
 import torch
 import numpy as np
-import yaml, os, pickle, librosa, re, argparse, math
+import yaml, os, pickle, librosa, re, argparse, math, functools, zlib, hashlib, threading, queue, json, tarfile, io
+import multiprocessing as mp
 from concurrent.futures import ThreadPoolExecutor as PE
-from random import shuffle
+from random import Random
+from collections import deque
 from tqdm import tqdm
-from pysptk.sptk import rapt
-from typing import List, Tuple, Dict, Union, Optional
+from typing import List, Tuple, Dict, Union, Optional, NamedTuple
 
-from phonemizer import phonemize
+import phonemizer
+from phonemizer.backend import EspeakBackend
+from phonemizer.separator import Separator
 from unidecode import unidecode
 
-from meldataset import mel_spectrogram
+from meldataset import MelExtractor
+from F0_Extractor import F0_Extract
+from Audio import Audio_Load
+from Metadata_Index import Metadata_Index_Generate, Metadata_Index_Path
 
 from encodec import EncodecModel
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None    # Windows. The appends are still single writes.
+
 from Arg_Parser import Recursive_Parse
 
 using_extension = [x.upper() for x in ['.wav', '.m4a', '.flac', '.flac']]
@@ -68,7 +79,158 @@ def expand_abbreviations(text: str):
 
     return text
 
-def Phonemize(texts: Union[str, List[str]], language: str):
+@functools.lru_cache(maxsize= None)
+def Phonemizer_Version():
+    return 'phonemizer-{}_espeak-{}'.format(
+        phonemizer.__version__,
+        '.'.join([str(x) for x in EspeakBackend.version()])
+        )
+
+class Phoneme_Cache:
+    '''
+    Append-only on-disk cache of Phonemize.
+    Each line is 'Key\tPronunciation'. The key is the hash of the phonemizer/espeak version, the language, and the normalized text,
+    so the entries of another version are just not hit and the file can be shared by generation, training, and inference.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.pronunciation_dict = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                lines = f.read().split(b'\n')
+            # The file is shared by other processes, so it is never truncated here.
+            # The last line without a newline is a write in progress or interrupted, and a broken line is just skipped.
+            for line in lines[:-1]:
+                try:
+                    line = line.decode('utf-8').split('\t')
+                except UnicodeDecodeError:
+                    continue
+                if len(line) != 2 or len(line[0]) != 40:
+                    continue
+                self.pronunciation_dict[line[0]] = line[1]
+
+        if os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok= True)
+        self.file_descriptor = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+
+    @staticmethod
+    def Key(text: str, language: str):
+        return hashlib.sha1('{}\t{}\t{}'.format(Phonemizer_Version(), language, text).encode('utf-8')).hexdigest()
+
+    def Get(self, text: str, language: str):
+        return self.pronunciation_dict.get(self.Key(text, language))
+
+    def Append(self, texts: List[str], language: str, pronunciations: List[str]):
+        with self.lock:
+            lines = []
+            for text, pronunciation in zip(texts, pronunciations):
+                key = self.Key(text, language)
+                if key in self.pronunciation_dict or '\n' in pronunciation or '\t' in pronunciation:
+                    continue
+                self.pronunciation_dict[key] = pronunciation
+                lines.append('{}\t{}\n'.format(key, pronunciation))
+            if len(lines) == 0:
+                return
+            data = ''.join(lines).encode('utf-8')
+
+            # Each append is one write of the O_APPEND descriptor under the file lock, so the lines of the processes do not interleave.
+            if not fcntl is None:
+                fcntl.flock(self.file_descriptor, fcntl.LOCK_EX)
+            try:
+                size = os.fstat(self.file_descriptor).st_size
+                if size > 0:
+                    with open(self.path, 'rb') as f:
+                        f.seek(size - 1)
+                        if f.read(1) != b'\n':
+                            data = b'\n' + data   # The line of an interrupted write is closed, so the first new line is not broken.
+                os.write(self.file_descriptor, data)
+            finally:
+                if not fcntl is None:
+                    fcntl.flock(self.file_descriptor, fcntl.LOCK_UN)
+
+    def __len__(self):
+        return len(self.pronunciation_dict)
+
+phoneme_cache_dict = {}
+def Phoneme_Cache_Get(path: str):
+    '''
+    The cache of a path is opened once in a process.
+    '''
+    if not path in phoneme_cache_dict.keys():
+        phoneme_cache_dict[path] = Phoneme_Cache(path)
+    return phoneme_cache_dict[path]
+
+class Phonemizer_Service:
+    '''
+    Keeps initialized espeak backends alive across calls.
+    Each language has num_workers backends, and a batch is split to the idle backends by a thread pool.
+    phonemizer loads an own copy of the espeak library for each backend, so the backends run in parallel and many callers can share the service.
+    '''
+    def __init__(self, num_workers: int= 4):
+        self.num_workers = num_workers
+        self.backend_queue_dict = {}
+        self.lock = threading.Lock()
+        self.executor = PE(max_workers= num_workers)
+
+    def Backend_Queue(self, language: str):
+        with self.lock:
+            if not language in self.backend_queue_dict.keys():
+                backend_queue = queue.Queue()
+                for _ in range(self.num_workers):
+                    backend_queue.put(EspeakBackend(
+                        language= language,
+                        preserve_punctuation= True,
+                        with_stress= True
+                        ))
+                self.backend_queue_dict[language] = backend_queue
+
+        return self.backend_queue_dict[language]
+
+    def Phonemize_Chunk(self, texts: List[str], language: str):
+        backend_queue = self.Backend_Queue(language)
+        backend = backend_queue.get()
+        try:
+            return backend.phonemize(
+                texts,
+                separator= Separator(phone= '', syllable= '', word= ' '),
+                strip= True,
+                njobs= 1
+                )
+        finally:
+            backend_queue.put(backend)
+
+    def Phonemize(self, texts: List[str], language: str):
+        '''
+        language: The language code of espeak like 'en-us'.
+        '''
+        chunk_size = max(math.ceil(len(texts) / self.num_workers), 1)
+        chunks = [texts[index:index + chunk_size] for index in range(0, len(texts), chunk_size)]
+
+        return [
+            pronunciation
+            for pronunciations in self.executor.map(lambda chunk: self.Phonemize_Chunk(chunk, language), chunks)
+            for pronunciation in pronunciations
+            ]
+
+    def close(self):
+        self.executor.shutdown()
+
+@functools.lru_cache(maxsize= None)
+def Phonemizer_Service_Default():
+    return Phonemizer_Service(num_workers= 4)
+
+def Phonemize(
+    texts: Union[str, List[str]],
+    language: str,
+    cache_path: Optional[str]= None,
+    service: Optional[Phonemizer_Service]= None
+    ):
+    '''
+    cache_path: The path of phoneme cache. When None, every text is phonemized.
+    service: The phonemizer service to use. When None, the default service of this process is used.
+    '''
     if type(texts) == str:
         texts = [texts]
 
@@ -80,35 +242,38 @@ def Phonemize(texts: Union[str, List[str]], language: str):
     elif language == 'Korean':
         language = 'ko'
 
-    pronunciations = phonemize(
-        texts,
-        language= language,
-        backend='espeak',
-        strip=True,
-        preserve_punctuation=True,
-        with_stress= True,
-        njobs=4
-        )
-    pronunciations = [re.sub(whitespace_re, ' ', pronunciation) for pronunciation in pronunciations]
-
-    return pronunciations
-
-def Pattern_Generate(
-    path,
-    sample_rate: int,
-    hop_size: int,
-    num_mels: int,
-    f0_min: int,
-    f0_max: int,
-    ):
-    audio, _ = librosa.load(path, sr= sample_rate)
+    cache = None if cache_path is None else Phoneme_Cache_Get(cache_path)
+    pronunciation_dict = {}
+    if not cache is None:
+        for text in set(texts):
+            pronunciation = cache.Get(text, language)
+            if not pronunciation is None:
+                pronunciation_dict[text] = pronunciation
+
+    missing_texts = sorted(set(texts) - set(pronunciation_dict.keys()))
+    if len(missing_texts) > 0:
+        pronunciations = (service or Phonemizer_Service_Default()).Phonemize(missing_texts, language)
+        pronunciations = [re.sub(whitespace_re, ' ', pronunciation) for pronunciation in pronunciations]
+        pronunciation_dict.update(dict(zip(missing_texts, pronunciations)))
+        if not cache is None:
+            cache.Append(missing_texts, language, pronunciations)
+
+    return [pronunciation_dict[text] for text in texts]
+
+def Pattern_Audio_Load(path, sample_rate: int, hop_size: int):
+    audio = Audio_Load(path, sample_rate)
     audio = librosa.util.normalize(audio) * 0.95
     audio = audio[:audio.shape[0] - (audio.shape[0] % hop_size)]
 
-    latents = encodec.encode(torch.from_numpy(audio)[None, None])[0][0].squeeze(0).numpy()    # [32, Audio_t / 320]
+    return audio
 
-    mel = mel_spectrogram(
-        y= torch.from_numpy(audio).float().unsqueeze(0),
+@torch.inference_mode()
+def Mel_Extract(audios: List[np.ndarray], sample_rate: int, hop_size: int, num_mels: int, batch_size: int= 16):
+    '''
+    audios: list of [Audio_t].
+    Audios are sorted by length and extracted in padded batches. The mels are same to extracting each audio alone.
+    '''
+    mel_extractor = MelExtractor(
         n_fft= hop_size * 4,
         num_mels= num_mels,
         sampling_rate= sample_rate,
@@ -117,44 +282,118 @@ def Pattern_Generate(
         fmin= 0,
         fmax= None,
         center= False
-        ).squeeze(0).numpy()
-
-    f0 = rapt(
-        x= audio * 32768,
-        fs= sample_rate,
-        hopsize= hop_size,
-        min= f0_min,
-        max= f0_max,
-        otype= 1
         )
-    
-    if abs(latents.shape[1] - f0.shape[0]) > 1:
-        return None, None, None, None
-    elif latents.shape[1] > f0.shape[0]:
-        f0 = np.pad(f0, [0, latents.shape[1] - f0.shape[0]], constant_values= 0.0)
-    else:   # mel.shape[1] < f0.shape[0]:
-        audio = np.pad(audio, [0, (f0.shape[0] - latents.shape[1]) * hop_size])
-        latents = np.pad(latents, [[0, 0], [0, f0.shape[0] - latents.shape[1]]], mode= 'edge')
+
+    mels = [None] * len(audios)
+    indices = sorted(range(len(audios)), key= lambda index: audios[index].shape[0])
+    for batch_index in range(0, len(indices), batch_size):
+        batch_indices = indices[batch_index:batch_index + batch_size]
+        batch_mels, mel_lengths = mel_extractor(
+            torch.nn.utils.rnn.pad_sequence([torch.from_numpy(audios[index]).float() for index in batch_indices], batch_first= True),
+            torch.LongTensor([audios[index].shape[0] for index in batch_indices])
+            )
+        for index, mel, mel_length in zip(batch_indices, batch_mels.numpy(), mel_lengths.tolist()):
+            mels[index] = mel[:, :mel_length]
+
+    return mels
+
+def Pattern_Preprocess(
+    audio: np.ndarray,
+    mel: np.ndarray,
+    f0: np.ndarray,
+    hop_size: int
+    ):
+    '''
+    Everything of pattern generation except loading, feature extraction, and Encodec.
+    Mel and F0 are extracted before this, so the features of many audios can be extracted in a batch.
+    The silence is trimmed here before encoding, so the trimmed audio can be encoded alone or in a batch.
+    '''
+    latent_length = audio.shape[0] // hop_size  # Encodec returns one code frame per hop.
+    if abs(latent_length - f0.shape[0]) > 1:
+        return None, None, None
+    elif latent_length > f0.shape[0]:
+        f0 = np.pad(f0, [0, latent_length - f0.shape[0]], constant_values= 0.0)
+    else:   # latent_length < f0.shape[0]:
+        audio = np.pad(audio, [0, (f0.shape[0] - latent_length) * hop_size])
 
     if mel.shape[1] - f0.shape[0] < 0 or mel.shape[1] - f0.shape[0] > 1:
-        return None, None, None, None
+        return None, None, None
     else:
         mel = mel[:, :f0.shape[0]]
         
     nonsilence_frames = np.where(f0 > 0.0)[0]
     if len(nonsilence_frames) < 2:
-        return None, None, None, None
+        return None, None, None
     initial_silence_frame, *_, last_silence_frame = nonsilence_frames
     initial_silence_frame = max(initial_silence_frame - 11, 0)
     last_silence_frame = min(last_silence_frame + 11, f0.shape[0])
     audio = audio[initial_silence_frame * hop_size:last_silence_frame * hop_size]
-    latents = latents[:, initial_silence_frame:last_silence_frame]
     mel = mel[:, initial_silence_frame:last_silence_frame]
     f0 = f0[initial_silence_frame:last_silence_frame]
+
+    return audio, mel, f0
+
+@torch.inference_mode()
+def Encodec_Encode(audios: List[np.ndarray], hop_size: int):
+    '''
+    audios: list of [Audio_t], Audio_t must be a multiple of hop_size.
+    Encodec 24Khz is causal, so zero padding on the right side does not change the codes of the valid frames.
+    Thus, a padded batch returns the same codes as encoding each audio alone.
+    '''
+    lengths = [audio.shape[0] // hop_size for audio in audios]
+    max_audio_length = max([audio.shape[0] for audio in audios])
+    audios = np.stack(
+        [np.pad(audio, [0, max_audio_length - audio.shape[0]]) for audio in audios],
+        axis= 0
+        )
+    latents = encodec.encode(torch.from_numpy(audios).float().unsqueeze(1))[0][0].numpy()  # [Batch, 32, Audio_t / 320]
+
+    return [latent[:, :length] for latent, length in zip(latents, lengths)]
+
+def Pattern_Generate(
+    path,
+    sample_rate: int,
+    hop_size: int,
+    num_mels: int,
+    f0_min: int,
+    f0_max: int,
+    f0_backend: str= 'rapt',
+    f0_device: Optional[str]= None
+    ):
+    audio = Pattern_Audio_Load(path= path, sample_rate= sample_rate, hop_size= hop_size)
+    f0 = F0_Extract(
+        audios= [audio],
+        sample_rate= sample_rate,
+        hop_size= hop_size,
+        f0_min= f0_min,
+        f0_max= f0_max,
+        backend= f0_backend,
+        device= f0_device
+        )[0]
+    mel = Mel_Extract(
+        audios= [audio],
+        sample_rate= sample_rate,
+        hop_size= hop_size,
+        num_mels= num_mels
+        )[0]
+    audio, mel, f0 = Pattern_Preprocess(
+        audio= audio,
+        mel= mel,
+        f0= f0,
+        hop_size= hop_size
+        )
+    if audio is None:
+        return None, None, None, None
+
+    latents = Encodec_Encode([audio], hop_size= hop_size)[0]    # [32, Audio_t / 320]
     
     return audio.astype(np.float16), latents.astype(np.int16), mel.astype(np.float16), f0.astype(np.float16)
 
-def Pattern_File_Generate(path: str, speaker: str, emotion: str, language: str, gender: str, dataset: str, text: str, pronunciation: str, tag: str='', eval: bool= False):
+def Pattern_File_Path(path: str, speaker: str, dataset: str, tag: str='', eval: bool= False):
+    '''
+    Returns the pattern file path and whether the pattern file already exists in train or eval pattern path.
+    The existence check is only for the patterns which are not in the manifest, like patterns generated before the manifest.
+    '''
     pattern_path = hp.Train.Eval_Pattern.Path if eval else hp.Train.Train_Pattern.Path
 
     file = '{}.{}{}.PICKLE'.format(
@@ -162,24 +401,27 @@ def Pattern_File_Generate(path: str, speaker: str, emotion: str, language: str,
         '{}.'.format(tag) if tag != '' else '',
         os.path.splitext(os.path.basename(path))[0]
         ).upper()
-    if any([
+    exists = any([
         os.path.exists(os.path.join(x, dataset, speaker, file).replace("\\", "/"))
         for x in [hp.Train.Eval_Pattern.Path, hp.Train.Train_Pattern.Path]
-        ]):
-        return
-    file = os.path.join(pattern_path, dataset, speaker, file).replace("\\", "/")
+        ])
 
-    audio, latent, mel, f0 = Pattern_Generate(
-        path= path,
-        sample_rate= hp.Sound.Sample_Rate,
-        hop_size= hp.Sound.Frame_Shift,
-        num_mels= hp.Sound.Mel_Dim,
-        f0_min= hp.Sound.F0_Min,
-        f0_max= hp.Sound.F0_Max
-        )
-    if audio is None:
-        return
-     
+    return os.path.join(pattern_path, dataset, speaker, file).replace("\\", "/"), exists
+
+def Pattern_File_Save(
+    file: str,
+    audio: np.ndarray,
+    latent: np.ndarray,
+    mel: np.ndarray,
+    f0: np.ndarray,
+    speaker: str,
+    emotion: str,
+    language: str,
+    gender: str,
+    dataset: str,
+    text: str,
+    pronunciation: str
+    ):
     new_Pattern_dict = {
         'Audio': audio,
         'Latent': latent,
@@ -194,75 +436,288 @@ def Pattern_File_Generate(path: str, speaker: str, emotion: str, language: str,
         'Pronunciation': pronunciation
         }
 
-    os.makedirs(os.path.join(pattern_path, dataset, speaker).replace('\\', '/'), exist_ok= True)
-    with open(file, 'wb') as f:
+    # The pattern is written to a temporary file and renamed, so a crash cannot leave a truncated pattern file.
+    os.makedirs(os.path.dirname(file), exist_ok= True)
+    with open(file + '.tmp', 'wb') as f:
         pickle.dump(new_Pattern_dict, f, protocol=4)
+    os.replace(file + '.tmp', file)
+
+def Pattern_File_Generate(path: str, speaker: str, emotion: str, language: str, gender: str, dataset: str, text: str, pronunciation: str, tag: str='', eval: bool= False):
+    file, exists = Pattern_File_Path(path= path, speaker= speaker, dataset= dataset, tag= tag, eval= eval)
+    if exists:
+        return path, 'Exists', file
+
+    audio, latent, mel, f0 = Pattern_Generate(
+        path= path,
+        sample_rate= hp.Sound.Sample_Rate,
+        hop_size= hp.Sound.Frame_Shift,
+        num_mels= hp.Sound.Mel_Dim,
+        f0_min= hp.Sound.F0_Min,
+        f0_max= hp.Sound.F0_Max,
+        f0_backend= hp.Sound.F0_Backend,
+        f0_device= hp.Sound.F0_Device
+        )
+    if audio is None:
+        return path, 'Rejected', file
+    
+    Pattern_File_Save(file, audio, latent, mel, f0, speaker, emotion, language, gender, dataset, text, pronunciation)
+
+    return path, 'Done', file
 
-def Selvas_Info_Load(path: str):
+def Pattern_File_Generate_Batch(params_list: List[Tuple], encode_batch_size: int):
     '''
-    ema, emb, emf, emg, emh, nea, neb, nec, ned, nee, nek, nel, nem, nen, neo
-    1-100: Neutral
-    101-200: Happy
-    201-300: Sad
-    301-400: Angry
+    params_list: list of Pattern_File_Generate parameters.
+    F0 of all audios is extracted in one backend call, and mels are extracted in padded batches.
+    Patterns are sorted by the trimmed audio length, and similar length patterns are encoded in one padded call.
+    The codes are same to Pattern_File_Generate.
+    '''
+    results = []
+    loaded_list = []
+    for params in params_list:
+        path, speaker, emotion, language, gender, dataset, text, pronunciation, tag, eval = params
+        file, exists = Pattern_File_Path(path= path, speaker= speaker, dataset= dataset, tag= tag, eval= eval)
+        if exists:
+            results.append((path, 'Exists', file))
+            continue
+        audio = Pattern_Audio_Load(path= path, sample_rate= hp.Sound.Sample_Rate, hop_size= hp.Sound.Frame_Shift)
+        loaded_list.append((file, audio, params))
 
-    lmy, ava, avb, avc, avd, ada, adb, adc, add:
-    all neutral
+    f0s = F0_Extract(
+        audios= [audio for _, audio, _ in loaded_list],
+        sample_rate= hp.Sound.Sample_Rate,
+        hop_size= hp.Sound.Frame_Shift,
+        f0_min= hp.Sound.F0_Min,
+        f0_max= hp.Sound.F0_Max,
+        backend= hp.Sound.F0_Backend,
+        device= hp.Sound.F0_Device
+        ) if len(loaded_list) > 0 else []
+    mels = Mel_Extract(
+        audios= [audio for _, audio, _ in loaded_list],
+        sample_rate= hp.Sound.Sample_Rate,
+        hop_size= hp.Sound.Frame_Shift,
+        num_mels= hp.Sound.Mel_Dim,
+        batch_size= encode_batch_size
+        )
+
+    preprocessed_list = []
+    for (file, audio, params), mel, f0 in zip(loaded_list, mels, f0s):
+        path = params[0]
+        audio, mel, f0 = Pattern_Preprocess(
+            audio= audio,
+            mel= mel,
+            f0= f0,
+            hop_size= hp.Sound.Frame_Shift
+            )
+        if audio is None:
+            results.append((path, 'Rejected', file))
+            continue
+        preprocessed_list.append((file, audio, mel, f0, params))
+
+    preprocessed_list = sorted(preprocessed_list, key= lambda x: x[1].shape[0])
+    for index in range(0, len(preprocessed_list), encode_batch_size):
+        batch = preprocessed_list[index:index + encode_batch_size]
+        latents = Encodec_Encode([audio for _, audio, _, _, _ in batch], hop_size= hp.Sound.Frame_Shift)
+        for (file, audio, mel, f0, params), latent in zip(batch, latents):
+            path, speaker, emotion, language, gender, dataset, text, pronunciation, tag, eval = params
+            Pattern_File_Save(
+                file,
+                audio.astype(np.float16),
+                latent.astype(np.int16),
+                mel.astype(np.float16),
+                f0.astype(np.float16),
+                speaker, emotion, language, gender, dataset, text, pronunciation
+                )
+            results.append((path, 'Done', file))
+
+    return results
+
+def Pattern_File_Generate_by_Params(params: Tuple):
+    '''
+    Process pool cannot pickle lambda, so this module level function is used.
+    '''
+    return [Pattern_File_Generate(*params)]
+
+class Generation_Manifest:
     '''
-    paths = []
+    The journal of the source files whose pattern generation is finished.
+    Each line is 'Status\tSource_Path\tPattern_File'.
+    Status is 'Done', 'Exists' or 'Rejected'. 'Rejected' means the source failed the length or silence check, so it is not tried again.
+    A line is written only after the pattern file is renamed to its final path, so every journaled pattern is complete.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.status_dict = {}
+        self.file_dict = {}
+
+        if os.path.exists(path):
+            lines = open(path, 'r', encoding= 'utf-8-sig').read()
+            for line in lines.split('\n'):
+                line = line.split('\t')
+                if len(line) != 3 or not line[0] in ['Done', 'Exists', 'Rejected']:    # The last line can be cut by a crash.
+                    continue
+                status, source_path, file = line
+                self.status_dict[source_path] = status
+                self.file_dict[source_path] = file
+            cut_last_line = len(lines) > 0 and not lines.endswith('\n')
+        else:
+            cut_last_line = False
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok= True)
+        self.file = open(path, 'a', encoding= 'utf-8')
+        if cut_last_line:
+            self.file.write('\n')
+
+    def __contains__(self, source_path: str):
+        return source_path in self.status_dict
+
+    def __len__(self):
+        return len(self.status_dict)
+
+    def Append(self, source_path: str, status: str, file: str):
+        self.file.write('{}\t{}\t{}\n'.format(status, source_path, file))
+        self.file.flush()
+        self.status_dict[source_path] = status
+        self.file_dict[source_path] = file
+
+    def Files(self):
+        '''
+        Returns the pattern files which exist.
+        '''
+        return [
+            self.file_dict[source_path]
+            for source_path, status in self.status_dict.items()
+            if status in ['Done', 'Exists']
+            ]
+
+    def close(self):
+        self.file.close()
+
+def Worker_Initialize(hyper_parameters_path: str, num_threads: int= 1):
+    '''
+    Each process worker loads its own hyper parameters and Encodec only once.
+    num_threads: The intra-op thread count of torch in the worker.
+    '''
+    global hp, encodec
+    hp = Recursive_Parse(yaml.load(
+        open(hyper_parameters_path, encoding='utf-8'),
+        Loader=yaml.Loader
+        ))
+    torch.set_num_threads(num_threads)
+    encodec = EncodecModel.encodec_model_24khz()
+
+def Parallel_Map(
+    function,
+    params_list,
+    max_worker: int,
+    use_process: bool= False,
+    hyper_parameters_path: Optional[str]= None,
+    worker_threads: int= 1,
+    chunk_size: int= 1
+    ):
+    '''
+    Yields the results of thread pool in order, and the results of process pool in completion order.
+    '''
+    if not use_process:
+        with PE(max_workers= max_worker) as pe:
+            yield from pe.map(function, params_list)
+        return
+
+    # 'spawn' is used because a forked torch/OpenMP runtime can hang in the child.
+    with mp.get_context('spawn').Pool(
+        processes= max_worker,
+        initializer= Worker_Initialize,
+        initargs= (hyper_parameters_path, worker_threads)
+        ) as pool:
+        yield from pool.imap_unordered(function, params_list, chunksize= chunk_size)
+
+def Pattern_File_Generate_Parallel(
+    params_list: List[Tuple],
+    max_worker: int,
+    use_process: bool= False,
+    hyper_parameters_path: Optional[str]= None,
+    worker_threads: int= 1,
+    chunk_size: int= 16,
+    encode_batch_size: int= 1,
+    manifest: Optional[Generation_Manifest]= None
+    ):
+    def Journal(results: List[Tuple[str, str, str]]):
+        if not manifest is None:
+            for source_path, status, file in results:
+                manifest.Append(source_path, status, file)
+        progress.update(len(results))
+
+    total = len(params_list)
+    if encode_batch_size > 1:
+        # Four batches are collected at once so that the sorted batches have similar lengths.
+        generate_function = functools.partial(Pattern_File_Generate_Batch, encode_batch_size= encode_batch_size)
+        params_list = [
+            params_list[index:index + encode_batch_size * 4]
+            for index in range(0, len(params_list), encode_batch_size * 4)
+            ]
+        chunk_size = 1
+    else:
+        generate_function = Pattern_File_Generate_by_Params
+
+    progress = tqdm(total= total)
+    for results in Parallel_Map(
+        function= generate_function,
+        params_list= params_list,
+        max_worker= max_worker,
+        use_process= use_process,
+        hyper_parameters_path= hyper_parameters_path,
+        worker_threads= worker_threads,
+        chunk_size= chunk_size
+        ):
+        Journal(results)
+    progress.close()
+
+class Pattern_Info(NamedTuple):
+    '''
+    One source utterance. Path is the first field, so sorting infos is same to sorting their paths.
+    '''
+    Path: str
+    Text: str
+    Speaker: str
+    Emotion: str
+    Language: Optional[str]
+    Gender: Optional[str]
+    Dataset: str
+    Tag: str= ''
+
+def Thread_Map(function, iterable, max_worker: int= 16, buffer_size: Optional[int]= None):
+    '''
+    Ordered lazy map by a thread pool for file reads and existence checks.
+    At most buffer_size items are in flight, so a huge iterable is not materialized.
+    '''
+    buffer_size = buffer_size or max_worker * 4
+    with PE(max_workers= max_worker) as pe:
+        futures = deque()
+        for item in iterable:
+            futures.append(pe.submit(function, item))
+            if len(futures) >= buffer_size:
+                yield futures.popleft().result()
+        while len(futures) > 0:
+            yield futures.popleft().result()
+
+def Audio_File_Walk(path: str):
     for root, _, files in os.walk(path):
         for file in files:
             file = os.path.join(root, file).replace('\\', '/')
             if not os.path.splitext(file)[1].upper() in using_extension:
                 continue
-            if any(['lmy04282' in file, 'lmy07365' in file, 'lmy05124' in file]):
-                continue
-            paths.append(file)
-
-    text_dict = {}
-    
-    for wav_path in paths:
-        text = open(wav_path.replace('/wav/', '/transcript/').replace('.wav', '.txt'), 'r', encoding= 'utf-8-sig').readlines()[0].strip()
-        text = Text_Filtering(text)
-        if text is None:
-            continue
-
-        text_dict[wav_path] = text
-
-    paths = list(text_dict.keys())
-
-    pronunciations = Phonemize(
-        texts= [text_dict[path] for path in paths],
-        language= 'Korean'
-        )    
-    pronunciation_dict = {path: pronunciation for path, pronunciation in zip(paths, pronunciations)}
-
-    speaker_dict = {
-        path: path.split('/')[-3].strip().upper()
-        for path in paths
-        }
-    
-    emotion_dict = {}
-    for path in paths:
-        if speaker_dict[path] in ['LMY', 'KIH', 'AVA', 'AVB', 'AVC', 'AVD', 'ADA', 'ADB', 'ADC', 'ADD', 'PFA', 'PFB', 'PFC', 'PFD', 'PFI', 'PFL', 'PFM', 'PFO', 'PFP', 'PMA', 'PMB', 'PMC', 'PMD', 'PMI', 'PMJ', 'PML']:
-            emotion_dict[path] = 'Neutral'
-        elif speaker_dict[path] in ['EMA', 'EMB', 'EMF', 'EMG', 'EMH', 'NEA', 'NEB', 'NEC', 'NED', 'NEE', 'NEK', 'NEL', 'NEM', 'NEN', 'NEO']:
-            index = int(os.path.splitext(os.path.basename(path))[0][-5:])
-            if index > 0 and index < 101:
-                emotion_dict[path] = 'Neutral'
-            elif index > 100 and index < 201:
-                emotion_dict[path] = 'Happy'
-            elif index > 200 and index < 301:
-                emotion_dict[path] = 'Sad'
-            elif index > 300 and index < 401:
-                emotion_dict[path] = 'Angry'
-            else:
-                raise NotImplementedError('Unknown emotion index: {}'.format(index))
-        else:
-            raise NotImplementedError('Unknown speaker: {}'.format(speaker_dict[path]))
+            yield file
 
-    language_dict = {path: 'Korean' for path in paths}
+def Selvas_Info_Load(path: str, max_worker: int= 16):
+    '''
+    ema, emb, emf, emg, emh, nea, neb, nec, ned, nee, nek, nel, nem, nen, neo
+    1-100: Neutral
+    101-200: Happy
+    201-300: Sad
+    301-400: Angry
 
+    lmy, ava, avb, avc, avd, ada, adb, adc, add:
+    all neutral
+    '''
     gender_dict = {
         'ADA': 'Female',
         'ADB': 'Female',
@@ -306,115 +761,107 @@ def Selvas_Info_Load(path: str):
         'PMJ': 'Male',
         'PML': 'Male',
         }
-    gender_dict = {
-        path: gender_dict[speaker]
-        for path, speaker in speaker_dict.items()
-        }
 
-    print('Selvas info generated: {}'.format(len(paths)))
-    return paths, text_dict, pronunciation_dict, speaker_dict, emotion_dict, language_dict, gender_dict
+    def Emotion(path: str, speaker: str):
+        if speaker in ['LMY', 'KIH', 'AVA', 'AVB', 'AVC', 'AVD', 'ADA', 'ADB', 'ADC', 'ADD', 'PFA', 'PFB', 'PFC', 'PFD', 'PFI', 'PFL', 'PFM', 'PFO', 'PFP', 'PMA', 'PMB', 'PMC', 'PMD', 'PMI', 'PMJ', 'PML']:
+            return 'Neutral'
+        elif speaker in ['EMA', 'EMB', 'EMF', 'EMG', 'EMH', 'NEA', 'NEB', 'NEC', 'NED', 'NEE', 'NEK', 'NEL', 'NEM', 'NEN', 'NEO']:
+            index = int(os.path.splitext(os.path.basename(path))[0][-5:])
+            if index > 0 and index < 101:
+                return 'Neutral'
+            elif index > 100 and index < 201:
+                return 'Happy'
+            elif index > 200 and index < 301:
+                return 'Sad'
+            elif index > 300 and index < 401:
+                return 'Angry'
+            else:
+                raise NotImplementedError('Unknown emotion index: {}'.format(index))
+        else:
+            raise NotImplementedError('Unknown speaker: {}'.format(speaker))
+
+    def Info_Load(wav_path: str):
+        text = open(wav_path.replace('/wav/', '/transcript/').replace('.wav', '.txt'), 'r', encoding= 'utf-8-sig').readlines()[0].strip()
+        text = Text_Filtering(text)
+        if text is None:
+            return None
+        speaker = wav_path.split('/')[-3].strip().upper()
+
+        return Pattern_Info(wav_path, text, speaker, Emotion(wav_path, speaker), 'Korean', gender_dict[speaker], 'Selvas')
+
+    wav_paths = (
+        file
+        for file in Audio_File_Walk(path)
+        if not any(['lmy04282' in file, 'lmy07365' in file, 'lmy05124' in file])
+        )
+    count = 0
+    for info in Thread_Map(Info_Load, wav_paths, max_worker= max_worker):
+        if info is None:
+            continue
+        count += 1
+        yield info
+
+    print('Selvas info generated: {}'.format(count))
 
-def KSS_Info_Load(path: str):
+def KSS_Info_Load(path: str, max_worker: int= 16):
     '''
     all neutral
     '''
-    paths, text_dict = [], {}
-    for line in open(os.path.join(path, 'transcript.v.1.4.txt').replace('\\', '/'), 'r', encoding= 'utf-8-sig').readlines():
+    count = 0
+    for line in open(os.path.join(path, 'transcript.v.1.4.txt').replace('\\', '/'), 'r', encoding= 'utf-8-sig'):
         line = line.strip().split('|')
         file, text = line[0].strip(), line[2].strip()
         text = Text_Filtering(text)
         if text is None:
             continue
-        
-        file = os.path.join(path, 'kss', file).replace('\\', '/')
-        paths.append(file)
-        text_dict[file] = text
-
-    pronunciations = Phonemize(
-        texts= [text_dict[path] for path in paths],
-        language= 'Korean'
-        )    
-    pronunciation_dict = {path: pronunciation for path, pronunciation in zip(paths, pronunciations)}
-
-    speaker_dict = {
-        path: 'KSS'
-        for path in paths
-        }
-    emotion_dict = {
-        path: 'Neutral'
-        for path in paths
-        }
-    language_dict = {
-        path: 'Korean'
-        for path in paths
-        }
-    gender_dict = {
-        path: 'Female'
-        for path in paths
-        }
 
-    print('KSS info generated: {}'.format(len(paths)))
-    return paths, text_dict, pronunciation_dict, speaker_dict, emotion_dict, language_dict, gender_dict
+        count += 1
+        yield Pattern_Info(os.path.join(path, 'kss', file).replace('\\', '/'), text, 'KSS', 'Neutral', 'Korean', 'Female', 'KSS')
+
+    print('KSS info generated: {}'.format(count))
 
-def AIHub_Info_Load(path: str):
+def AIHub_Info_Load(path: str, max_worker: int= 16):
     emotion_label_dict = {
         'Neutrality': 'Neutral'
         }
 
-    skip_info_keys = []
-    info_dict = {}
+    wav_path_dict, json_path_dict = {}, {}
     for root, _, files in os.walk(path):
         for file in files:
             key, extension = os.path.splitext(file)
-            if not key in info_dict.keys():
-                info_dict[key] = {}
-            
-            path = os.path.join(root, file).replace('\\', '/')
+            file = os.path.join(root, file).replace('\\', '/')
             if extension.upper() == '.WAV':
-                info_dict[key]['Path'] = path
+                wav_path_dict[key] = file
             elif extension.upper() == '.JSON':
-                pattern_info = json.load(open(path, encoding= 'utf-8-sig'))
-                text = Text_Filtering(pattern_info['전사정보']['TransLabelText'].replace('\xa0', ' '))
-                if text is None:
-                    skip_info_keys.append(key)
-                    continue
-
-                info_dict[key]['Text'] = text
-                info_dict[key]['Speaker'] = 'AIHub_{}'.format(pattern_info['화자정보']['SpeakerName'])
-                info_dict[key]['Gender'] = pattern_info['화자정보']['Gender']
-                info_dict[key]['Emotion'] = emotion_label_dict[pattern_info['화자정보']['Emotion']]
+                json_path_dict[key] = file
             else:
-                raise ValueError(f'Unsupported file type: {path}')
+                raise ValueError(f'Unsupported file type: {file}')
 
-    for key in skip_info_keys:
-        info_dict.pop(key, None)
-    
-    paths = [info['Path'] for info in info_dict.values()]
-    text_dict = {
-        info['Path']: info['Text']  for info in info_dict.values()
-        }
-    pronunciations = Phonemize(
-        texts= [text_dict[path] for path in paths],
-        language= 'Korean'
-        )    
-    pronunciation_dict = {path: pronunciation for path, pronunciation in zip(paths, pronunciations)}
-
-    speaker_dict = {
-        info['Path']: info['Speaker']  for info in info_dict.values()
-        }
-    emotion_dict = {
-        info['Path']: info['Emotion']  for info in info_dict.values()
-        }
-    language_dict = {
-        path: 'Korean'
-        for path in paths
-        }
-    gender_dict = {
-        info['Path']: info['Gender']  for info in info_dict.values()
-        }
+    def Info_Load(key: str):
+        pattern_info = json.load(open(json_path_dict[key], encoding= 'utf-8-sig'))
+        text = Text_Filtering(pattern_info['전사정보']['TransLabelText'].replace('\xa0', ' '))
+        if text is None:
+            return None
+
+        return Pattern_Info(
+            wav_path_dict[key],
+            text,
+            'AIHub_{}'.format(pattern_info['화자정보']['SpeakerName']),
+            emotion_label_dict[pattern_info['화자정보']['Emotion']],
+            'Korean',
+            pattern_info['화자정보']['Gender'],
+            'AIHub'
+            )
+
+    count = 0
+    keys = [key for key in json_path_dict.keys() if key in wav_path_dict.keys()]
+    for info in Thread_Map(Info_Load, keys, max_worker= max_worker):
+        if info is None:
+            continue
+        count += 1
+        yield info
 
-    print('AIHub info generated: {}'.format(len(paths)))
-    return paths, text_dict, pronunciation_dict, speaker_dict, emotion_dict, language_dict, gender_dict
+    print('AIHub info generated: {}'.format(count))
 
 def Basic_Info_Load(
     path: str,
@@ -429,108 +876,37 @@ def Basic_Info_Load(
     language: The language of dataset or speaker. When dataset is multi language, this parameter is dictionary that key and value are speaker and language, resplectly.
     gender: The gender of dataset or speaker. When dataset is multi language, this parameter is dictionary that key and value are speaker and gender, resplectly.
     '''
-    paths = []
-    for root, _, files in os.walk(path):
-        for file in files:
-            file = os.path.join(root, file).replace('\\', '/')
-            if not os.path.splitext(file)[1].upper() in using_extension:
+    count = 0
+    with open(os.path.join(path, 'scripts.txt').replace('\\', '/'), 'r', encoding= 'utf-8-sig') as f:
+        next(f, None)
+        for line in f:
+            file, text, speaker, emotion = line.strip().split('\t')
+            speaker = speaker.strip()
+            speaker_language = language[speaker] if type(language) == dict else language
+            speaker_gender = gender[speaker] if type(gender) == dict else gender
+            if speaker_language == 'English':
+                text = unidecode(text)  # When English script, unidecode called.
+            text = Text_Filtering(text)
+            if text is None:
                 continue
-            paths.append(file)
-    
-    text_dict = {}
-    speaker_dict = {}
-    emotion_dict = {}
-
-    for line in open(os.path.join(path, 'scripts.txt').replace('\\', '/'), 'r', encoding= 'utf-8-sig').readlines()[1:]:
-        file, text, speaker, emotion = line.strip().split('\t')
-        if (type(language) == str and language == 'English') or (type(language) == dict and language[speaker] == 'English'):
-            text = unidecode(text)  # When English script, unidecode called.
-        text = Text_Filtering(text)
-        if text is None:
-            continue
-        
-        text_dict[os.path.join(path, file).replace('\\', '/')] = text
-        speaker_dict[os.path.join(path, file).replace('\\', '/')] = speaker.strip()
-        emotion_dict[os.path.join(path, file).replace('\\', '/')] = emotion.strip()
 
-    paths = list(text_dict.keys())
+            count += 1
+            yield Pattern_Info(
+                os.path.join(path, file).replace('\\', '/'),
+                text,
+                speaker,
+                emotion.strip(),
+                speaker_language,
+                speaker_gender,
+                dataset_label
+                )
 
-    language_dict = {path: language for path in paths}
+    print('{} info generated: {}'.format(dataset_label, count))
 
-    if type(language) == str or language is None:
-        language_dict = {path: language for path in paths}
-    elif type(language) == dict:
-        language_dict = {
-            path: language[speaker]
-            for path, speaker in speaker_dict.items()
-            }
-
-    if type(gender) == str or gender is None:
-        gender_dict = {path: gender for path in paths}
-    elif type(gender) == dict:
-        gender_dict = {
-            path: gender[speaker]
-            for path, speaker in speaker_dict.items()
-            }
-
-    pronunciation_dict = {}
-    for language in set(language_dict.values()):
-        language_paths = [path for path in paths if language_dict[path] == language]
-        language_pronunciations = Phonemize(
-            texts= [text_dict[path] for path in language_paths],
-            language= language
-            )
-        pronunciation_dict.update({
-            path: pronunciation
-            for path, pronunciation in zip(language_paths, language_pronunciations)
-            })
-
-    print('{} info generated: {}'.format(dataset_label, len(paths)))
-    return paths, text_dict, pronunciation_dict, speaker_dict, emotion_dict, language_dict, gender_dict
-
-
-def VCTK_Info_Load(path: str):
+def VCTK_Info_Load(path: str, max_worker: int= 16):
     '''
     VCTK v0.92 is distributed as flac files.
     '''
-    path = os.path.join(path, 'wav48_silence_trimmed').replace('\\', '/')
-    
-    paths = []
-    for root, _, files in os.walk(path):
-        for file in files:
-            file = os.path.join(root, file).replace('\\', '/')
-            if not os.path.splitext(file)[1].upper() in using_extension:
-                continue
-            elif '_mic1' in file:
-                continue
-
-            paths.append(file)
-
-    text_dict = {}
-    for path in paths:
-        if 'p315'.upper() in path.upper():  #Officially, 'p315' text is lost in VCTK dataset.
-            continue
-        text = Text_Filtering(unidecode(open(path.replace('wav48_silence_trimmed', 'txt').replace('flac', 'txt').replace('_mic2', ''), 'r').readlines()[0]))
-        if text is None:
-            continue
-        
-        text_dict[path] = text
-            
-    paths = list(text_dict.keys())
-    pronunciations = Phonemize(
-        texts= [text_dict[path] for path in paths],
-        language= 'English'
-        )    
-    pronunciation_dict = {path: pronunciation for path, pronunciation in zip(paths, pronunciations)}
-
-    speaker_dict = {
-        path: 'VCTK.{}'.format(path.split('/')[-2].strip().upper())
-        for path in paths
-        }
-
-    emotion_dict = {path: 'Neutral' for path in paths}
-    language_dict = {path: 'English' for path in paths}
-
     gender_dict = {
         'VCTK.P225': 'Female',
         'VCTK.P226': 'Male',
@@ -642,166 +1018,223 @@ def VCTK_Info_Load(path: str):
         'VCTK.P376': 'Male',
         'VCTK.S5': 'Female',
         }
-    gender_dict = {
-        path: gender_dict[speaker]
-        for path, speaker in speaker_dict.items()
-        }
 
-    print('VCTK info generated: {}'.format(len(paths)))
-
-    return paths, text_dict, pronunciation_dict, speaker_dict, emotion_dict, language_dict, gender_dict
+    def Info_Load(file: str):
+        text = Text_Filtering(unidecode(open(file.replace('wav48_silence_trimmed', 'txt').replace('flac', 'txt').replace('_mic2', ''), 'r').readlines()[0]))
+        if text is None:
+            return None
+        speaker = 'VCTK.{}'.format(file.split('/')[-2].strip().upper())
 
-def Libri_Info_Load(path: str):
-    paths = []
-    for root, _, files in os.walk(path):
-        for file in files:
-            file_path = os.path.join(root, file).replace('\\', '/')
-            if not os.path.splitext(file_path)[1].upper() in using_extension:
-                continue
-            paths.append(file_path)
+        return Pattern_Info(file, text, speaker, 'Neutral', 'English', gender_dict[speaker], 'VCTK')
 
-    text_dict = {}
-    for file_path in paths:
-        text = Text_Filtering(unidecode(open('{}.normalized.txt'.format(os.path.splitext(file_path)[0]), 'r', encoding= 'utf-8-sig').readlines()[0]))
-        if text is None:
+    files = (
+        file
+        for file in Audio_File_Walk(os.path.join(path, 'wav48_silence_trimmed').replace('\\', '/'))
+        if not '_mic1' in file and not 'p315'.upper() in file.upper()  #Officially, 'p315' text is lost in VCTK dataset.
+        )
+    count = 0
+    for info in Thread_Map(Info_Load, files, max_worker= max_worker):
+        if info is None:
             continue
-        
-        text_dict[file_path] = text
-
-    paths = list(text_dict.keys())
-    pronunciations = Phonemize(
-        texts= [text_dict[path] for path in paths],
-        language= 'English'
-        )    
-    pronunciation_dict = {path: pronunciation for path, pronunciation in zip(paths, pronunciations)}
-
-    speaker_dict = {
-        path: 'Libri.{:04d}'.format(int(path.split('/')[-3].strip().upper()))
-        for path in paths
-        }
+        count += 1
+        yield info
 
-    emotion_dict = {path: 'Neutral' for path in paths}
-    language_dict = {path: 'English' for path in paths}
+    print('VCTK info generated: {}'.format(count))
 
+def Libri_Info_Load(path: str, max_worker: int= 16):
     gender_dict = {}
     for line in open(os.path.join(os.path.join(path, 'SPEAKERS.txt').replace('\\', '/')), 'r', encoding= 'utf-8-sig').readlines()[12:]:
         speaker, gender, *_ = [x.strip() for x in line.strip().split('|')]
         gender_dict[f'Libri.{int(speaker):04d}'] = 'Male' if gender == 'M' else 'Female'
-    gender_dict = {
-        path: gender_dict[speaker]
-        for path, speaker in speaker_dict.items()
-        }
 
-    print('Libri info generated: {}'.format(len(paths)))
-    return paths, text_dict, pronunciation_dict, speaker_dict, emotion_dict, language_dict, gender_dict
+    def Info_Load(file_path: str):
+        text = Text_Filtering(unidecode(open('{}.normalized.txt'.format(os.path.splitext(file_path)[0]), 'r', encoding= 'utf-8-sig').readlines()[0]))
+        if text is None:
+            return None
+        speaker = 'Libri.{:04d}'.format(int(file_path.split('/')[-3].strip().upper()))
 
-def LJ_Info_Load(path: str):
-    paths = []
-    for root, _, files in os.walk(path):
-        for file in files:
-            file = os.path.join(root, file).replace('\\', '/')
-            if not os.path.splitext(file)[1].upper() in using_extension:
-                continue
-            paths.append(file)
+        return Pattern_Info(file_path, text, speaker, 'Neutral', 'English', gender_dict[speaker], 'Libri')
 
-    text_dict = {}
-    for line in open(os.path.join(path, 'metadata.csv').replace('\\', '/'), 'r', encoding= 'utf-8-sig').readlines():
-        line = line.strip().split('|')        
+    count = 0
+    for info in Thread_Map(Info_Load, Audio_File_Walk(path), max_worker= max_worker):
+        if info is None:
+            continue
+        count += 1
+        yield info
+
+    print('Libri info generated: {}'.format(count))
+
+def LJ_Info_Load(path: str, max_worker: int= 16):
+    count = 0
+    for line in open(os.path.join(path, 'metadata.csv').replace('\\', '/'), 'r', encoding= 'utf-8-sig'):
+        line = line.strip().split('|')
         text = Text_Filtering(unidecode(line[2].strip()))
         if text is None:
             continue
-        wav_path = os.path.join(path, 'wavs', '{}.wav'.format(line[0]))
-        
-        text_dict[wav_path] = text
 
-    paths = list(text_dict.keys())
+        count += 1
+        yield Pattern_Info(os.path.join(path, 'wavs', '{}.wav'.format(line[0])), text, 'LJ', 'Neutral', 'English', 'Female', 'LJ')
 
-    pronunciations = Phonemize(
-        texts= [text_dict[path] for path in paths],
-        language= 'English'
-        )    
-    pronunciation_dict = {path: pronunciation for path, pronunciation in zip(paths, pronunciations)}
-    
-    speaker_dict = {
-        path: 'LJ'
-        for path in paths
-        }
-    emotion_dict = {path: 'Neutral' for path in paths}
-    language_dict = {path: 'English' for path in paths}
-    gender_dict = {path: 'Female' for path in paths}
-
-    print('LJ info generated: {}'.format(len(paths)))
-    return paths, text_dict, pronunciation_dict, speaker_dict, emotion_dict, language_dict, gender_dict
-
-def MLS_Info_Load(path: str):
-    paths, texts, speakers = [], [], []
-    for partition in ['dev', 'test', 'train']:
-        for line in open(os.path.join(path, partition, 'transcripts.txt').replace('\\', '/'), 'r', encoding= 'utf-8-sig').readlines():
-            file_path, text = line.strip().split('\t')
-            speaker, book_id, _ = file_path.strip().split('_')
-            file_path = os.path.join(path, partition, 'audio', speaker, book_id, f'{file_path}.opus')
-            if not os.path.exists(file_path):
-                continue                        
-            text = Text_Filtering(unidecode(text))
-            if text is None:
-                continue            
-            paths.append(file_path)
-            texts.append(text)
-            speakers.append(int(speaker))
-
-    text_dict = {
-        path: text
-        for path, text in zip(paths, texts)
-        }
-    
-    pronunciations = Phonemize(
-        texts= texts,
-        language= 'English'
-        )    
-    pronunciation_dict = {
-        path: pronunciation
-        for path, pronunciation in zip(paths, pronunciations)
-        }
+    print('LJ info generated: {}'.format(count))
 
-    speaker_dict = {
-        path: f'MLS.{speaker:05d}'
-        for path, speaker in zip(paths, speakers)
-        }
-    emotion_dict = {path: 'Neutral' for path in paths}
-    language_dict = {path: 'English' for path in paths}
-    
+def MLS_Info_Load(path: str, max_worker: int= 16):
+    '''
+    The transcripts are streamed line by line, and the existence of the audio files is checked by a thread pool.
+    '''
     gender_dict = {}
     for line in open(os.path.join(os.path.join(path, 'metainfo.txt').replace('\\', '/')), 'r', encoding= 'utf-8-sig').readlines()[1:]:
         speaker, gender, *_ = [x.strip() for x in line.strip().split('|')]
         gender_dict[int(speaker)] = 'Male' if gender == 'M' else 'Female'
-    gender_dict = {
-        path: gender_dict[speaker]
-        for path, speaker in zip(paths, speakers)
-        }
 
-    print('MLS info generated: {}'.format(len(paths)))
-    return paths, text_dict, pronunciation_dict, speaker_dict, emotion_dict, language_dict, gender_dict
+    def Line_Generate():
+        for partition in ['dev', 'test', 'train']:
+            with open(os.path.join(path, partition, 'transcripts.txt').replace('\\', '/'), 'r', encoding= 'utf-8-sig') as f:
+                for line in f:
+                    yield partition, line
+
+    def Info_Load(params: Tuple[str, str]):
+        partition, line = params
+        file_path, text = line.strip().split('\t')
+        speaker, book_id, _ = file_path.strip().split('_')
+        file_path = os.path.join(path, partition, 'audio', speaker, book_id, f'{file_path}.opus')
+        if not os.path.exists(file_path):
+            return None
+        text = Text_Filtering(unidecode(text))
+        if text is None:
+            return None
+        speaker = int(speaker)
 
-def Split_Eval(paths: List[str], eval_ratio: float= 0.001, min_eval: int= 1):
-    shuffle(paths)
+        return Pattern_Info(file_path, text, f'MLS.{speaker:05d}', 'Neutral', 'English', gender_dict[speaker], 'MLS')
+
+    count = 0
+    for info in Thread_Map(Info_Load, Line_Generate(), max_worker= max_worker):
+        if info is None:
+            continue
+        count += 1
+        yield info
+
+    print('MLS info generated: {}'.format(count))
+
+def Pronunciation_Dict_Generate(
+    infos: List[Pattern_Info],
+    cache_path: Optional[str]= None,
+    service: Optional[Phonemizer_Service]= None
+    ):
+    '''
+    Info loaders do not phonemize, so only the infos which are not generated yet are phonemized here.
+    cache_path: The texts phonemized by previous runs are read from the phoneme cache.
+    Returns the pronunciation dict by path.
+    '''
+    pronunciation_dict = {}
+    for language in set([info.Language for info in infos]):
+        language_infos = [info for info in infos if info.Language == language]
+        language_pronunciations = Phonemize(
+            texts= [info.Text for info in language_infos],
+            language= language,
+            cache_path= cache_path,
+            service= service
+            )
+        pronunciation_dict.update({
+            info.Path: pronunciation
+            for info, pronunciation in zip(language_infos, language_pronunciations)
+            })
+
+    return pronunciation_dict
+
+def Split_Eval(infos: List[Pattern_Info], eval_ratio: float= 0.001, min_eval: int= 1, seed: int= 0):
+    '''
+    The split is deterministic, so every shard and every resumed run gets the same train/eval split.
+    Path is the first field of Pattern_Info, so the infos are sorted by path.
+    '''
+    paths = sorted(infos)
+    Random(seed).shuffle(paths)
     index = max(int(len(paths) * eval_ratio), min_eval)
     return paths[index:], paths[:index]
 
-def Metadata_Generate(eval: bool= False):
-    pattern_path = hp.Train.Eval_Pattern.Path if eval else hp.Train.Train_Pattern.Path
-    metadata_File = hp.Train.Eval_Pattern.Metadata_File if eval else hp.Train.Train_Pattern.Metadata_File
-
-    latent_range_dict = {}
-    mel_range_dict = {}
-    latent_dict = {}
-    f0_dict = {}
-    speakers = []
-    emotions = []
-    languages = []
-    genders = []
-    language_and_gender_dict_by_speaker = {}
-
-    new_metadata_dict = {
+def Shard_Tag(shard_index: int, shard_count: int):
+    return '{}-of-{}'.format(shard_index, shard_count)
+
+def Shard_Select(infos: List[Pattern_Info], shard_index: int, shard_count: int):
+    '''
+    The shard of a path does not depend on the other paths, so a growing path list does not move the finished paths.
+    '''
+    if shard_count == 1:
+        return infos
+    return [info for info in infos if zlib.crc32(info.Path.encode('utf-8')) % shard_count == shard_index]
+
+def Statistics_Initialize():
+    '''
+    A streaming accumulator of population statistics.
+    M2 is the sum of squared differences from the mean. A plain dict is used so that the partial files can be loaded anywhere.
+    '''
+    return {'Count': 0, 'Mean': 0.0, 'M2': 0.0, 'Min': math.inf, 'Max': -math.inf}
+
+def Statistics_Update(statistics: Dict[str, float], x: np.ndarray):
+    '''
+    Updates the accumulator by a batch of values, so the values do not need to be kept.
+    '''
+    x = np.asarray(x, dtype= np.float64).ravel()
+    if x.size == 0:
+        return statistics
+
+    mean = x.mean().item()
+    return Statistics_Merge(statistics, {
+        'Count': x.size,
+        'Mean': mean,
+        'M2': np.square(x - mean).sum().item(),
+        'Min': x.min().item(),
+        'Max': x.max().item()
+        })
+
+def Statistics_Merge(a: Dict[str, float], b: Dict[str, float]):
+    '''
+    Merges the accumulators of two disjoint sets by Chan's parallel algorithm.
+    '''
+    if a['Count'] == 0:
+        return dict(b)
+    elif b['Count'] == 0:
+        return dict(a)
+
+    count = a['Count'] + b['Count']
+    delta = b['Mean'] - a['Mean']
+
+    return {
+        'Count': count,
+        'Mean': a['Mean'] + delta * b['Count'] / count,
+        'M2': a['M2'] + b['M2'] + delta ** 2 * a['Count'] * b['Count'] / count,
+        'Min': min(a['Min'], b['Min']),
+        'Max': max(a['Max'], b['Max'])
+        }
+
+def Statistics_Finalize(statistics: Dict[str, float]):
+    return {
+        'Min': statistics['Min'],
+        'Max': statistics['Max'],
+        'Mean': statistics['Mean'],
+        'Std': math.sqrt(statistics['M2'] / statistics['Count']) if statistics['Count'] > 0 else 0.0
+        }
+
+def Is_Pattern_File(file: str, metadata_file: str):
+    # Temporary files of unfinished writes and the metadata file itself are not patterns.
+    return file.upper().endswith('.PICKLE') and file.upper() != metadata_file.upper()
+
+def Pattern_File_Scan(pattern_path: str, metadata_file: str):
+    '''
+    Yields the pattern files relative to pattern_path by one os.scandir walk.
+    Symbolic links are followed like os.walk(followlinks= True).
+    '''
+    root_length = len(pattern_path.replace('\\', '/').rstrip('/')) + 1
+    directories = [pattern_path]
+    while len(directories) > 0:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks= True):
+                    directories.append(entry.path)
+                elif Is_Pattern_File(entry.name, metadata_file):
+                    yield entry.path.replace('\\', '/')[root_length:]
+
+def Metadata_Dict_Initialize():
+    return {
         'Frame_Shift': hp.Sound.Frame_Shift,
         'Sample_Rate': hp.Sound.Sample_Rate,
         'File_List': [],
@@ -814,156 +1247,422 @@ def Metadata_Generate(eval: bool= False):
         'Dataset_Dict': {},
         'File_List_by_Speaker_Dict': {},
         'Text_Length_Dict': {},
+        'Pronunciation_Length_Dict': {},
         }
 
-    files_tqdm = tqdm(
-        total= sum([len(files) for root, _, files in os.walk(pattern_path, followlinks=True)]),
-        desc= 'Eval_Pattern' if eval else 'Train_Pattern'
-        )
+def Statistics_Dict_Initialize():
+    return {
+        'Mel_Range': {},
+        'Latent': {},
+        'F0': {},
+        'Speakers': set(),
+        'Emotions': set(),
+        'Languages': set(),
+        'Genders': set(),
+        'Tokens': set(),
+        'Language_and_Gender_by_Speaker': {}
+        }
 
-    for root, _, files in os.walk(pattern_path, followlinks=True):
-        for file in files:
-            with open(os.path.join(root, file).replace("\\", "/"), "rb") as f:
+@torch.inference_mode()
+def Metadata_Chunk_Collect(params: Tuple[str, List[str]]):
+    '''
+    params: pattern path and a chunk of pattern files relative to the pattern path.
+    Returns the partial metadata and statistics of the chunk, and the number of the files.
+    The latent codes of the chunk are decoded by one quantizer call.
+    The RVQ decode is a frame-wise sum of codebook lookups, so decoding the concatenated codes is same to decoding each file.
+    '''
+    pattern_path, files = params
+    metadata_dict = Metadata_Dict_Initialize()
+    statistics_dict = Statistics_Dict_Initialize()
+
+    latent_code_list = []
+    latent_speakers = []
+    for file in files:
+        try:
+            with open(os.path.join(pattern_path, file).replace("\\", "/"), "rb") as f:
                 pattern_dict = pickle.load(f)
 
-            file = os.path.join(root, file).replace("\\", "/").replace(pattern_path, '').lstrip('/')
-
-            try:
-                if not all([
-                    key in pattern_dict.keys()
-                    for key in ('Audio', 'Latent', 'F0', 'Speaker', 'Emotion', 'Language', 'Gender', 'Dataset', 'Text', 'Pronunciation')
-                    ]):
-                    continue
-                new_metadata_dict['Audio_Length_Dict'][file] = pattern_dict['Audio'].shape[0]
-                new_metadata_dict['Latent_Length_Dict'][file] = pattern_dict['Latent'].shape[1]
-                new_metadata_dict['Mel_Length_Dict'][file] = pattern_dict['Mel'].shape[1]
-                new_metadata_dict['F0_Length_Dict'][file] = pattern_dict['F0'].shape[0]
-                new_metadata_dict['Speaker_Dict'][file] = pattern_dict['Speaker']
-                new_metadata_dict['Emotion_Dict'][file] = pattern_dict['Emotion']
-                new_metadata_dict['Dataset_Dict'][file] = pattern_dict['Dataset']
-                new_metadata_dict['File_List'].append(file)
-                if not pattern_dict['Speaker'] in new_metadata_dict['File_List_by_Speaker_Dict'].keys():
-                    new_metadata_dict['File_List_by_Speaker_Dict'][pattern_dict['Speaker']] = []
-                new_metadata_dict['File_List_by_Speaker_Dict'][pattern_dict['Speaker']].append(file)
-                new_metadata_dict['Text_Length_Dict'][file] = len(pattern_dict['Text'])
-
-                if not pattern_dict['Speaker'] in latent_range_dict.keys():
-                    latent_range_dict[pattern_dict['Speaker']] = {'Min': math.inf, 'Max': -math.inf}
-                if not pattern_dict['Speaker'] in mel_range_dict.keys():
-                    mel_range_dict[pattern_dict['Speaker']] = {'Min': math.inf, 'Max': -math.inf}
-                if not pattern_dict['Speaker'] in latent_dict.keys():
-                    latent_dict[pattern_dict['Speaker']] = []
-                if not pattern_dict['Speaker'] in f0_dict.keys():
-                    f0_dict[pattern_dict['Speaker']] = []
-                
-                latent = encodec.quantizer.decode(torch.from_numpy(pattern_dict['Latent']).unsqueeze(1).long()).squeeze(0)                
-                mel_range_dict[pattern_dict['Speaker']]['Min'] = min(mel_range_dict[pattern_dict['Speaker']]['Min'], pattern_dict['Mel'].min().item())
-                mel_range_dict[pattern_dict['Speaker']]['Max'] = max(mel_range_dict[pattern_dict['Speaker']]['Max'], pattern_dict['Mel'].max().item())
-
-                latent_dict[pattern_dict['Speaker']].append(latent)
-                f0_dict[pattern_dict['Speaker']].append(pattern_dict['F0'])
-                speakers.append(pattern_dict['Speaker'])
-                emotions.append(pattern_dict['Emotion'])
-                languages.append(pattern_dict['Language'])
-                genders.append(pattern_dict['Gender'])
-                language_and_gender_dict_by_speaker[pattern_dict['Speaker']] = {
-                    'Language': pattern_dict['Language'],
-                    'Gender': pattern_dict['Gender']
-                    }
-            except:
-                print('File \'{}\' is not correct pattern file. This file is ignored.'.format(file))
-
-            files_tqdm.update(1)
-
-    with open(os.path.join(pattern_path, metadata_File.upper()).replace("\\", "/"), 'wb') as f:
-        pickle.dump(new_metadata_dict, f, protocol= 4)
-
-    if not eval:
-        yaml.dump(
-            latent_range_dict,
-            open(hp.Latent_Info_Path, 'w')
-            )
-        yaml.dump(
-            mel_range_dict,
-            open(hp.Mel_Range_Info_Path, 'w')
-            )
-        
-        latent_info_dict = {}
-        for speaker, latent_list in latent_dict.items():
-            latent = np.hstack(latent_list).astype(np.float32)
-            latent_info_dict[speaker] = {
-                'Min': latent.min().item(),
-                'Max': latent.max().item(),
-                'Mean': latent.mean().item(),
-                'Std': latent.std().item()
+            if not all([
+                key in pattern_dict.keys()
+                for key in ('Audio', 'Latent', 'F0', 'Speaker', 'Emotion', 'Language', 'Gender', 'Dataset', 'Text', 'Pronunciation')
+                ]):
+                continue
+            speaker = pattern_dict['Speaker']
+
+            metadata_dict['Audio_Length_Dict'][file] = pattern_dict['Audio'].shape[0]
+            metadata_dict['Latent_Length_Dict'][file] = pattern_dict['Latent'].shape[1]
+            metadata_dict['Mel_Length_Dict'][file] = pattern_dict['Mel'].shape[1]
+            metadata_dict['F0_Length_Dict'][file] = pattern_dict['F0'].shape[0]
+            metadata_dict['Speaker_Dict'][file] = speaker
+            metadata_dict['Emotion_Dict'][file] = pattern_dict['Emotion']
+            metadata_dict['Dataset_Dict'][file] = pattern_dict['Dataset']
+            metadata_dict['File_List'].append(file)
+            if not speaker in metadata_dict['File_List_by_Speaker_Dict'].keys():
+                metadata_dict['File_List_by_Speaker_Dict'][speaker] = []
+            metadata_dict['File_List_by_Speaker_Dict'][speaker].append(file)
+            metadata_dict['Text_Length_Dict'][file] = len(pattern_dict['Text'])
+            metadata_dict['Pronunciation_Length_Dict'][file] = len(pattern_dict['Pronunciation'])
+
+            if not speaker in statistics_dict['Mel_Range'].keys():
+                statistics_dict['Mel_Range'][speaker] = {'Min': math.inf, 'Max': -math.inf}
+            if not speaker in statistics_dict['Latent'].keys():
+                statistics_dict['Latent'][speaker] = Statistics_Initialize()
+            if not speaker in statistics_dict['F0'].keys():
+                statistics_dict['F0'][speaker] = Statistics_Initialize()
+
+            statistics_dict['Mel_Range'][speaker]['Min'] = min(statistics_dict['Mel_Range'][speaker]['Min'], pattern_dict['Mel'].min().item())
+            statistics_dict['Mel_Range'][speaker]['Max'] = max(statistics_dict['Mel_Range'][speaker]['Max'], pattern_dict['Mel'].max().item())
+
+            f0 = pattern_dict['F0']
+            statistics_dict['F0'][speaker] = Statistics_Update(
+                statistics_dict['F0'][speaker],
+                f0[f0 > 0.0]    # Only voiced frames.
+                )
+            statistics_dict['Speakers'].add(speaker)
+            statistics_dict['Emotions'].add(pattern_dict['Emotion'])
+            statistics_dict['Languages'].add(pattern_dict['Language'])
+            statistics_dict['Genders'].add(pattern_dict['Gender'])
+            statistics_dict['Tokens'].update(pattern_dict['Pronunciation'])
+            statistics_dict['Language_and_Gender_by_Speaker'][speaker] = {
+                'Language': pattern_dict['Language'],
+                'Gender': pattern_dict['Gender']
                 }
-        yaml.dump(
-            latent_info_dict,
-            open(hp.Latent_Info_Path, 'w')
-            )
 
-        f0_info_dict = {}
-        for speaker, f0_list in f0_dict.items():
-            f0 = np.hstack(f0_list)
-            f0 = np.clip(f0, 0, np.inf)
-            f0 = f0[f0 != 0.0].astype(np.float32)
-            f0_info_dict[speaker] = {
-                'Min': f0.min().item(),
-                'Max': f0.max().item(),
-                'Mean': f0.mean().item(),
-                'Std': f0.std().item()
-                }
-        yaml.dump(
-            f0_info_dict,
-            open(hp.F0_Info_Path, 'w')
-            )
-        
-        speaker_index_dict = {
-            speaker: index
-            for index, speaker in enumerate(sorted(set(speakers)))
-            }
-        yaml.dump(
-            speaker_index_dict,
-            open(hp.Speaker_Info_Path, 'w')
-            )
-            
-        emotion_index_dict = {
-            emotion: index
-            for index, emotion in enumerate(sorted(set(emotions)))
-            }
-        yaml.dump(
-            emotion_index_dict,
-            open(hp.Emotion_Info_Path, 'w')
-            )
+            latent_code_list.append(pattern_dict['Latent'])
+            latent_speakers.append(speaker)
+        except:
+            print('File \'{}\' is not correct pattern file. This file is ignored.'.format(file))
+
+    if len(latent_code_list) > 0:
+        latents = encodec.quantizer.decode(
+            torch.from_numpy(np.concatenate(latent_code_list, axis= 1)).unsqueeze(1).long()
+            ).squeeze(0).numpy()   # [Latent_d, Sum_Latent_t]
+        latents = np.split(latents, np.cumsum([codes.shape[1] for codes in latent_code_list])[:-1], axis= 1)
+        for latent, speaker in zip(latents, latent_speakers):
+            statistics_dict['Latent'][speaker] = Statistics_Update(statistics_dict['Latent'][speaker], latent)
+
+    return metadata_dict, statistics_dict, len(files)
+
+def Metadata_Collect(
+    pattern_path: str,
+    metadata_file: str,
+    files: Optional[List[str]]= None,
+    desc: str= '',
+    max_worker: int= 1,
+    use_process: bool= False,
+    hyper_parameters_path: Optional[str]= None,
+    worker_threads: int= 1,
+    chunk_size: int= 256
+    ):
+    '''
+    files: The pattern files relative to pattern_path. When None, every pattern file in pattern_path is collected.
+    Returns the metadata dict and the statistics dict.
+    The statistics dict has only mergeable values, so the partials of chunks and shards are reduced by the same merge.
+    '''
+    if files is None:
+        files = Pattern_File_Scan(pattern_path, metadata_file)
+        total = None
+    else:
+        total = len(files)
 
-        language_index_dict = {
-            language: index
-            for index, language in enumerate(sorted(set(languages)))
+    def Chunk_Generate():
+        chunk = []
+        for file in files:
+            chunk.append(file)
+            if len(chunk) == chunk_size:
+                yield pattern_path, chunk
+                chunk = []
+        if len(chunk) > 0:
+            yield pattern_path, chunk
+
+    metadata_dict = Metadata_Dict_Initialize()
+    statistics_dict = Statistics_Dict_Initialize()
+    progress = tqdm(total= total, desc= desc)
+    for chunk_metadata_dict, chunk_statistics_dict, count in Parallel_Map(
+        function= Metadata_Chunk_Collect,
+        params_list= Chunk_Generate(),
+        max_worker= max_worker,
+        use_process= use_process,
+        hyper_parameters_path= hyper_parameters_path,
+        worker_threads= worker_threads
+        ):
+        metadata_dict = Metadata_Dict_Merge(metadata_dict, chunk_metadata_dict)
+        statistics_dict = Statistics_Dict_Merge(statistics_dict, chunk_statistics_dict)
+        progress.update(count)
+    progress.close()
+
+    return metadata_dict, statistics_dict
+
+def Metadata_Dict_Merge(a: Dict, b: Dict):
+    for key, value in b.items():
+        if key == 'File_List':
+            a[key].extend(value)
+        elif key == 'File_List_by_Speaker_Dict':
+            for speaker, files in value.items():
+                a[key].setdefault(speaker, []).extend(files)
+        elif key.endswith('_Dict'):
+            a.setdefault(key, {}).update(value)    # The previous metadata may not have a dict added later.
+
+    return a
+
+def Statistics_Dict_Merge(a: Dict, b: Dict):
+    for key in ['Speakers', 'Emotions', 'Languages', 'Genders', 'Tokens']:
+        a[key] |= b[key]
+    a['Language_and_Gender_by_Speaker'].update(b['Language_and_Gender_by_Speaker'])
+    for speaker, mel_range in b['Mel_Range'].items():
+        a['Mel_Range'][speaker] = {
+            'Min': min(a['Mel_Range'].get(speaker, mel_range)['Min'], mel_range['Min']),
+            'Max': max(a['Mel_Range'].get(speaker, mel_range)['Max'], mel_range['Max'])
             }
-        yaml.dump(
-            language_index_dict,
-            open(hp.Language_Info_Path, 'w')
-            )
+    for key in ['Latent', 'F0']:
+        for speaker, statistics in b[key].items():
+            a[key][speaker] = Statistics_Merge(a[key][speaker], statistics) if speaker in a[key].keys() else statistics
 
-        gender_index_dict = {
-            gender: index
-            for index, gender in enumerate(sorted(set(genders)))
-            }
-        yaml.dump(
-            gender_index_dict,
-            open(hp.Gender_Info_Path, 'w')
-            )
+    return a
+
+def Statistics_File_Path(pattern_path: str, metadata_file: str):
+    '''
+    The statistics accumulators are stored next to the metadata, so the metadata can be appended without a rescan.
+    '''
+    return os.path.join(pattern_path, os.path.splitext(metadata_file.upper())[0] + '.STATISTICS').replace("\\", "/")
+
+def Index_Dict_Generate(values: set, info_path: str, keep_previous_indices: bool= False):
+    '''
+    keep_previous_indices: The indices of the previous info are kept and the new values are indexed after them,
+    so the speaker/emotion/language/gender embeddings of a trained model stay valid after an append.
+    '''
+    if not keep_previous_indices or not os.path.exists(info_path):
+        return {value: index for index, value in enumerate(sorted(values))}
+
+    index_dict = yaml.load(open(info_path, 'r'), Loader=yaml.Loader) or {}
+    for value in sorted(set(values) - set(index_dict.keys())):
+        index_dict[value] = max(index_dict.values(), default= -1) + 1
+
+    return index_dict
+
+def Metadata_Write(
+    pattern_path: str,
+    metadata_file: str,
+    metadata_dict: Dict,
+    statistics_dict: Dict,
+    eval: bool= False,
+    keep_previous_indices: bool= False
+    ):
+    with open(os.path.join(pattern_path, metadata_file.upper()).replace("\\", "/"), 'wb') as f:
+        pickle.dump(metadata_dict, f, protocol= 4)
+    with open(Statistics_File_Path(pattern_path, metadata_file), 'wb') as f:
+        pickle.dump(statistics_dict, f, protocol= 4)
+    Metadata_Index_Generate(metadata_dict).Save(Metadata_Index_Path(pattern_path, metadata_file))
+
+    if eval:
+        return
+
+    yaml.dump(
+        statistics_dict['Mel_Range'],
+        open(hp.Mel_Range_Info_Path, 'w')
+        )
+
+    yaml.dump(
+        {
+            speaker: Statistics_Finalize(statistics)
+            for speaker, statistics in statistics_dict['Latent'].items()
+            },
+        open(hp.Latent_Info_Path, 'w')
+        )
+    yaml.dump(
+        {
+            speaker: Statistics_Finalize(statistics)
+            for speaker, statistics in statistics_dict['F0'].items()
+            },
+        open(hp.F0_Info_Path, 'w')
+        )
 
+    for key, info_path in [
+        ('Speakers', hp.Speaker_Info_Path),
+        ('Emotions', hp.Emotion_Info_Path),
+        ('Languages', hp.Language_Info_Path),
+        ('Genders', hp.Gender_Info_Path)
+        ]:
         yaml.dump(
-            language_and_gender_dict_by_speaker,
-            open(hp.Language_and_Gender_Info_by_Speaker_Path, 'w')
+            Index_Dict_Generate(statistics_dict[key], info_path, keep_previous_indices),
+            open(info_path, 'w')
             )
 
+    yaml.dump(
+        statistics_dict['Language_and_Gender_by_Speaker'],
+        open(hp.Language_and_Gender_Info_by_Speaker_Path, 'w')
+        )
+
+def Metadata_Generate(eval: bool= False, **parallel_kwargs):
+    '''
+    parallel_kwargs: max_worker, use_process, hyper_parameters_path and worker_threads of Metadata_Collect.
+    '''
+    pattern_path = hp.Train.Eval_Pattern.Path if eval else hp.Train.Train_Pattern.Path
+    metadata_file = hp.Train.Eval_Pattern.Metadata_File if eval else hp.Train.Train_Pattern.Metadata_File
+
+    metadata_dict, statistics_dict = Metadata_Collect(
+        pattern_path= pattern_path,
+        metadata_file= metadata_file,
+        desc= 'Eval_Pattern' if eval else 'Train_Pattern',
+        **parallel_kwargs
+        )
+    Metadata_Write(pattern_path, metadata_file, metadata_dict, statistics_dict, eval)
+
     print('Metadata generate done.')
 
-def Token_dict_Generate(tokens: Union[List[str], str]):
-    tokens = ['<S>', '<E>', '<P>'] + sorted(list(tokens))        
-    token_dict = {token: index for index, token in enumerate(tokens)}
+def Metadata_Append(eval: bool= False, **parallel_kwargs):
+    '''
+    Only the pattern files which are not in the previous metadata are collected and merged into the previous metadata and statistics.
+    A pattern file regenerated at an existing path is not recollected. Use Metadata_Generate for that.
+    When the previous metadata or statistics does not exist, the metadata is generated from scratch.
+    '''
+    pattern_path = hp.Train.Eval_Pattern.Path if eval else hp.Train.Train_Pattern.Path
+    metadata_file = hp.Train.Eval_Pattern.Metadata_File if eval else hp.Train.Train_Pattern.Metadata_File
+    metadata_path = os.path.join(pattern_path, metadata_file.upper()).replace("\\", "/")
+    statistics_path = Statistics_File_Path(pattern_path, metadata_file)
+
+    if not os.path.exists(metadata_path) or not os.path.exists(statistics_path):
+        print('There is no previous metadata or statistics of \'{}\'. Metadata is generated from scratch.'.format(pattern_path))
+        Metadata_Generate(eval= eval, **parallel_kwargs)
+        return
+
+    metadata_dict = pickle.load(open(metadata_path, 'rb'))
+    statistics_dict = pickle.load(open(statistics_path, 'rb'))
+
+    previous_files = set(metadata_dict['Audio_Length_Dict'].keys())
+    new_metadata_dict, new_statistics_dict = Metadata_Collect(
+        pattern_path= pattern_path,
+        metadata_file= metadata_file,
+        files= [
+            file
+            for file in Pattern_File_Scan(pattern_path, metadata_file)
+            if not file in previous_files
+            ],
+        desc= '{} append'.format('Eval_Pattern' if eval else 'Train_Pattern'),
+        **parallel_kwargs
+        )
+    metadata_dict = Metadata_Dict_Merge(metadata_dict, new_metadata_dict)
+    statistics_dict = Statistics_Dict_Merge(statistics_dict, new_statistics_dict)
+    Metadata_Write(pattern_path, metadata_file, metadata_dict, statistics_dict, eval, keep_previous_indices= True)
+
+    print('Metadata append done: {} new files.'.format(len(new_metadata_dict['File_List'])))
+
+def Metadata_Partial_Generate(files: List[str], shard_tag: str, eval: bool= False, **parallel_kwargs):
+    '''
+    files: The pattern files generated by the shard. The files out of pattern path of the split are ignored.
+    The partial is merged with the partials of other shards by Metadata_Merge.
+    '''
+    pattern_path = hp.Train.Eval_Pattern.Path if eval else hp.Train.Train_Pattern.Path
+    metadata_file = hp.Train.Eval_Pattern.Metadata_File if eval else hp.Train.Train_Pattern.Metadata_File
+
+    root = pattern_path.replace('\\', '/').rstrip('/') + '/'
+    metadata_dict, statistics_dict = Metadata_Collect(
+        pattern_path= pattern_path,
+        metadata_file= metadata_file,
+        files= [file[len(root):] for file in files if file.startswith(root)],
+        desc= '{} {}'.format('Eval_Pattern' if eval else 'Train_Pattern', shard_tag),
+        **parallel_kwargs
+        )
+
+    with open(os.path.join(pattern_path, 'METADATA.{}.PARTIAL'.format(shard_tag.upper())).replace("\\", "/"), 'wb') as f:
+        pickle.dump({'Metadata': metadata_dict, 'Statistics': statistics_dict}, f, protocol= 4)
+
+    print('Metadata partial generate done: {}'.format(shard_tag))
+
+def Metadata_Merge(shard_count: int):
+    tokens = set()
+    for eval in [False, True]:
+        pattern_path = hp.Train.Eval_Pattern.Path if eval else hp.Train.Train_Pattern.Path
+        metadata_file = hp.Train.Eval_Pattern.Metadata_File if eval else hp.Train.Train_Pattern.Metadata_File
+
+        partial_paths = [
+            os.path.join(pattern_path, 'METADATA.{}.PARTIAL'.format(Shard_Tag(index, shard_count).upper())).replace("\\", "/")
+            for index in range(shard_count)
+            ]
+        missing_paths = [path for path in partial_paths if not os.path.exists(path)]
+        if len(missing_paths) > 0:
+            raise FileNotFoundError('Some shard partials are not generated yet: {}'.format(missing_paths))
+        
+        metadata_dict, statistics_dict = None, None
+        for path in partial_paths:
+            partial_dict = pickle.load(open(path, 'rb'))
+            if metadata_dict is None:
+                metadata_dict, statistics_dict = partial_dict['Metadata'], partial_dict['Statistics']
+                continue
+            metadata_dict = Metadata_Dict_Merge(metadata_dict, partial_dict['Metadata'])
+            statistics_dict = Statistics_Dict_Merge(statistics_dict, partial_dict['Statistics'])
+
+        Metadata_Write(pattern_path, metadata_file, metadata_dict, statistics_dict, eval)
+        tokens |= statistics_dict['Tokens']
+
+    Token_dict_Generate(tokens= tokens)
+
+    print('Metadata merge done: {} shards.'.format(shard_count))
+
+# The keys used by training. 'Audio' is the largest, but it is not read by the datasets.
+stream_pattern_keys = ['Latent', 'Mel', 'F0', 'Speaker', 'Text', 'Pronunciation']
+
+def Tar_Shard_Generate(eval: bool= False, shard_size: int= 2 ** 30, max_worker: int= 16, seed: int= 0):
+    '''
+    Packs the patterns of the metadata into sequential tar shards for Datasets.Stream_Dataset.
+    The patterns are shuffled before packing, so each shard has many speakers and datasets.
+    shard_size: The bytes of a shard. A new shard starts when it is exceeded.
+    SHARDS.PICKLE is the index of shards, and has the member files with their latent and text lengths.
+    '''
+    pattern_path = hp.Train.Eval_Pattern.Path if eval else hp.Train.Train_Pattern.Path
+    metadata_file = hp.Train.Eval_Pattern.Metadata_File if eval else hp.Train.Train_Pattern.Metadata_File
+    tar_path = os.path.join(pattern_path, hp.Train.Stream.Directory).replace('\\', '/')
+    os.makedirs(tar_path, exist_ok= True)
+
+    metadata_dict = pickle.load(open(os.path.join(pattern_path, metadata_file.upper()).replace('\\', '/'), 'rb'))
+    files = list(metadata_dict['File_List'])
+    Random(seed).shuffle(files)
+
+    def Member_Load(file: str):
+        pattern_dict = pickle.load(open(os.path.join(pattern_path, file).replace('\\', '/'), 'rb'))
+        return file, pickle.dumps({key: pattern_dict[key] for key in stream_pattern_keys}, protocol= 4)
+
+    shards = []
+    tar, shard_bytes = None, 0
+    for file, data in tqdm(Thread_Map(Member_Load, files, max_worker= max_worker), total= len(files), desc= tar_path):
+        if tar is None or shard_bytes >= shard_size:
+            if not tar is None:
+                tar.close()
+                os.replace(os.path.join(tar_path, shards[-1][0] + '.tmp'), os.path.join(tar_path, shards[-1][0]))
+            shards.append(('SHARD_{:05d}.TAR'.format(len(shards)), []))
+            tar = tarfile.open(os.path.join(tar_path, shards[-1][0] + '.tmp').replace('\\', '/'), 'w')
+            shard_bytes = 0
+
+        member_info = tarfile.TarInfo(name= file)
+        member_info.size = len(data)
+        tar.addfile(member_info, io.BytesIO(data))
+        shard_bytes += len(data)
+        shards[-1][1].append((file, metadata_dict['Latent_Length_Dict'][file], metadata_dict['Text_Length_Dict'][file]))
+
+    if not tar is None:
+        tar.close()
+        os.replace(os.path.join(tar_path, shards[-1][0] + '.tmp'), os.path.join(tar_path, shards[-1][0]))
+
+    # The index is written last, so the shards of an interrupted run are not used.
+    with open(os.path.join(tar_path, 'SHARDS.PICKLE').replace('\\', '/'), 'wb') as f:
+        pickle.dump({'Shards': shards}, f, protocol= 4)
+
+    print('Tar shard generate done: {} patterns, {} shards.'.format(len(files), len(shards)))
+
+def Token_dict_Generate(tokens: Union[List[str], str], keep_previous_tokens: bool= False):
+    '''
+    keep_previous_tokens: A resumed generation phonemizes only the missing items, so the tokens of the previous token dict are kept.
+        Their ids are kept and the new tokens are indexed after them like Index_Dict_Generate, so the saved patterns and the token embedding stay valid.
+    '''
+    tokens = set(tokens)
+    if not keep_previous_tokens or not os.path.exists(hp.Token_Path):
+        tokens = ['<S>', '<E>', '<P>'] + sorted(tokens - set(['<S>', '<E>', '<P>']))
+        token_dict = {token: index for index, token in enumerate(tokens)}
+    else:
+        token_dict = yaml.load(open(hp.Token_Path, 'r', encoding= 'utf-8-sig'), Loader=yaml.Loader) or {}
+        for token in ['<S>', '<E>', '<P>'] + sorted(tokens - set(['<S>', '<E>', '<P>']) - set(token_dict.keys())):
+            if not token in token_dict.keys():
+                token_dict[token] = max(token_dict.values(), default= -1) + 1
     
     os.makedirs(os.path.dirname(hp.Token_Path), exist_ok= True)    
     yaml.dump(token_dict, open(hp.Token_Path, 'w', encoding='utf-8-sig'), allow_unicode= True)
@@ -985,6 +1684,17 @@ if __name__ == '__main__':
     parser.add_argument("-evalr", "--eval_ratio", default= 0.001, type= float)
     parser.add_argument("-evalm", "--eval_min", default= 1, type= int)
     parser.add_argument("-mw", "--max_worker", default= 2, required=False, type= int)
+    parser.add_argument("-iw", "--info_worker", default= 16, required=False, type= int)
+    parser.add_argument("-mp", "--use_process", action= 'store_true')
+    parser.add_argument("-wt", "--worker_threads", default= 1, required=False, type= int)
+    parser.add_argument("-cs", "--chunk_size", default= 16, required=False, type= int)
+    parser.add_argument("-eb", "--encode_batch_size", default= 1, required=False, type= int)
+    parser.add_argument("-manifest", "--manifest_path", required=False)
+    parser.add_argument("-shard", "--shard", required=False, type= str)
+    parser.add_argument("-merge", "--merge_shards", required=False, type= int)
+    parser.add_argument("-append", "--append_metadata", action= 'store_true')
+    parser.add_argument("-tar", "--tar_shard", action= 'store_true')
+    parser.add_argument("-ts", "--tar_shard_size", default= 1024, required=False, type= int)
 
     args = parser.parse_args()
 
@@ -994,176 +1704,120 @@ if __name__ == '__main__':
         Loader=yaml.Loader
         ))
 
-    train_paths, eval_paths = [], []
-    text_dict = {}
-    pronunciation_dict = {}
-    speaker_dict = {}
-    emotion_dict = {}
-    language_dict = {}
-    gender_dict = {}
-    dataset_dict = {}
-    tag_dict = {}
-
-    if not args.selvas_path is None:
-        selvas_paths, selvas_text_dict, selvas_pronunciation_dict, selvas_speaker_dict, selvas_emotion_dict, selvas_language_dict, selvas_gender_dict = Selvas_Info_Load(path= args.selvas_path)
-        selvas_paths = Split_Eval(selvas_paths, args.eval_ratio, args.eval_min)
-        train_paths.extend(selvas_paths[0])
-        eval_paths.extend(selvas_paths[1])
-        text_dict.update(selvas_text_dict)
-        pronunciation_dict.update(selvas_pronunciation_dict)
-        speaker_dict.update(selvas_speaker_dict)
-        emotion_dict.update(selvas_emotion_dict)
-        language_dict.update(selvas_language_dict)
-        gender_dict.update(selvas_gender_dict)
-        dataset_dict.update({path: 'Selvas' for paths in selvas_paths for path in paths})
-        tag_dict.update({path: '' for paths in selvas_paths for path in paths})
-
-    if not args.kss_path is None:
-        kss_paths, kss_text_dict, kss_pronunciation_dict, kss_speaker_dict, kss_emotion_dict, kss_language_dict, kss_gender_dict = KSS_Info_Load(path= args.kss_path)
-        kss_paths = Split_Eval(kss_paths, args.eval_ratio, args.eval_min)
-        train_paths.extend(kss_paths[0])
-        eval_paths.extend(kss_paths[1])
-        text_dict.update(kss_text_dict)
-        pronunciation_dict.update(kss_pronunciation_dict)
-        speaker_dict.update(kss_speaker_dict)
-        emotion_dict.update(kss_emotion_dict)
-        language_dict.update(kss_language_dict)
-        gender_dict.update(kss_gender_dict)
-        dataset_dict.update({path: 'KSS' for paths in kss_paths for path in paths})
-        tag_dict.update({path: '' for paths in kss_paths for path in paths})
-
-    if not args.aihub_path is None:
-        aihub_paths, aihub_text_dict, aihub_pronunciation_dict, aihub_speaker_dict, aihub_emotion_dict, aihub_language_dict, aihub_gender_dict = AIHub_Info_Load(
-            path= args.aihub_path
-            )
-        aihub_paths = Split_Eval(aihub_paths, args.eval_ratio, args.eval_min)
-        train_paths.extend(aihub_paths[0])
-        eval_paths.extend(aihub_paths[1])
-        text_dict.update(aihub_text_dict)
-        pronunciation_dict.update(aihub_pronunciation_dict)
-        speaker_dict.update(aihub_speaker_dict)
-        emotion_dict.update(aihub_emotion_dict)
-        language_dict.update(aihub_language_dict)
-        gender_dict.update(aihub_gender_dict)
-        dataset_dict.update({path: 'AIHub' for paths in aihub_paths for path in paths})
-        tag_dict.update({path: '' for paths in aihub_paths for path in paths})
-
-
-
-    if not args.vctk_path is None:
-        vctk_paths, vctk_text_dict, vctk_pronunciation_dict, vctk_speaker_dict, vctk_emotion_dict, vctk_language_dict, vctk_gender_dict = VCTK_Info_Load(path= args.vctk_path)
-        vctk_paths = Split_Eval(vctk_paths, args.eval_ratio, args.eval_min)
-        train_paths.extend(vctk_paths[0])
-        eval_paths.extend(vctk_paths[1])
-        text_dict.update(vctk_text_dict)
-        pronunciation_dict.update(vctk_pronunciation_dict)
-        speaker_dict.update(vctk_speaker_dict)
-        emotion_dict.update(vctk_emotion_dict)
-        language_dict.update(vctk_language_dict)
-        gender_dict.update(vctk_gender_dict)
-        dataset_dict.update({path: 'VCTK' for paths in vctk_paths for path in paths})
-        tag_dict.update({path: '' for paths in vctk_paths for path in paths})
-
-    if not args.libri_path is None:
-        libri_paths, libri_text_dict, libri_pronunciation_dict, libri_speaker_dict, libri_emotion_dict, libri_language_dict, libri_gender_dict = Libri_Info_Load(path= args.libri_path)
-        libri_paths = Split_Eval(libri_paths, args.eval_ratio, args.eval_min)
-        train_paths.extend(libri_paths[0])
-        eval_paths.extend(libri_paths[1])
-        text_dict.update(libri_text_dict)
-        pronunciation_dict.update(libri_pronunciation_dict)
-        speaker_dict.update(libri_speaker_dict)
-        emotion_dict.update(libri_emotion_dict)
-        language_dict.update(libri_language_dict)
-        gender_dict.update(libri_gender_dict)
-        dataset_dict.update({path: 'Libri' for paths in libri_paths for path in paths})
-        tag_dict.update({path: '' for paths in libri_paths for path in paths})
-
-    if not args.lj_path is None:
-        lj_paths, lj_text_dict, lj_pronunciation_dict, lj_speaker_dict, lj_emotion_dict, lj_language_dict, lj_gender_dict = LJ_Info_Load(path= args.lj_path)
-        lj_paths = Split_Eval(lj_paths, args.eval_ratio, args.eval_min)
-        train_paths.extend(lj_paths[0])
-        eval_paths.extend(lj_paths[1])
-        text_dict.update(lj_text_dict)
-        pronunciation_dict.update(lj_pronunciation_dict)
-        speaker_dict.update(lj_speaker_dict)
-        emotion_dict.update(lj_emotion_dict)
-        language_dict.update(lj_language_dict)
-        gender_dict.update(lj_gender_dict)
-        dataset_dict.update({path: 'LJ' for paths in lj_paths for path in paths})
-        tag_dict.update({path: '' for paths in lj_paths for path in paths})
-
-    if not args.mls_path is None:
-        mls_paths, mls_text_dict, mls_pronunciation_dict, mls_speaker_dict, mls_emotion_dict, mls_language_dict, mls_gender_dict = MLS_Info_Load(path= args.mls_path)
-        mls_paths = Split_Eval(mls_paths, args.eval_ratio, args.eval_min)
-        train_paths.extend(mls_paths[0])
-        eval_paths.extend(mls_paths[1])
-        text_dict.update(mls_text_dict)
-        pronunciation_dict.update(mls_pronunciation_dict)
-        speaker_dict.update(mls_speaker_dict)
-        emotion_dict.update(mls_emotion_dict)
-        language_dict.update(mls_language_dict)
-        gender_dict.update(mls_gender_dict)
-        dataset_dict.update({path: 'MLS' for paths in mls_paths for path in paths})
-        tag_dict.update({path: '' for paths in mls_paths for path in paths})
-
-    # if len(train_paths) == 0 or len(eval_paths) == 0:
+    if not args.merge_shards is None:
+        Metadata_Merge(shard_count= args.merge_shards)
+        if args.tar_shard:
+            Tar_Shard_Generate(shard_size= args.tar_shard_size * 2 ** 20, max_worker= args.info_worker)
+            Tar_Shard_Generate(eval= True, shard_size= args.tar_shard_size * 2 ** 20, max_worker= args.info_worker)
+        exit(0)
+
+    shard_index, shard_count = 0, 1
+    if not args.shard is None:
+        shard_index, shard_count = [int(x) for x in args.shard.split('/')]
+        if not 0 <= shard_index < shard_count:
+            raise ValueError('Shard index must be in [0, {}): {}'.format(shard_count, args.shard))
+
+    info_loader_dict = {
+        'Selvas': (Selvas_Info_Load, args.selvas_path),
+        'KSS': (KSS_Info_Load, args.kss_path),
+        'AIHub': (AIHub_Info_Load, args.aihub_path),
+        'VCTK': (VCTK_Info_Load, args.vctk_path),
+        'Libri': (Libri_Info_Load, args.libri_path),
+        'LJ': (LJ_Info_Load, args.lj_path),
+        'MLS': (MLS_Info_Load, args.mls_path),
+        }
+    info_loader_dict = {
+        dataset: (info_loader, path)
+        for dataset, (info_loader, path) in info_loader_dict.items()
+        if not path is None
+        }
+
+    # Independent corpora are loaded concurrently. Each loader reads its transcripts by its own thread pool.
+    train_infos, eval_infos = [], []
+    with PE(max_workers= max(len(info_loader_dict), 1)) as pe:
+        futures = [
+            pe.submit(lambda info_loader, path: list(info_loader(path= path, max_worker= args.info_worker)), info_loader, path)
+            for info_loader, path in info_loader_dict.values()
+            ]
+        for future in futures:
+            dataset_train_infos, dataset_eval_infos = Split_Eval(future.result(), args.eval_ratio, args.eval_min)
+            train_infos.extend(dataset_train_infos)
+            eval_infos.extend(dataset_eval_infos)
+
+    # if len(train_infos) == 0 or len(eval_infos) == 0:
     #     raise ValueError('Total info count must be bigger than 0.')
 
-    tokens = set([
-        token
-        for phonemes in pronunciation_dict.values()
-        for token in phonemes
-        ])
-    token_dict = Token_dict_Generate(tokens= tokens)
-
-    with PE(max_workers = args.max_worker) as pe:
-        for _ in tqdm(
-            pe.map(
-                lambda params: Pattern_File_Generate(*params),
-                [
-                    (
-                        path,
-                        speaker_dict[path],
-                        emotion_dict[path],
-                        language_dict[path],
-                        gender_dict[path],
-                        dataset_dict[path],
-                        text_dict[path],
-                        pronunciation_dict[path],
-                        tag_dict[path],
-                        False
-                        )
-                    for path in train_paths
-                    ]
-                ),
-            total= len(train_paths)
-            ):
-            pass
-        for _ in tqdm(
-            pe.map(
-                lambda params: Pattern_File_Generate(*params),
-                [
-                    (
-                        path,
-                        speaker_dict[path],
-                        emotion_dict[path],
-                        language_dict[path],
-                        gender_dict[path],
-                        dataset_dict[path],
-                        text_dict[path],
-                        pronunciation_dict[path],
-                        tag_dict[path],
-                        True
-                        )
-                    for path in eval_paths
-                    ]
-                ),
-            total= len(eval_paths)
-            ):
-            pass
-
-    Metadata_Generate()
-    Metadata_Generate(eval= True)
+    train_infos = Shard_Select(train_infos, shard_index, shard_count)
+    eval_infos = Shard_Select(eval_infos, shard_index, shard_count)
+
+    manifest = Generation_Manifest(args.manifest_path or os.path.join(
+        os.path.dirname(hp.Token_Path),
+        'Generation_Manifest.txt' if shard_count == 1 else 'Generation_Manifest.{}.txt'.format(Shard_Tag(shard_index, shard_count))
+        ).replace('\\', '/'))
+    train_infos = [info for info in train_infos if not info.Path in manifest]
+    eval_infos = [info for info in eval_infos if not info.Path in manifest]
+    print('Manifest: {} sources are finished, {} sources are remained.'.format(len(manifest), len(train_infos) + len(eval_infos)))
+
+    pronunciation_dict = Pronunciation_Dict_Generate(
+        infos= train_infos + eval_infos,
+        cache_path= hp.Phoneme_Cache_Path,
+        service= Phonemizer_Service(num_workers= hp.Phonemizer_Workers)
+        )
+
+    if shard_count == 1:  # The token dict of shards is generated by the merge.
+        tokens = set([
+            token
+            for phonemes in pronunciation_dict.values()
+            for token in phonemes
+            ])
+        token_dict = Token_dict_Generate(tokens= tokens, keep_previous_tokens= len(manifest) > 0)
+
+    for infos, eval in [(train_infos, False), (eval_infos, True)]:
+        Pattern_File_Generate_Parallel(
+            params_list= [
+                (
+                    info.Path,
+                    info.Speaker,
+                    info.Emotion,
+                    info.Language,
+                    info.Gender,
+                    info.Dataset,
+                    info.Text,
+                    pronunciation_dict[info.Path],
+                    info.Tag,
+                    eval
+                    )
+                for info in infos
+                ],
+            max_worker= args.max_worker,
+            use_process= args.use_process,
+            hyper_parameters_path= args.hyper_parameters,
+            worker_threads= args.worker_threads,
+            chunk_size= args.chunk_size,
+            encode_batch_size= args.encode_batch_size,
+            manifest= manifest
+            )
+    manifest.close()
+
+    parallel_kwargs = {
+        'max_worker': args.max_worker,
+        'use_process': args.use_process,
+        'hyper_parameters_path': args.hyper_parameters,
+        'worker_threads': args.worker_threads
+        }
+    if shard_count == 1 and args.append_metadata:
+        Metadata_Append(**parallel_kwargs)
+        Metadata_Append(eval= True, **parallel_kwargs)
+    elif shard_count == 1:
+        Metadata_Generate(**parallel_kwargs)
+        Metadata_Generate(eval= True, **parallel_kwargs)
+    else:
+        Metadata_Partial_Generate(files= manifest.Files(), shard_tag= Shard_Tag(shard_index, shard_count), **parallel_kwargs)
+        Metadata_Partial_Generate(files= manifest.Files(), shard_tag= Shard_Tag(shard_index, shard_count), eval= True, **parallel_kwargs)
+
+    if shard_count == 1 and args.tar_shard:
+        Tar_Shard_Generate(shard_size= args.tar_shard_size * 2 ** 20, max_worker= args.info_worker)
+        Tar_Shard_Generate(eval= True, shard_size= args.tar_shard_size * 2 ** 20, max_worker= args.info_worker)
 
 # python Pattern_Generator.py -hp Hyper_Parameters.yaml -lj D:\Rawdata\LJSpeech
 # python Pattern_Generator.py -hp Hyper_Parameters.yaml -vctk D:\Rawdata\VCTK092
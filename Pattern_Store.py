@@ -0,0 +1,449 @@
+import numpy as np
+import yaml, os, pickle, argparse, hashlib, time, tempfile, shutil
+from tqdm import tqdm
+from typing import Dict, List, Optional, Tuple
+
+from Arg_Parser import Recursive_Parse
+
+# raw: The columns are stored as the training dtypes, and a pattern is a view of the memmap.
+# packed: The codes are packed by 10 bits, and mel and F0 are quantized to 8 bits. About half of the raw bytes.
+codec_column_dtype_dict = {
+    'raw': {
+        'Token': np.int16,
+        'Latent': np.int16,
+        'Mel': np.float16,
+        'F0': np.float32
+        },
+    'packed': {
+        'Token': np.int16,
+        'Latent': np.uint8,
+        'Mel': np.uint8,
+        'F0': np.uint8
+        }
+    }
+code_bits = 10  # Encodec has 1024 entries per codebook.
+# The optional column of the decoded latents. It is float16 in every codec, because quantizing it again loses the codebook precision.
+continuous_latent_dtype = np.float16
+
+def Code_Packed_Size(count: int):
+    '''
+    4 codes are packed into 5 bytes.
+    '''
+    return (count + 3) // 4 * 5
+
+def Code_Pack(codes: np.ndarray):
+    '''
+    codes: Any shape of integers in [0, 1024).
+    Returns flatten uint8 of Code_Packed_Size(codes.size).
+    '''
+    codes = codes.reshape(-1).astype(np.uint16)
+    if codes.size > 0 and codes.max() >= 1 << code_bits:
+        raise ValueError('The codes must be lower than {}.'.format(1 << code_bits))
+    codes = np.pad(codes, [0, (-codes.size) % 4]).reshape(-1, 4)
+
+    packed = np.empty((codes.shape[0], 5), dtype= np.uint8)
+    packed[:, 0] = codes[:, 0] & 0xFF
+    packed[:, 1] = (codes[:, 0] >> 8) | ((codes[:, 1] & 0x3F) << 2)
+    packed[:, 2] = (codes[:, 1] >> 6) | ((codes[:, 2] & 0x0F) << 4)
+    packed[:, 3] = (codes[:, 2] >> 4) | ((codes[:, 3] & 0x03) << 6)
+    packed[:, 4] = codes[:, 3] >> 2
+
+    return packed.reshape(-1)
+
+def Code_Unpack(packed: np.ndarray, count: int):
+    '''
+    The inverse of Code_Pack. Returns int16 [count].
+    '''
+    packed = packed.reshape(-1, 5).astype(np.int16)
+
+    codes = np.empty((packed.shape[0], 4), dtype= np.int16)
+    codes[:, 0] = packed[:, 0] | ((packed[:, 1] & 0x03) << 8)
+    codes[:, 1] = (packed[:, 1] >> 2) | ((packed[:, 2] & 0x0F) << 6)
+    codes[:, 2] = (packed[:, 2] >> 4) | ((packed[:, 3] & 0x3F) << 4)
+    codes[:, 3] = (packed[:, 3] >> 6) | (packed[:, 4] << 2)
+
+    return codes.reshape(-1)[:count]
+
+def Feature_Quantize(feature: np.ndarray, keep_zero: bool= False):
+    '''
+    Quantizes to uint8 by the per-utterance min and max.
+    keep_zero: 0 is reserved for exact 0.0, like unvoiced F0, and the other values use 1 ~ 255.
+    Returns quantized, scale, offset. The value is offset + quantized * scale.
+    '''
+    feature = feature.astype(np.float32)
+    mask = feature != 0.0 if keep_zero else np.ones_like(feature, dtype= bool)
+    levels = 254 if keep_zero else 255
+    if not mask.any():
+        return np.zeros(feature.shape, dtype= np.uint8), np.float32(1.0), np.float32(0.0)
+
+    minimum, maximum = feature[mask].min(), feature[mask].max()
+    scale = np.float32(max(maximum - minimum, 1e-5) / levels)
+    quantized = np.round((feature - minimum) / scale).clip(0, levels)
+    if keep_zero:
+        quantized = np.where(mask, quantized + 1, 0)
+        minimum = minimum - scale   # Code 1 is the minimum.
+
+    return quantized.astype(np.uint8), scale, np.float32(minimum)
+
+def Feature_Dequantize(quantized: np.ndarray, scale: float, offset: float, keep_zero: bool= False):
+    feature = quantized.astype(np.float32) * scale + offset
+    if keep_zero:
+        feature[quantized == 0] = 0.0
+
+    return feature
+
+def Config_Hash(token_dict: Dict[str, int], f0_info_dict: Dict[str, Dict[str, float]], use_between_padding: bool):
+    '''
+    The token ids and the normalized F0 depend on these, so the store is checked against them when it is loaded.
+    '''
+    return hashlib.sha1(repr((
+        sorted(token_dict.items()),
+        sorted([(speaker, info['Mean'], info['Std']) for speaker, info in f0_info_dict.items()]),
+        use_between_padding
+        )).encode('utf-8')).hexdigest()
+
+def Column_Path(store_path: str, shard: int, column: str):
+    return os.path.join(store_path, 'SHARD_{:05d}.{}'.format(shard, column.upper())).replace('\\', '/')
+
+class Pattern_Store:
+    '''
+    Packed columnar store of patterns.
+    Each shard has one raw file per column, and every pattern is a contiguous block in each column file.
+        TOKEN: int16 token ids. '<S>', '<E>' and between padding are already applied.
+        LATENT: Encodec codes of [Latent_d, Latent_t] in C order. int16, or 10 bits packed uint8.
+        MEL: [Mel_d, Mel_t] in C order. float16, or uint8 with per-pattern scale and offset.
+        F0: Speaker normalized F0. Unvoiced frames are 0.0. float32, or uint8 with per-pattern scale and offset.
+        CONTINUOUS_LATENT: Optional. The quantizer decode of the codes, [Latent_d, Latent_t] in float16 without the latent normalization.
+    INDEX.NPZ has the codec, the files, and the shard, offset, and length of every column by pattern.
+    The columns are read by np.memmap, so a pattern is read from the page cache without file open or unpickle.
+    '''
+    def __init__(self, store_path: str):
+        self.store_path = store_path
+        index = np.load(os.path.join(store_path, 'INDEX.NPZ').replace('\\', '/'))
+        self.index_dict = {key: index[key] for key in index.files}
+        self.codec = str(self.index_dict['Codec']) if 'Codec' in self.index_dict.keys() else 'raw'
+        self.column_dtype_dict = dict(codec_column_dtype_dict[self.codec])
+        self.has_continuous_latent = 'Continuous_Latent_Offset' in self.index_dict.keys()
+        if self.has_continuous_latent:
+            self.column_dtype_dict['Continuous_Latent'] = continuous_latent_dtype
+        # The rows are found by binary search on the sorted files instead of a dict of strings, so the DataLoader workers share the pages.
+        self.sorted_rows = np.argsort(self.index_dict['Files'])
+        self.sorted_files = self.index_dict['Files'][self.sorted_rows]
+        self.memmap_dict = {}
+
+    def __getstate__(self):
+        # Memmaps are not sent to DataLoader workers. Each worker maps the shards by itself.
+        state = self.__dict__.copy()
+        state['memmap_dict'] = {}
+        return state
+
+    def __contains__(self, file: str):
+        return self.Row(file) >= 0
+
+    def Row(self, file: str):
+        '''
+        Returns -1 when the file is not in the store.
+        '''
+        index = np.searchsorted(self.sorted_files, file)
+        if index >= self.sorted_files.shape[0] or self.sorted_files[index] != file:
+            return -1
+        return int(self.sorted_rows[index])
+
+    def Check(self, token_dict: Dict[str, int], f0_info_dict: Dict[str, Dict[str, float]], use_between_padding: bool):
+        if str(self.index_dict['Config_Hash']) != Config_Hash(token_dict, f0_info_dict, use_between_padding):
+            raise ValueError(
+                'The pattern store \'{}\' was built with another token dict, F0 info, or between padding. Rebuild it by Pattern_Store.py.'.format(self.store_path)
+                )
+
+    def Memmap(self, shard: int, column: str):
+        key = (shard, column)
+        if not key in self.memmap_dict.keys():
+            self.memmap_dict[key] = np.memmap(Column_Path(self.store_path, shard, column), dtype= self.column_dtype_dict[column], mode= 'r')
+        return self.memmap_dict[key]
+
+    def Bytes(self, file: str, columns: Tuple[str, ...]= ('Token', 'Latent', 'Mel', 'F0')):
+        '''
+        The bytes read by Get.
+        '''
+        row = self.Row(file)
+        if row < 0:
+            raise KeyError(file)
+        return sum([
+            Column_Size(self.codec, column, int(self.index_dict['{}_Length'.format(column)][row]), self.index_dict) * np.dtype(self.column_dtype_dict[column]).itemsize
+            for column in columns
+            ])
+
+    def Get(self, file: str, columns: Tuple[str, ...]= ('Token', 'Latent', 'Mel', 'F0')):
+        '''
+        Returns the columns. They are read-only views of the memmaps when the codec is raw.
+        '''
+        row = self.Row(file)
+        if row < 0:
+            raise KeyError(file)
+        shard = int(self.index_dict['Shard'][row])
+        column_dict = {}
+        for column in columns:
+            offset = int(self.index_dict['{}_Offset'.format(column)][row])
+            length = int(self.index_dict['{}_Length'.format(column)][row])
+            value = self.Memmap(shard, column)[offset:offset + Column_Size(self.codec, column, length, self.index_dict)]
+
+            if self.codec == 'packed' and column == 'Latent':
+                value = Code_Unpack(value, int(self.index_dict['Latent_Dim']) * length)
+            elif self.codec == 'packed' and column in ['Mel', 'F0']:
+                value = Feature_Dequantize(
+                    quantized= value,
+                    scale= self.index_dict['{}_Quantize_Scale'.format(column)][row],
+                    offset= self.index_dict['{}_Quantize_Offset'.format(column)][row],
+                    keep_zero= column == 'F0'
+                    )
+            if column in ['Latent', 'Mel', 'Continuous_Latent']:
+                value = value.reshape(int(self.index_dict['{}_Dim'.format(column)]), length)
+            column_dict[column] = value
+
+        return column_dict
+
+def Column_Size(codec: str, column: str, length: int, dim_dict: Dict[str, int]):
+    '''
+    The number of elements of a pattern in the column file.
+    '''
+    size = length * int(dim_dict['{}_Dim'.format(column)]) if column in ['Latent', 'Mel', 'Continuous_Latent'] else length
+    if codec == 'packed' and column == 'Latent':
+        size = Code_Packed_Size(size)
+
+    return size
+
+def Column_Encode(codec: str, column: str, value: np.ndarray):
+    '''
+    Returns the flatten value to write and the dequantization parameters.
+    '''
+    if column == 'Continuous_Latent':
+        return np.ascontiguousarray(value, dtype= continuous_latent_dtype).reshape(-1), {}
+    elif codec == 'raw':
+        return np.ascontiguousarray(value, dtype= codec_column_dtype_dict[codec][column]).reshape(-1), {}
+    elif column == 'Latent':
+        return Code_Pack(value), {}
+    elif column in ['Mel', 'F0']:
+        quantized, scale, offset = Feature_Quantize(value, keep_zero= column == 'F0')
+        return quantized.reshape(-1), {'{}_Quantize_Scale'.format(column): scale, '{}_Quantize_Offset'.format(column): offset}
+
+    return np.ascontiguousarray(value, dtype= codec_column_dtype_dict[codec][column]).reshape(-1), {}
+
+def Pattern_Store_Generate(
+    pattern_path: str,
+    metadata_file: str,
+    store_path: str,
+    token_dict: Dict[str, int],
+    f0_info_dict: Dict[str, Dict[str, float]],
+    use_between_padding: bool,
+    codec: str= 'raw',
+    shard_size: int= 2 ** 30,
+    max_worker: int= 8,
+    files: Optional[List[str]]= None,
+    continuous_latent: bool= False
+    ):
+    '''
+    Packs every pattern of the metadata into the store.
+    codec: 'raw' or 'packed'. See codec_column_dtype_dict.
+    continuous_latent: When it is True, the latents decoded by the Encodec quantizer are also stored, so training does not decode the codes.
+    shard_size: The bytes of the latent column of a shard. A new shard starts when it is exceeded.
+    files: When it is given, only these files are packed instead of the file list of the metadata.
+    '''
+    from Datasets import Text_to_Token
+    from Pattern_Generator import Thread_Map
+
+    if not codec in codec_column_dtype_dict.keys():
+        raise ValueError('Unsupported codec: {}. Supported codecs: {}'.format(codec, list(codec_column_dtype_dict.keys())))
+
+    if files is None:
+        metadata_dict = pickle.load(open(os.path.join(pattern_path, metadata_file).replace('\\', '/'), 'rb'))
+        files = metadata_dict['File_List']
+    os.makedirs(store_path, exist_ok= True)
+
+    if continuous_latent:
+        import torch
+        from encodec import EncodecModel
+        encodec = EncodecModel.encodec_model_24khz()
+
+    def Pattern_Load(file: str):
+        pattern_dict = pickle.load(open(os.path.join(pattern_path, file).replace('\\', '/'), 'rb'))
+
+        if use_between_padding:
+            token = ['<P>'] * (len(pattern_dict['Pronunciation']) * 2 - 1)
+            token[0::2] = pattern_dict['Pronunciation']
+        else:
+            token = pattern_dict['Pronunciation']
+        token = Text_to_Token(token, token_dict)
+
+        f0 = pattern_dict['F0'].astype(np.float32)
+        f0_info = f0_info_dict[pattern_dict['Speaker']]
+        f0 = np.where(f0 != 0.0, (f0 - f0_info['Mean']) / f0_info['Std'], 0.0)
+        f0 = np.clip(f0, -3.0, 3.0)
+
+        column_dict = {
+            'Token': token,
+            'Latent': pattern_dict['Latent'],
+            'Mel': pattern_dict['Mel'],
+            'F0': f0
+            }
+        if continuous_latent:
+            with torch.inference_mode():
+                column_dict['Continuous_Latent'] = encodec.quantizer.decode(
+                    torch.from_numpy(pattern_dict['Latent']).long().unsqueeze(1)
+                    ).squeeze(0).numpy()   # [Latent_d, Latent_t]
+        # Encoding is done in the workers.
+        return {
+            column: (value.shape, *Column_Encode(codec, column, value))
+            for column, value in column_dict.items()
+            }
+
+    column_dtype_dict = dict(codec_column_dtype_dict[codec])
+    if continuous_latent:
+        column_dtype_dict['Continuous_Latent'] = continuous_latent_dtype
+    index_dict = {key: [] for key in ['Shard'] + ['{}_{}'.format(column, x) for column in column_dtype_dict.keys() for x in ['Offset', 'Length']]}
+    parameter_dict = {}
+    dim_dict = {}
+    shard, shard_bytes = 0, 0
+    column_files = {column: open(Column_Path(store_path, shard, column), 'wb') for column in column_dtype_dict.keys()}
+    offset_dict = {column: 0 for column in column_dtype_dict.keys()}
+
+    for column_dict in tqdm(Thread_Map(Pattern_Load, files, max_worker= max_worker), total= len(files), desc= store_path):
+        if shard_bytes >= shard_size:
+            for file in column_files.values():
+                file.close()
+            shard, shard_bytes = shard + 1, 0
+            column_files = {column: open(Column_Path(store_path, shard, column), 'wb') for column in column_dtype_dict.keys()}
+            offset_dict = {column: 0 for column in column_dtype_dict.keys()}
+
+        index_dict['Shard'].append(shard)
+        for column, (shape, value, parameters) in column_dict.items():
+            column_files[column].write(value.tobytes())
+            index_dict['{}_Offset'.format(column)].append(offset_dict[column])
+            index_dict['{}_Length'.format(column)].append(shape[-1])
+            offset_dict[column] += value.size
+            for key, parameter in parameters.items():
+                parameter_dict.setdefault(key, []).append(parameter)
+            if len(shape) == 2:
+                dim_dict['{}_Dim'.format(column)] = shape[0]
+        shard_bytes += column_dict['Latent'][1].nbytes
+
+    for file in column_files.values():
+        file.close()
+
+    # The index is written last, so an interrupted build does not leave a loadable store.
+    # np.savez appends '.npz' to a path, so the file object is given.
+    with open(os.path.join(store_path, 'INDEX.NPZ').replace('\\', '/'), 'wb') as f:
+        np.savez(
+            f,
+            Codec= np.array(codec),
+            Files= np.array(files),
+            Config_Hash= np.array(Config_Hash(token_dict, f0_info_dict, use_between_padding)),
+            **{key: np.array(value, dtype= np.int64) for key, value in index_dict.items()},
+            **{key: np.array(value, dtype= np.float32) for key, value in parameter_dict.items()},
+            **{key: np.array(value) for key, value in dim_dict.items()}
+            )
+
+    print('Pattern store generated: {} patterns, {} shards, {} codec{}.'.format(len(files), shard + 1, codec, ' with continuous latents' if continuous_latent else ''))
+
+def Pattern_Store_Benchmark(
+    pattern_path: str,
+    metadata_file: str,
+    token_dict: Dict[str, int],
+    f0_info_dict: Dict[str, Dict[str, float]],
+    use_between_padding: bool,
+    count: int= 256,
+    max_worker: int= 8
+    ):
+    '''
+    Builds a temporary store of each codec from the first patterns, and reports the bytes read per sample against the decode time.
+    The store files are in the page cache while timing, so the time is the decode cost without I/O.
+    With the network bandwidth B bytes/sec, the read time of a sample is about Bytes / B + Decode.
+    '''
+    metadata_dict = pickle.load(open(os.path.join(pattern_path, metadata_file).replace('\\', '/'), 'rb'))
+    files = metadata_dict['File_List'][:count]
+
+    result_dict = {}
+    column_dicts_dict = {}
+    temp_path = tempfile.mkdtemp()
+    try:
+        for codec in codec_column_dtype_dict.keys():
+            store_path = os.path.join(temp_path, codec).replace('\\', '/')
+            Pattern_Store_Generate(
+                pattern_path= pattern_path,
+                metadata_file= metadata_file,
+                store_path= store_path,
+                token_dict= token_dict,
+                f0_info_dict= f0_info_dict,
+                use_between_padding= use_between_padding,
+                codec= codec,
+                max_worker= max_worker,
+                files= files
+                )
+            store = Pattern_Store(store_path)
+            for file in files:  # Warm up the page cache.
+                store.Get(file)
+
+            start_time = time.time()
+            column_dicts_dict[codec] = [{column: np.array(value) for column, value in store.Get(file).items()} for file in files]
+            elapsed_time = time.time() - start_time
+            result_dict[codec] = (
+                np.mean([store.Bytes(file) for file in files]),
+                elapsed_time / len(files)
+                )
+            del store
+    finally:
+        shutil.rmtree(temp_path, ignore_errors= True)
+
+    raw_bytes = result_dict['raw'][0]
+    for codec, (sample_bytes, decode_time) in result_dict.items():
+        print('{}: {:.1f} KB/sample ({:.2%} of raw), decode {:.3f} ms/sample'.format(codec, sample_bytes / 1024, sample_bytes / raw_bytes, decode_time * 1000))
+    for codec, column_dicts in column_dicts_dict.items():
+        if codec == 'raw':
+            continue
+        assert all([(x['Latent'] == y['Latent']).all() for x, y in zip(column_dicts, column_dicts_dict['raw'])]), 'The codes are not lossless.'
+        for column in ['Mel', 'F0']:
+            errors = np.concatenate([np.abs(x[column].astype(np.float32) - y[column].astype(np.float32)).reshape(-1) for x, y in zip(column_dicts, column_dicts_dict['raw'])])
+            print('{} {}: mean abs error {:.5f}, max abs error {:.5f}'.format(codec, column, errors.mean(), errors.max()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-hp", "--hyper_parameters", required=True, type= str)
+    parser.add_argument("-ss", "--shard_size", default= 2 ** 30, type= int)
+    parser.add_argument("-mw", "--max_worker", default= 8, type= int)
+    parser.add_argument("-benchmark", "--benchmark", default= 0, type= int, help= 'The number of train patterns to compare the codecs. The stores are not generated.')
+    args = parser.parse_args()
+
+    hp = Recursive_Parse(yaml.load(
+        open(args.hyper_parameters, encoding='utf-8'),
+        Loader=yaml.Loader
+        ))
+    token_dict = yaml.load(open(hp.Token_Path, 'r', encoding= 'utf-8-sig'), Loader=yaml.Loader)
+    f0_info_dict = yaml.load(open(hp.F0_Info_Path, 'r'), Loader=yaml.Loader)
+
+    if args.benchmark > 0:
+        Pattern_Store_Benchmark(
+            pattern_path= hp.Train.Train_Pattern.Path,
+            metadata_file= hp.Train.Train_Pattern.Metadata_File,
+            token_dict= token_dict,
+            f0_info_dict= f0_info_dict,
+            use_between_padding= hp.Duration_Predictor.Use_Between_Padding,
+            count= args.benchmark,
+            max_worker= args.max_worker
+            )
+        quit()
+
+    for pattern_hp in [hp.Train.Train_Pattern, hp.Train.Eval_Pattern]:
+        Pattern_Store_Generate(
+            pattern_path= pattern_hp.Path,
+            metadata_file= pattern_hp.Metadata_File,
+            store_path= os.path.join(pattern_hp.Path, hp.Train.Pattern_Store.Directory).replace('\\', '/'),
+            token_dict= token_dict,
+            f0_info_dict= f0_info_dict,
+            use_between_padding= hp.Duration_Predictor.Use_Between_Padding,
+            codec= hp.Train.Pattern_Store.Codec,
+            shard_size= args.shard_size,
+            max_worker= args.max_worker,
+            continuous_latent= hp.Train.Pattern_Store.Continuous_Latent
+            )
+
+# python Pattern_Store.py -hp Hyper_Parameters.yaml
+# python Pattern_Store.py -hp Hyper_Parameters.yaml -benchmark 512
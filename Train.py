@@ -2,7 +2,7 @@ import os
 os.environ['FOR_DISABLE_CONSOLE_CTRL_HANDLER'] = 'T'    # This is ot prevent to be called Fortran Ctrl+C crash in Windows.
 import torch
 import numpy as np
-import logging, yaml, os, sys, argparse, math, pickle, wandb
+import logging, yaml, os, sys, argparse, math, pickle, random, wandb
 from tqdm import tqdm
 from collections import defaultdict
 import matplotlib
@@ -13,11 +13,12 @@ from scipy.io import wavfile
 from Modules.Modules import NaturalSpeech2, Mask_Generate
 from Modules.Nvidia_Alignment_Learning_Framework import AttentionBinarizationLoss, AttentionCTCLoss
 
-from Datasets import Dataset, Inference_Dataset, Collater, Inference_Collater
+from Datasets import Dataset, Stream_Dataset, Bucket_Batch_Sampler, Weighted_Sampler, Inference_Dataset, Collater, Inference_Collater, Speech_Prompt_Gather
+from Pattern_Generator import Phonemizer_Service
 from Noam_Scheduler import Noam_Scheduler
 from Logger import Logger
 
-from meldataset import mel_spectrogram
+from meldataset import MelExtractor
 from distributed import init_distributed, apply_gradient_allreduce, reduce_tensor
 from Arg_Parser import Recursive_Parse, To_Non_Recursive_Dict
 
@@ -55,6 +56,18 @@ class Trainer:
             torch.cuda.set_device(self.gpu_id)
         
         self.steps = steps
+        self.epochs = 0
+        self.epoch_batches = 0  # The consumed batches of the current epoch.
+        self.rng_state = None   # The RNG states of the checkpoint. They are loaded when the train data loader starts.
+        self.mel_extractor = MelExtractor(
+            n_fft= self.hp.Sound.Frame_Shift * 4,
+            num_mels= self.hp.Sound.Mel_Dim,
+            sampling_rate= self.hp.Sound.Sample_Rate,
+            hop_size= self.hp.Sound.Frame_Shift,
+            win_size= self.hp.Sound.Frame_Shift * 4,
+            fmin= 0,
+            fmax= None
+            )
 
         self.Dataset_Generate()
         self.Model_Generate()
@@ -88,20 +101,34 @@ class Trainer:
         self.latent_std = sum([x['Std'] for x in latent_info_dict.values()]) / len(latent_info_dict)
         f0_info_dict = yaml.load(open(self.hp.F0_Info_Path, 'r'), Loader=yaml.Loader)
 
-        train_dataset = Dataset(
-            token_dict= token_dict,
-            f0_info_dict= f0_info_dict,
-            use_between_padding= self.hp.Duration_Predictor.Use_Between_Padding,
-            pattern_path= self.hp.Train.Train_Pattern.Path,
-            metadata_file= self.hp.Train.Train_Pattern.Metadata_File,
-            latent_length_min= max(self.hp.Train.Train_Pattern.Feature_Length.Min, self.hp.Train.Segment_Size),
-            latent_length_max= self.hp.Train.Train_Pattern.Feature_Length.Max,
-            text_length_min= self.hp.Train.Train_Pattern.Text_Length.Min,
-            text_length_max= self.hp.Train.Train_Pattern.Text_Length.Max,
-            accumulated_dataset_epoch= self.hp.Train.Train_Pattern.Accumulated_Dataset_Epoch,
-            augmentation_ratio= self.hp.Train.Train_Pattern.Augmentation_Ratio,
-            use_pattern_cache= self.hp.Train.Pattern_Cache
-            )
+        if self.hp.Train.Stream.Use:
+            train_dataset = Stream_Dataset(
+                token_dict= token_dict,
+                f0_info_dict= f0_info_dict,
+                use_between_padding= self.hp.Duration_Predictor.Use_Between_Padding,
+                shard_path= os.path.join(self.hp.Train.Train_Pattern.Path, self.hp.Train.Stream.Directory).replace('\\', '/'),
+                latent_length_min= max(self.hp.Train.Train_Pattern.Feature_Length.Min, self.hp.Train.Segment_Size),
+                latent_length_max= self.hp.Train.Train_Pattern.Feature_Length.Max,
+                text_length_min= self.hp.Train.Train_Pattern.Text_Length.Min,
+                text_length_max= self.hp.Train.Train_Pattern.Text_Length.Max,
+                shuffle_buffer_size= self.hp.Train.Stream.Shuffle_Buffer_Size
+                )
+        else:
+            train_dataset = Dataset(
+                token_dict= token_dict,
+                f0_info_dict= f0_info_dict,
+                use_between_padding= self.hp.Duration_Predictor.Use_Between_Padding,
+                pattern_path= self.hp.Train.Train_Pattern.Path,
+                metadata_file= self.hp.Train.Train_Pattern.Metadata_File,
+                latent_length_min= max(self.hp.Train.Train_Pattern.Feature_Length.Min, self.hp.Train.Segment_Size),
+                latent_length_max= self.hp.Train.Train_Pattern.Feature_Length.Max,
+                text_length_min= self.hp.Train.Train_Pattern.Text_Length.Min,
+                text_length_max= self.hp.Train.Train_Pattern.Text_Length.Max,
+                pattern_cache_size= int(self.hp.Train.Pattern_Cache.Size * 2 ** 30) if self.hp.Train.Pattern_Cache.Use else 0,
+                pattern_cache_directory= self.hp.Train.Pattern_Cache.Directory,
+                pattern_store_path= os.path.join(self.hp.Train.Train_Pattern.Path, self.hp.Train.Pattern_Store.Directory).replace('\\', '/') if self.hp.Train.Pattern_Store.Use else None,
+                use_continuous_latent= self.hp.Train.Pattern_Store.Use and self.hp.Train.Pattern_Store.Continuous_Latent
+                )
         eval_dataset = Dataset(
             token_dict= token_dict,
             f0_info_dict= f0_info_dict,
@@ -112,7 +139,10 @@ class Trainer:
             latent_length_max= self.hp.Train.Eval_Pattern.Feature_Length.Max,
             text_length_min= self.hp.Train.Eval_Pattern.Text_Length.Min,
             text_length_max= self.hp.Train.Eval_Pattern.Text_Length.Max,
-            use_pattern_cache= self.hp.Train.Pattern_Cache
+            pattern_cache_size= int(self.hp.Train.Pattern_Cache.Size * 2 ** 30) if self.hp.Train.Pattern_Cache.Use else 0,
+            pattern_cache_directory= self.hp.Train.Pattern_Cache.Directory,
+            pattern_store_path= os.path.join(self.hp.Train.Eval_Pattern.Path, self.hp.Train.Pattern_Store.Directory).replace('\\', '/') if self.hp.Train.Pattern_Store.Use else None,
+            use_continuous_latent= self.hp.Train.Pattern_Store.Use and self.hp.Train.Pattern_Store.Continuous_Latent
             )
         inference_dataset = Inference_Dataset(
             token_dict= token_dict,
@@ -121,15 +151,33 @@ class Trainer:
             use_between_padding= self.hp.Duration_Predictor.Use_Between_Padding,
             texts= self.hp.Train.Inference_in_Train.Text,
             references= self.hp.Train.Inference_in_Train.Reference,
+            phoneme_cache_path= self.hp.Phoneme_Cache_Path,
+            phonemizer_service= Phonemizer_Service(num_workers= self.hp.Phonemizer_Workers)
             )
 
+        if not self.hp.Train.Stream.Use:
+            # The speaker augmentation and the accumulated epochs are by the sampler instead of duplicated pattern lists.
+            train_weights = train_dataset.Speaker_Weights(self.hp.Train.Train_Pattern.Augmentation_Ratio)
+            virtual_epoch_length = \
+                self.hp.Train.Train_Pattern.Virtual_Epoch_Length or \
+                int(round(train_weights.sum())) * self.hp.Train.Train_Pattern.Accumulated_Dataset_Epoch
+
         if self.gpu_id == 0:
-            logging.info('The number of train patterns = {}.'.format(len(train_dataset) // self.hp.Train.Train_Pattern.Accumulated_Dataset_Epoch))
+            logging.info('The number of train patterns = {}.'.format(len(train_dataset)))
+            if not self.hp.Train.Stream.Use:
+                logging.info('The virtual epoch length = {}.'.format(virtual_epoch_length))
             logging.info('The number of development patterns = {}.'.format(len(eval_dataset)))
             logging.info('The number of inference patterns = {}.'.format(len(inference_dataset)))
 
         collater = Collater(
-            token_dict= token_dict
+            token_dict= token_dict,
+            pin_memory= True
+            )
+        train_collater = Collater(
+            token_dict= token_dict,
+            pin_memory= True,
+            seed= 0,
+            rank= self.gpu_id if self.hp.Use_Multi_GPU else 0
             )
         inference_collater = Inference_Collater(
             token_dict= token_dict,
@@ -137,16 +185,44 @@ class Trainer:
             )
 
         self.dataloader_dict = {}
-        self.dataloader_dict['Train'] = torch.utils.data.DataLoader(
-            dataset= train_dataset,
-            sampler= torch.utils.data.DistributedSampler(train_dataset, shuffle= True) \
-                     if self.hp.Use_Multi_GPU else \
-                     torch.utils.data.RandomSampler(train_dataset),
-            collate_fn= collater,
-            batch_size= self.hp.Train.Batch_Size,
-            num_workers= self.hp.Train.Num_Workers,
-            pin_memory= True
-            )
+        if self.hp.Train.Bucketing.Use and not self.hp.Train.Stream.Use:
+            latent_lengths, token_lengths = train_dataset.Lengths()
+            self.dataloader_dict['Train'] = torch.utils.data.DataLoader(
+                dataset= train_dataset,
+                batch_sampler= Bucket_Batch_Sampler(
+                    latent_lengths= latent_lengths,
+                    token_lengths= token_lengths,
+                    frame_budget= self.hp.Train.Bucketing.Frame_Budget,
+                    max_batch_size= self.hp.Train.Bucketing.Max_Batch_Size,
+                    weights= train_weights,
+                    num_samples= virtual_epoch_length,
+                    num_replicas= self.num_gpus if self.hp.Use_Multi_GPU else 1,
+                    rank= self.gpu_id if self.hp.Use_Multi_GPU else 0,
+                    rank_affine= self.hp.Train.Rank_Affinity.Use,
+                    rebalance_interval= self.hp.Train.Rank_Affinity.Rebalance_Interval
+                    ),
+                collate_fn= train_collater,
+                num_workers= self.hp.Train.Num_Workers,
+                pin_memory= True,
+                generator= torch.Generator()
+                )
+        else:
+            self.dataloader_dict['Train'] = torch.utils.data.DataLoader(
+                dataset= train_dataset,
+                sampler= None if self.hp.Train.Stream.Use else Weighted_Sampler(
+                    weights= train_weights,
+                    num_samples= virtual_epoch_length,
+                    num_replicas= self.num_gpus if self.hp.Use_Multi_GPU else 1,
+                    rank= self.gpu_id if self.hp.Use_Multi_GPU else 0,
+                    rank_affine= self.hp.Train.Rank_Affinity.Use,
+                    rebalance_interval= self.hp.Train.Rank_Affinity.Rebalance_Interval
+                    ),
+                collate_fn= train_collater,
+                batch_size= self.hp.Train.Batch_Size,
+                num_workers= self.hp.Train.Num_Workers,
+                pin_memory= True,
+                generator= torch.Generator()
+                )
         self.dataloader_dict['Eval'] = torch.utils.data.DataLoader(
             dataset= eval_dataset,
             sampler= torch.utils.data.DistributedSampler(eval_dataset, shuffle= True) \
@@ -195,17 +271,23 @@ class Trainer:
         # if self.gpu_id == 0:
         #     logging.info(self.model)
 
-    def Train_Step(self, tokens, token_lengths, speech_prompts, speech_prompts_for_diffusion, latents, latent_lengths, f0s, mels, attention_priors):
+    def Train_Step(self, tokens, token_lengths, speech_prompt_offsets, latents, latent_lengths, f0s, mels, continuous_latents):
         loss_dict = {}
+        speech_prompt_length = latent_lengths.min().item() // 2  # Same to the collater. latent_lengths is still on CPU.
         tokens = tokens.to(self.device, non_blocking=True)
         token_lengths = token_lengths.to(self.device, non_blocking=True)
-        speech_prompts = speech_prompts.to(self.device, non_blocking=True)
-        speech_prompts_for_diffusion = speech_prompts_for_diffusion.to(self.device, non_blocking=True)
         latents = latents.to(self.device, non_blocking=True)
+        if not continuous_latents is None:
+            # The speech prompts are cropped from the continuous latents, so the model does not decode the codes.
+            continuous_latents = continuous_latents.to(self.device, non_blocking=True).float()
+        speech_prompts, speech_prompts_for_diffusion = Speech_Prompt_Gather(
+            latents if continuous_latents is None else continuous_latents,
+            speech_prompt_offsets,
+            speech_prompt_length
+            )
         latent_lengths = latent_lengths.to(self.device, non_blocking=True)
         f0s = f0s.to(self.device, non_blocking=True)
         mels = mels.to(self.device, non_blocking=True)
-        attention_priors = attention_priors.to(self.device, non_blocking=True)
 
         with torch.cuda.amp.autocast(enabled= self.hp.Use_Mixed_Precision):
             _, latents_slice, diffusion_starts, diffusion_targets, diffusion_predictions, \
@@ -219,7 +301,7 @@ class Trainer:
                 latent_lengths= latent_lengths,
                 f0s= f0s,
                 mels= mels,
-                attention_priors= attention_priors
+                continuous_latents= continuous_latents
                 )
             
             with torch.cuda.amp.autocast(enabled= False):
@@ -298,18 +380,32 @@ class Trainer:
 
     def Train_Epoch(self):
         self.accumulated_grad_dict = {}
-        for tokens, token_lengths, speech_prompts, speech_prompts_for_diffusion, latents, latent_lengths, f0s, mels, attention_priors in self.dataloader_dict['Train']:
+        # When the epoch is resumed from a checkpoint, the samplers skip the consumed batches without reading them.
+        if isinstance(self.dataloader_dict['Train'].dataset, Stream_Dataset):
+            self.dataloader_dict['Train'].dataset.set_epoch(self.epochs, start_batch= self.epoch_batches, batch_size= self.hp.Train.Batch_Size)
+        if isinstance(self.dataloader_dict['Train'].batch_sampler, Bucket_Batch_Sampler):
+            self.dataloader_dict['Train'].batch_sampler.set_epoch(self.epochs, start_index= self.epoch_batches)
+        if isinstance(self.dataloader_dict['Train'].sampler, Weighted_Sampler):
+            self.dataloader_dict['Train'].sampler.set_epoch(self.epochs, start_index= self.epoch_batches * self.hp.Train.Batch_Size)
+        self.dataloader_dict['Train'].collate_fn.set_epoch(self.epochs, start_batch= self.epoch_batches)
+        # The worker seeds are drawn from the generator of the data loader by the epoch, so they do not depend on the global RNG states.
+        self.dataloader_dict['Train'].generator.manual_seed(self.epochs * self.num_gpus + self.gpu_id)
+        if not self.rng_state is None:
+            self.RNG_Load(self.rng_state)
+            self.rng_state = None
+        dataloader_iterator = iter(self.dataloader_dict['Train'])
+        for tokens, token_lengths, speech_prompt_offsets, latents, latent_lengths, f0s, mels, continuous_latents in dataloader_iterator:
             self.Train_Step(
                 tokens= tokens,
                 token_lengths= token_lengths,
-                speech_prompts= speech_prompts,
-                speech_prompts_for_diffusion= speech_prompts_for_diffusion,
+                speech_prompt_offsets= speech_prompt_offsets,
                 latents= latents,
                 latent_lengths= latent_lengths,
                 f0s= f0s,
                 mels= mels,
-                attention_priors= attention_priors,
+                continuous_latents= continuous_latents
                 )
+            self.epoch_batches += 1
 
             if self.steps % self.hp.Train.Checkpoint_Save_Interval == 0:
                 self.Save_Checkpoint()
@@ -320,6 +416,8 @@ class Trainer:
                     for tag, loss in self.scalar_dict['Train'].items()
                     }
                 self.scalar_dict['Train']['Learning_Rate'] = self.scheduler.get_last_lr()[0]
+                if isinstance(self.dataloader_dict['Train'].dataset, Dataset) and not self.dataloader_dict['Train'].dataset.pattern_cache is None:
+                    self.scalar_dict['Train']['Pattern_Cache/Hit_Rate'] = self.dataloader_dict['Train'].dataset.pattern_cache.Statistics()['Hit_Rate']
                 self.writer_dict['Train'].add_scalar_dict(self.scalar_dict['Train'], self.steps)
                 if self.hp.Weights_and_Biases.Use:
                     wandb.log(
@@ -332,26 +430,37 @@ class Trainer:
                         )
                 self.scalar_dict['Train'] = defaultdict(float)
 
-            if self.steps % self.hp.Train.Evaluation_Interval == 0:
-                self.Evaluation_Epoch()
-
-            if self.steps % self.hp.Train.Inference_Interval == 0:
-                self.Inference_Epoch()
+            if self.steps % self.hp.Train.Evaluation_Interval == 0 or self.steps % self.hp.Train.Inference_Interval == 0:
+                # Evaluation and inference keep the RNG states of training, so a run resumed from a checkpoint draws the same random numbers.
+                rng_state = self.RNG_State()
+                if self.steps % self.hp.Train.Evaluation_Interval == 0:
+                    self.Evaluation_Epoch()
+                if self.steps % self.hp.Train.Inference_Interval == 0:
+                    self.Inference_Epoch()
+                self.RNG_Load(rng_state)
             
             if self.steps >= self.hp.Train.Max_Step:
                 return
 
-    def Evaluation_Step(self, tokens, token_lengths, speech_prompts, speech_prompts_for_diffusion, latents, latent_lengths, f0s, mels, attention_priors):
+        self.epoch_batches = 0
+
+    def Evaluation_Step(self, tokens, token_lengths, speech_prompt_offsets, latents, latent_lengths, f0s, mels, continuous_latents):
         loss_dict = {}
+        speech_prompt_length = latent_lengths.min().item() // 2  # Same to the collater. latent_lengths is still on CPU.
         tokens = tokens.to(self.device, non_blocking=True)
         token_lengths = token_lengths.to(self.device, non_blocking=True)
-        speech_prompts = speech_prompts.to(self.device, non_blocking=True)
-        speech_prompts_for_diffusion = speech_prompts_for_diffusion.to(self.device, non_blocking=True)
         latents = latents.to(self.device, non_blocking=True)
+        if not continuous_latents is None:
+            # The speech prompts are cropped from the continuous latents, so the model does not decode the codes.
+            continuous_latents = continuous_latents.to(self.device, non_blocking=True).float()
+        speech_prompts, speech_prompts_for_diffusion = Speech_Prompt_Gather(
+            latents if continuous_latents is None else continuous_latents,
+            speech_prompt_offsets,
+            speech_prompt_length
+            )
         latent_lengths = latent_lengths.to(self.device, non_blocking=True)
         f0s = f0s.to(self.device, non_blocking=True)
         mels = mels.to(self.device, non_blocking=True)
-        attention_priors = attention_priors.to(self.device, non_blocking=True)
 
         with torch.cuda.amp.autocast(enabled= self.hp.Use_Mixed_Precision):
             _, latents_slice, diffusion_starts, diffusion_targets, diffusion_predictions, \
@@ -365,7 +474,7 @@ class Trainer:
                 latent_lengths= latent_lengths,
                 f0s= f0s,
                 mels= mels,
-                attention_priors= attention_priors
+                continuous_latents= continuous_latents
                 )
 
             with torch.cuda.amp.autocast(enabled= False):
@@ -410,7 +519,9 @@ class Trainer:
 
         self.model.eval()
 
-        for step, (tokens, token_lengths, speech_prompts, speech_prompts_for_diffusion, latents, latent_lengths, f0s, mels, attention_priors) in tqdm(
+        if isinstance(self.dataloader_dict['Eval'].sampler, torch.utils.data.DistributedSampler):
+            self.dataloader_dict['Eval'].sampler.set_epoch(self.epochs)
+        for step, (tokens, token_lengths, speech_prompt_offsets, latents, latent_lengths, f0s, mels, continuous_latents) in tqdm(
             enumerate(self.dataloader_dict['Eval'], 1),
             desc='[Evaluation]',
             total= math.ceil(len(self.dataloader_dict['Eval'].dataset) / self.hp.Train.Batch_Size / self.num_gpus)
@@ -418,13 +529,12 @@ class Trainer:
             durations = self.Evaluation_Step(
                 tokens= tokens,
                 token_lengths= token_lengths,
-                speech_prompts= speech_prompts,
-                speech_prompts_for_diffusion= speech_prompts_for_diffusion,
+                speech_prompt_offsets= speech_prompt_offsets,
                 latents= latents,
                 latent_lengths= latent_lengths,
                 f0s= f0s,
                 mels= mels,
-                attention_priors= attention_priors,
+                continuous_latents= continuous_latents
                 )
 
         if self.gpu_id == 0:
@@ -436,6 +546,7 @@ class Trainer:
             self.writer_dict['Evaluation'].add_histogram_model(self.model, 'NaturalSpeech2', self.steps, delete_keywords=[])
         
             index = np.random.randint(0, tokens.size(0))
+            speech_prompts, _ = Speech_Prompt_Gather(latents, speech_prompt_offsets, latent_lengths.min().item() // 2)
 
             with torch.inference_mode():
                 prediction_audios, *_, prediction_durations, prediction_f0s, prediction_latent_lengths = self.model(
@@ -455,28 +566,18 @@ class Trainer:
             target_audio = target_audios[0, :target_audio_length].clamp(-1.0, 1.0)
             prediction_audio = prediction_audios[0, :prediction_audio_length].clamp(-1.0, 1.0)
 
-            target_feature = mel_spectrogram(
-                target_audio.unsqueeze(0),
-                n_fft= self.hp.Sound.Frame_Shift * 4,
-                num_mels= self.hp.Sound.Mel_Dim,
-                sampling_rate= self.hp.Sound.Sample_Rate,
-                hop_size= self.hp.Sound.Frame_Shift,
-                win_size= self.hp.Sound.Frame_Shift * 4,
-                fmin= 0,
-                fmax= None
-                ).squeeze(0).cpu().numpy()
             if prediction_audio_length > self.hp.Sound.Frame_Shift * 10:
-                prediction_feature = mel_spectrogram(
-                    prediction_audio.unsqueeze(0),
-                    n_fft= self.hp.Sound.Frame_Shift * 4,
-                    num_mels= self.hp.Sound.Mel_Dim,
-                    sampling_rate= self.hp.Sound.Sample_Rate,
-                    hop_size= self.hp.Sound.Frame_Shift,
-                    win_size= self.hp.Sound.Frame_Shift * 4,
-                    fmin= 0,
-                    fmax= None
-                    ).squeeze(0).cpu().numpy()
+                # Target and prediction are extracted in one padded batch.
+                features, feature_lengths = self.mel_extractor(
+                    torch.nn.utils.rnn.pad_sequence([target_audio, prediction_audio], batch_first= True),
+                    torch.LongTensor([target_audio.size(0), prediction_audio.size(0)]).to(target_audio.device)
+                    )
+                target_feature, prediction_feature = [
+                    feature[:, :feature_length].cpu().numpy()
+                    for feature, feature_length in zip(features, feature_lengths.tolist())
+                    ]
             else:
+                target_feature = self.mel_extractor(target_audio.unsqueeze(0)).squeeze(0).cpu().numpy()
                 logging.warning('Prediction feature could not be generated because too shoart audio length.')
                 prediction_feature = np.zeros(shape= (self.hp.Sound.Mel_Dim, 1), dtype= np.float32)
 
@@ -679,19 +780,39 @@ class Trainer:
         self.optimizer.load_state_dict(state_dict['Optimizer'])
         self.scheduler.load_state_dict(state_dict['Scheduler'])
         self.steps = state_dict['Steps']
+        # The checkpoints before the data states start a new epoch.
+        self.epochs = state_dict.get('Epochs', 0)
+        self.epoch_batches = state_dict.get('Epoch_Batches', 0)
+        # 'RNG' is the list of the RNG states by GPU. A dict is the state of GPU 0 only.
+        rng_states = state_dict.get('RNG', None)
+        if isinstance(rng_states, dict):
+            rng_states = [rng_states]
+        if not rng_states is None and self.gpu_id < len(rng_states):
+            self.rng_state = rng_states[self.gpu_id]
+        elif not rng_states is None:
+            logging.warning('There is no RNG state of GPU {} at {} steps. The RNG states are not restored.'.format(self.gpu_id, self.steps))
 
         logging.info('Checkpoint loaded at {} steps in GPU {}.'.format(self.steps, self.gpu_id))
 
     def Save_Checkpoint(self):
+        # The epoch and the consumed batches are same over the GPUs, but the RNG states are not, so GPU 0 gathers them into the checkpoint.
+        rng_states = [self.RNG_State()]
+        if self.num_gpus > 1:
+            rng_states = [None] * self.num_gpus
+            torch.distributed.all_gather_object(rng_states, self.RNG_State())
         if self.gpu_id != 0:
             return
 
         os.makedirs(self.hp.Checkpoint_Path, exist_ok= True)
+
         state_dict = {
             'Model': self.model.state_dict(),
             'Optimizer': self.optimizer.state_dict(),
             'Scheduler': self.scheduler.state_dict(),
-            'Steps': self.steps
+            'Steps': self.steps,
+            'Epochs': self.epochs,
+            'Epoch_Batches': self.epoch_batches,
+            'RNG': rng_states
             }
         checkpoint_path = os.path.join(self.hp.Checkpoint_Path, 'S_{}.pt'.format(self.steps).replace('\\', '/'))
 
@@ -706,6 +827,22 @@ class Trainer:
             ]):
             wandb.save(checkpoint_path)
 
+    def RNG_State(self):
+        numpy_state = np.random.get_state()
+        return {
+            'Python': random.getstate(),
+            'NumPy': (numpy_state[0], numpy_state[1].tolist()) + tuple(numpy_state[2:]),   # The lists are loaded by torch.load with weights_only.
+            'Torch': torch.get_rng_state(),
+            'CUDA': torch.cuda.get_rng_state() if torch.cuda.is_available() else None
+            }
+
+    def RNG_Load(self, rng_state):
+        random.setstate(rng_state['Python'])
+        np.random.set_state((rng_state['NumPy'][0], np.array(rng_state['NumPy'][1], dtype= np.uint32)) + tuple(rng_state['NumPy'][2:]))
+        torch.set_rng_state(rng_state['Torch'])
+        if torch.cuda.is_available() and not rng_state['CUDA'] is None:
+            torch.cuda.set_rng_state(rng_state['CUDA'])
+
     def _Set_Distribution(self):
         if self.num_gpus > 1:
             self.model = apply_gradient_allreduce(self.model)
@@ -732,6 +869,7 @@ class Trainer:
         while self.steps < self.hp.Train.Max_Step:
             try:
                 self.Train_Epoch()
+                self.epochs += 1
             except KeyboardInterrupt:
                 self.Save_Checkpoint()
                 exit(1)
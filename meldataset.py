@@ -26,6 +26,7 @@ import math
 import os
 import random
 import logging
+import threading
 import torch
 import torch.utils.data
 import numpy as np
@@ -67,34 +68,91 @@ def spectral_de_normalize_torch(magnitudes):
     output = dynamic_range_decompression_torch(magnitudes)
     return output
 
-mel_basis = {}
-hann_window = {}
-
-def mel_spectrogram(y, n_fft, num_mels, sampling_rate, hop_size, win_size, fmin, fmax, center=False, use_normalize= True):
-    if torch.min(y) < -1.:
-        logging.warning('min value is {}'.format(torch.min(y)))
-    if torch.max(y) > 1.:
-        logging.warning('max value is {}'.format(torch.max(y)))
+class MelExtractor:
+    """
+    Mel spectrogram of hifigan style.
+    The mel filters and the windows are cached by the full parameter set and the device,
+    and the cache is shared by every extractor of the process with a lock, so an extractor is cheap to create and safe across threads.
+    A padded batch with lengths is accepted. Each audio is reflect padded by its own length before the zero padding,
+    so the valid frames are same to extracting the audio alone.
+    """
+    _mel_basis = {}
+    _window = {}
+    _lock = threading.Lock()
+
+    def __init__(self, n_fft, num_mels, sampling_rate, hop_size, win_size, fmin, fmax, center=False, use_normalize= True):
+        self.n_fft = n_fft
+        self.num_mels = num_mels
+        self.sampling_rate = sampling_rate
+        self.hop_size = hop_size
+        self.win_size = win_size
+        self.fmin = fmin
+        self.fmax = fmax
+        self.center = center
+        self.use_normalize = use_normalize
+
+    @classmethod
+    def get_mel_basis(cls, sampling_rate, n_fft, num_mels, fmin, fmax, device):
+        key = (sampling_rate, n_fft, num_mels, fmin, fmax, str(device))
+        with cls._lock:
+            if key not in cls._mel_basis:
+                mel = librosa_mel_fn(sr= sampling_rate, n_fft= n_fft, n_mels= num_mels, fmin= fmin, fmax= fmax)
+                cls._mel_basis[key] = torch.from_numpy(mel).float().to(device)
+            return cls._mel_basis[key]
+
+    @classmethod
+    def get_window(cls, win_size, device):
+        key = (win_size, str(device))
+        with cls._lock:
+            if key not in cls._window:
+                cls._window[key] = torch.hann_window(win_size).to(device)
+            return cls._window[key]
+
+    def get_lengths(self, lengths):
+        padding = int((self.n_fft-self.hop_size)/2)
+        return (lengths + 2 * padding - self.n_fft) // self.hop_size + 1
+
+    def spectrogram(self, y, lengths= None):
+        """
+        y: [Batch, Audio_t]
+        lengths: [Batch], the valid length of each audio. When None, every audio is full length.
+        """
+        if torch.min(y) < -1.:
+            logging.warning('min value is {}'.format(torch.min(y)))
+        if torch.max(y) > 1.:
+            logging.warning('max value is {}'.format(torch.max(y)))
+
+        padding = int((self.n_fft-self.hop_size)/2)
+        if lengths is None or bool((lengths == y.size(1)).all()):
+            y = torch.nn.functional.pad(y.unsqueeze(1), (padding, padding), mode='reflect').squeeze(1)
+        else:
+            y = torch.nn.utils.rnn.pad_sequence([
+                torch.nn.functional.pad(x[None, None, :length], (padding, padding), mode='reflect')[0, 0]
+                for x, length in zip(y, lengths.tolist())
+                ], batch_first= True)
 
-    global mel_basis, hann_window
-    if fmax not in mel_basis:
-        mel = librosa_mel_fn(sr= sampling_rate, n_fft= n_fft, n_mels= num_mels, fmin= fmin, fmax= fmax)
-        mel_basis[str(fmax)+'_'+str(y.device)] = torch.from_numpy(mel).float().to(y.device)
-        hann_window[str(y.device)] = torch.hann_window(win_size).to(y.device)
+        spec = torch.stft(y, self.n_fft, hop_length=self.hop_size, win_length=self.win_size, window=self.get_window(self.win_size, y.device),
+                          center=self.center, pad_mode='reflect', normalized=False, onesided=True, return_complex=False)
 
-    y = torch.nn.functional.pad(y.unsqueeze(1), (int((n_fft-hop_size)/2), int((n_fft-hop_size)/2)), mode='reflect')
-    y = y.squeeze(1)
+        return torch.sqrt(spec.pow(2).sum(-1)+(1e-9))
 
-    spec = torch.stft(y, n_fft, hop_length=hop_size, win_length=win_size, window=hann_window[str(y.device)],
-                      center=center, pad_mode='reflect', normalized=False, onesided=True, return_complex=False)
+    def __call__(self, y, lengths= None):
+        """
+        y: [Batch, Audio_t]
+        lengths: [Batch]. When it is given, the mel lengths are returned together.
+        """
+        spec = self.spectrogram(y, lengths)
+        spec = torch.matmul(self.get_mel_basis(self.sampling_rate, self.n_fft, self.num_mels, self.fmin, self.fmax, spec.device), spec)
+        if self.use_normalize:
+            spec = spectral_normalize_torch(spec)
 
-    spec = torch.sqrt(spec.pow(2).sum(-1)+(1e-9))
+        if lengths is None:
+            return spec
 
-    spec = torch.matmul(mel_basis[str(fmax)+'_'+str(y.device)], spec)    
-    if use_normalize:
-        spec = spectral_normalize_torch(spec)
+        return spec, self.get_lengths(lengths)
 
-    return spec
+def mel_spectrogram(y, n_fft, num_mels, sampling_rate, hop_size, win_size, fmin, fmax, center=False, use_normalize= True):
+    return MelExtractor(n_fft, num_mels, sampling_rate, hop_size, win_size, fmin, fmax, center, use_normalize)(y)
 
 def cepstral_liftering(y, n_fft, feature_size, hop_size, win_size, cutoff= 3, center=False):
     if torch.min(y) < -1.:
@@ -102,13 +160,12 @@ def cepstral_liftering(y, n_fft, feature_size, hop_size, win_size, cutoff= 3, ce
     if torch.max(y) > 1.:
         logging.warning('max value is {}'.format(torch.max(y)))
 
-    global hann_window
-    hann_window[str(y.device)] = torch.hann_window(win_size).to(y.device)
+    window = MelExtractor.get_window(win_size, y.device)
 
     y = torch.nn.functional.pad(y.unsqueeze(1), (int((n_fft-hop_size)/2), int((n_fft-hop_size)/2)), mode='reflect')
     y = y.squeeze(1)
 
-    spec = torch.stft(y, n_fft, hop_length=hop_size, win_length=win_size, window=hann_window[str(y.device)],
+    spec = torch.stft(y, n_fft, hop_length=hop_size, win_length=win_size, window=window,
                       center=center, pad_mode='reflect', normalized=False, onesided=True, return_complex= True)
     spec = torch.fft.irfft(torch.log(spec+1e-6), axis= 1)
     
@@ -130,13 +187,12 @@ def spectrogram(y, n_fft, hop_size, win_size, center=False, use_normalize= True)
     if torch.max(y) > 1.:
         logging.warning('max value is {}'.format(torch.max(y)))
 
-    global hann_window
-    hann_window[str(y.device)] = torch.hann_window(win_size).to(y.device)
+    window = MelExtractor.get_window(win_size, y.device)
 
     y = torch.nn.functional.pad(y.unsqueeze(1), (int((n_fft-hop_size)/2), int((n_fft-hop_size)/2)), mode='reflect')
     y = y.squeeze(1)
 
-    spec = torch.stft(y, n_fft, hop_length=hop_size, win_length=win_size, window=hann_window[str(y.device)],
+    spec = torch.stft(y, n_fft, hop_length=hop_size, win_length=win_size, window=window,
                       center=center, pad_mode='reflect', normalized=False, onesided=True, return_complex=False)
 
     spec = torch.sqrt(spec.pow(2).sum(-1)+(1e-9))
@@ -148,13 +204,7 @@ def spectrogram(y, n_fft, hop_size, win_size, center=False, use_normalize= True)
 def spectrogram_to_mel(spec, n_fft, num_mels, sampling_rate, win_size, fmin, fmax, use_denorm= False):
     spec = spectral_de_normalize_torch(spec) if use_denorm else spec
     
-    global mel_basis, hann_window
-    if fmax not in mel_basis:
-        mel = librosa_mel_fn(sr= sampling_rate, n_fft= n_fft, n_mels= num_mels, fmin= fmin, fmax= fmax)
-        mel_basis[str(fmax)+'_'+str(spec.device)] = torch.from_numpy(mel).float().to(spec.device)
-        hann_window[str(spec.device)] = torch.hann_window(win_size).to(spec.device)
-
-    spec = torch.matmul(mel_basis[str(fmax)+'_'+str(spec.device)], spec)
+    spec = torch.matmul(MelExtractor.get_mel_basis(sampling_rate, n_fft, num_mels, fmin, fmax, spec.device), spec)
     spec = spectral_normalize_torch(spec)
 
     return spec
@@ -165,13 +215,12 @@ def spec_energy(y, n_fft, hop_size, win_size, center=False):
     if torch.max(y) > 1.:
         logging.warning('max value is {}'.format(torch.max(y)))
 
-    global hann_window
-    hann_window[str(y.device)] = torch.hann_window(win_size).to(y.device)
+    window = MelExtractor.get_window(win_size, y.device)
 
     y = torch.nn.functional.pad(y.unsqueeze(1), (int((n_fft-hop_size)/2), int((n_fft-hop_size)/2)), mode='reflect')
     y = y.squeeze(1)
 
-    spec = torch.stft(y, n_fft, hop_length=hop_size, win_length=win_size, window=hann_window[str(y.device)],
+    spec = torch.stft(y, n_fft, hop_length=hop_size, win_length=win_size, window=window,
                       center=center, pad_mode='reflect', normalized=False, onesided=True, return_complex=False)
     spec = torch.sqrt(spec.pow(2).sum(-1)+(1e-9))
     energy = torch.norm(spec, dim= 1)
@@ -212,13 +261,12 @@ def vtlp(y: torch.Tensor, n_fft: int, sampling_rate: int, hop_size: int, win_siz
     if torch.max(y) > 1.:
         logging.warning('max value is {}'.format(torch.max(y)))
 
-    global hann_window
-    hann_window[str(y.device)] = torch.hann_window(win_size).to(y.device)
+    window = MelExtractor.get_window(win_size, y.device)
 
     y_padded = torch.nn.functional.pad(y.unsqueeze(1), (int((n_fft-hop_size)/2), int((n_fft-hop_size)/2)), mode='reflect')
     y_padded = y_padded.squeeze(1)
 
-    spec = torch.stft(y_padded, n_fft, hop_length=hop_size, win_length=win_size, window=hann_window[str(y_padded.device)],
+    spec = torch.stft(y_padded, n_fft, hop_length=hop_size, win_length=win_size, window=window,
                       center=center, pad_mode='reflect', normalized=False, onesided=True, return_complex= True)
 
     frequency_warp = get_frequency_warp(n_fft= spec.size(1), sampling_rate= sampling_rate, alpha= alpha)
@@ -235,7 +283,7 @@ def vtlp(y: torch.Tensor, n_fft: int, sampling_rate: int, hop_size: int, win_siz
             spec_warp[:, position] += warp_down * spec[:, index]
             spec_warp[:, position + 1] += warp_up * spec[:, index]
 
-    y_warp = torch.istft(spec_warp, n_fft= n_fft, hop_length= hop_size, win_length= win_size, window=hann_window[str(y_padded.device)])
+    y_warp = torch.istft(spec_warp, n_fft= n_fft, hop_length= hop_size, win_length= win_size, window=window)
     y_warp = torch.nn.functional.pad(y_warp.unsqueeze(1), (0, y.size(1) - y_warp.size(1))).squeeze(1)
     y_warp = np.clip(y_warp, -1.0, 1.0)
 
@@ -0,0 +1,54 @@
+import os, sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Audio
+
+soundfile = pytest.importorskip('soundfile')
+
+def Decoder_Spy(monkeypatch):
+    '''
+    Records the decoders which returned audio.
+    '''
+    used_decoders = []
+    for name, decoder in list(Audio.decoder_dict.items()):
+        if decoder is None:
+            continue
+        def Spy(path, offset, duration, name= name, decoder= decoder):
+            result = decoder(path, offset, duration)
+            used_decoders.append(name)
+            return result
+        monkeypatch.setitem(Audio.decoder_dict, name, Spy)
+    monkeypatch.setattr(Audio, 'unavailable_decoder_dict', {})
+
+    return used_decoders
+
+def test_opus_decodes_by_soundfile(tmp_path, monkeypatch):
+    if not 'OPUS' in soundfile.available_subtypes('OGG').keys():
+        pytest.skip('libsndfile is built without Opus.')
+    path = str(tmp_path / 'audio.opus')
+    times = np.arange(48000) / 48000
+    soundfile.write(path, (0.5 * np.sin(2 * np.pi * 220.0 * times)).astype(np.float32), 48000, format= 'OGG', subtype= 'OPUS')
+
+    used_decoders = Decoder_Spy(monkeypatch)
+    audio = Audio.Audio_Load(path, 16000)
+
+    assert used_decoders == ['soundfile']
+    assert audio.dtype == np.float32 and abs(audio.shape[0] - 16000) <= 1
+    assert not 'soundfile' in Audio.unavailable_decoder_dict['.OPUS']
+
+def test_corrupt_file_does_not_disable_soundfile(tmp_path, monkeypatch):
+    corrupt_path = str(tmp_path / 'corrupt.wav')
+    with open(corrupt_path, 'wb') as f:
+        f.write(b'RIFF' + b'\x00' * 64)
+    path = str(tmp_path / 'audio.wav')
+    soundfile.write(path, np.zeros(16000, dtype= np.float32), 16000)
+
+    used_decoders = Decoder_Spy(monkeypatch)
+    with pytest.raises(Exception):
+        Audio.Audio_Load(corrupt_path, 16000)
+    used_decoders.clear()
+    Audio.Audio_Load(path, 16000)
+
+    assert used_decoders == ['soundfile']